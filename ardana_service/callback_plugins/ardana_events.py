@@ -0,0 +1,158 @@
+"""Ansible callback plugin that reports progress as JSON events
+
+Playbooks run by the service have this plugin enabled, and are given the
+number of a file descriptor to write events to in the ARDANA_EVENT_FD
+environment variable.  Each event is a single line of JSON with an "event"
+type and the "time" it happened:
+
+    play         a play started ("name")
+    task         a task started ("name", "role")
+    ok, changed, failed, unreachable, skipped
+                 a task finished on a host ("host", "task", "role"; failed
+                 events also have "ignored")
+    stats        the run finished, with the recap counts by host ("hosts")
+
+Names are truncated so that each event other than stats is shorter than
+PIPE_BUF, and so is written atomically even when several processes write
+events at once.
+
+The v2 callbacks are used by ansible 2.x, and the others by ansible 1.9,
+which loads every callback plugin it finds but also runs them in the
+processes running tasks.  Without ARDANA_EVENT_FD the plugin does nothing.
+"""
+from __future__ import absolute_import
+
+import fcntl
+import json
+import os
+import time
+
+try:
+    from ansible.plugins.callback import CallbackBase
+except ImportError:
+    # ansible 1.9
+    CallbackBase = object
+
+EVENT_FD_VAR = 'ARDANA_EVENT_FD'
+
+# Longest name included in an event
+MAX_NAME_SIZE = 256
+
+
+def _name(name):
+    return (name or '')[:MAX_NAME_SIZE]
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'notification'
+    CALLBACK_NAME = 'ardana_events'
+    CALLBACK_NEEDS_WHITELIST = True
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        try:
+            self.fd = int(os.environ[EVENT_FD_VAR])
+        except (KeyError, ValueError):
+            self.fd = None
+        else:
+            # Processes started by ansible (e.g. ssh ControlPersist masters)
+            # must not inherit the fd, or they would keep the pipe open, and
+            # the run unfinished, after ansible exits
+            try:
+                flags = fcntl.fcntl(self.fd, fcntl.F_GETFD)
+                fcntl.fcntl(self.fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+            except (IOError, OSError):
+                self.fd = None
+        # The task names of ansible 1.9 include their role
+        self.task = None
+        self.role = None
+
+    def _send(self, event, **fields):
+        if self.fd is None:
+            return
+        fields['event'] = event
+        fields['time'] = time.time()
+        line = (json.dumps(fields, separators=(',', ':')) + '\n').encode(
+            'utf-8')
+        try:
+            while line:
+                line = line[os.write(self.fd, line):]
+        except OSError:
+            # Nobody is listening any more
+            self.fd = None
+
+    def _task_start(self, name, role):
+        self.task = _name(name)
+        self.role = _name(role) or None
+        self._send('task', name=self.task, role=self.role)
+
+    def _host_result(self, event, host, task=None, role=None, **fields):
+        self._send(event, host=_name(host),
+                   task=self.task if task is None else _name(task),
+                   role=self.role if task is None else _name(role) or None,
+                   **fields)
+
+    # ansible 2.x
+
+    @staticmethod
+    def _task_fields(task):
+        role = task._role.get_name() if task._role else None
+        return task.get_name(), role
+
+    def _v2_result(self, event, result, **fields):
+        task, role = self._task_fields(result._task)
+        self._host_result(event, result._host.get_name(), task, role,
+                          **fields)
+
+    def v2_playbook_on_play_start(self, play):
+        self._send('play', name=_name(play.get_name()))
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._task_start(*self._task_fields(task))
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._task_start(*self._task_fields(task))
+
+    def v2_runner_on_ok(self, result):
+        changed = result._result.get('changed', False)
+        self._v2_result('changed' if changed else 'ok', result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._v2_result('failed', result, ignored=bool(ignore_errors))
+
+    def v2_runner_on_unreachable(self, result):
+        self._v2_result('unreachable', result)
+
+    def v2_runner_on_skipped(self, result):
+        self._v2_result('skipped', result)
+
+    def v2_playbook_on_stats(self, stats):
+        self.playbook_on_stats(stats)
+
+    # ansible 1.9
+
+    def playbook_on_play_start(self, name):
+        self._send('play', name=_name(name))
+
+    def playbook_on_task_start(self, name, is_conditional):
+        role, _, task = (name or '').rpartition(' | ')
+        self._task_start(task, role)
+
+    def runner_on_ok(self, host, res):
+        changed = isinstance(res, dict) and res.get('changed', False)
+        self._host_result('changed' if changed else 'ok', host)
+
+    def runner_on_failed(self, host, res, ignore_errors=False):
+        self._host_result('failed', host, ignored=bool(ignore_errors))
+
+    def runner_on_unreachable(self, host, res):
+        self._host_result('unreachable', host)
+
+    def runner_on_skipped(self, host, item=None):
+        self._host_result('skipped', host)
+
+    def playbook_on_stats(self, stats):
+        self._send('stats', hosts=dict(
+            (host, stats.summarize(host))
+            for host in sorted(stats.processed)))
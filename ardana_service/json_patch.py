@@ -0,0 +1,158 @@
+"""Apply JSON patches (RFC 6902) to json-style documents
+
+Documents are the dicts and lists produced by json or yaml parsing, and
+paths are JSON pointers (RFC 6901).
+"""
+import copy
+
+
+class PatchError(ValueError):
+    """The patch is malformed or cannot be applied to the document"""
+
+
+class PatchTestError(PatchError):
+    """A test operation of the patch did not match the document"""
+
+
+def parse_pointer(pointer):
+    if pointer == '':
+        return []
+    if not isinstance(pointer, basestring) or not pointer.startswith('/'):
+        raise PatchError("Invalid JSON pointer %r" % pointer)
+    return [t.replace('~1', '/').replace('~0', '~')
+            for t in pointer.split('/')[1:]]
+
+
+def _index(container, token, allow_end=False):
+    # Convert a pointer token to an index of the given list
+    if allow_end and token == '-':
+        return len(container)
+    if not token.isdigit() or (token != '0' and token.startswith('0')):
+        raise PatchError("Invalid list index %r" % token)
+    index = int(token)
+    limit = len(container) + 1 if allow_end else len(container)
+    if index >= limit:
+        raise PatchError("List index %d out of range" % index)
+    return index
+
+
+def _resolve(doc, tokens):
+    # Return the value referred to by the list of tokens
+    for token in tokens:
+        if isinstance(doc, dict):
+            if token not in doc:
+                raise PatchError("Member %r does not exist" % token)
+            doc = doc[token]
+        elif isinstance(doc, list):
+            doc = doc[_index(doc, token)]
+        else:
+            raise PatchError("Cannot refer into a %s" % type(doc).__name__)
+    return doc
+
+
+def _add(doc, tokens, value):
+    if not tokens:
+        return value
+
+    parent = _resolve(doc, tokens[:-1])
+    token = tokens[-1]
+    if isinstance(parent, dict):
+        parent[token] = value
+    elif isinstance(parent, list):
+        parent.insert(_index(parent, token, allow_end=True), value)
+    else:
+        raise PatchError("Cannot add to a %s" % type(parent).__name__)
+    return doc
+
+
+def _remove(doc, tokens):
+    if not tokens:
+        raise PatchError("Cannot remove the whole document")
+
+    parent = _resolve(doc, tokens[:-1])
+    token = tokens[-1]
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise PatchError("Member %r does not exist" % token)
+        return parent.pop(token)
+    elif isinstance(parent, list):
+        return parent.pop(_index(parent, token))
+    raise PatchError("Cannot remove from a %s" % type(parent).__name__)
+
+
+def apply_patch(doc, patch):
+    """Apply the list of patch operations to doc, modifying it in place
+
+    The patched document is returned, which is a different object than doc
+    only if the patch replaces the whole document.  When an error is raised,
+    doc may have been partially modified.
+    """
+    if not isinstance(patch, list):
+        raise PatchError("A patch must be a list of operations")
+
+    for operation in patch:
+        try:
+            op = operation['op']
+            path = parse_pointer(operation['path'])
+        except (TypeError, KeyError):
+            raise PatchError("Invalid operation %r" % (operation,))
+
+        if op in ('add', 'replace', 'test') and 'value' not in operation:
+            raise PatchError("Missing value in %r" % (operation,))
+        if op in ('move', 'copy'):
+            if 'from' not in operation:
+                raise PatchError("Missing from in %r" % (operation,))
+            from_path = parse_pointer(operation['from'])
+
+        if op == 'add':
+            doc = _add(doc, path, operation['value'])
+
+        elif op == 'remove':
+            _remove(doc, path)
+
+        elif op == 'replace':
+            if path:
+                _remove(doc, path)
+            doc = _add(doc, path, operation['value'])
+
+        elif op == 'move':
+            if path[:len(from_path)] == from_path and path != from_path:
+                raise PatchError("Cannot move %s into itself" %
+                                 operation['from'])
+            value = _remove(doc, from_path) if from_path else doc
+            doc = _add(doc, path, value)
+
+        elif op == 'copy':
+            value = copy.deepcopy(_resolve(doc, from_path))
+            doc = _add(doc, path, value)
+
+        elif op == 'test':
+            if _resolve(doc, path) != operation['value']:
+                raise PatchTestError("Test of %s failed" % operation['path'])
+
+        else:
+            raise PatchError("Unknown operation %r" % op)
+
+    return doc
+
+
+def patched_members(patch):
+    """Return the top-level members of the document that patch refers to
+
+    None is returned if the patch refers to the document as a whole.
+    """
+    if not isinstance(patch, list):
+        raise PatchError("A patch must be a list of operations")
+
+    members = set()
+    for operation in patch:
+        if not isinstance(operation, dict):
+            raise PatchError("Invalid operation %r" % (operation,))
+        for key in ('path', 'from'):
+            if key not in operation:
+                continue
+            tokens = parse_pointer(operation[key])
+            if not tokens:
+                return
+            members.add(tokens[0])
+    return members
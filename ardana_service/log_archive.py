@@ -0,0 +1,109 @@
+"""Compression and retention of the logs of playbook runs
+
+The logs of finished runs are compressed (see log_index.compress), and once
+the files of all runs in the log dir take up more than the size limit, those
+of the oldest runs are deleted.  Runs that are still being logged are left
+alone.  The task records of runs whose logs have been deleted are kept.
+"""
+from eventlet import tpool
+import logging
+import os
+import re
+import threading
+
+from . import log_index
+
+LOG = logging.getLogger(__name__)
+
+# Files of a run: its log, compressed log, their indexes and its profile
+RUN_FILE_RE = re.compile(r'^(\d+_\d+)\.(?:log|log\.gz|profile)(?:\.idx)?$')
+
+
+class LogArchiver(object):
+    """Manages the logs in logs_dir, keeping them below max_size bytes
+
+    is_live(id) tells whether the run with that id is still being logged.
+    If compress is false, logs are only deleted.
+    """
+
+    def __init__(self, logs_dir, max_size, is_live, compress=True):
+        self.logs_dir = logs_dir
+        self.max_size = max_size
+        self.is_live = is_live
+        self.compress = compress
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self, interval):
+        """Archive the logs every interval seconds, in the background"""
+        self._thread = threading.Thread(target=self._run, args=(interval,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self, interval):
+        while not self._stop_event.is_set():
+            try:
+                self.archive()
+            except Exception as e:
+                LOG.exception(e)
+            self._stop_event.wait(interval)
+
+    def runs(self):
+        """Return a map of the id of each run to the names of its files"""
+        runs = {}
+        for filename in os.listdir(self.logs_dir):
+            match = RUN_FILE_RE.match(filename)
+            if match:
+                runs.setdefault(match.group(1), []).append(filename)
+        return runs
+
+    def archive(self):
+        if self.compress:
+            for id, filenames in self.runs().items():
+                if id + '.log' in filenames and not self.is_live(id):
+                    logfile = os.path.join(self.logs_dir, id + '.log')
+                    try:
+                        # Compression takes a while, and must not hold up
+                        # everything else
+                        tpool.execute(log_index.compress, logfile)
+                    except Exception as e:
+                        LOG.warning("Unable to compress %s: %s", logfile, e)
+        self.evict()
+
+    def evict(self):
+        """Delete the files of the oldest finished runs beyond max_size"""
+        runs = self.runs()
+        sizes = {}
+        total = 0
+        for id, filenames in runs.items():
+            size = 0
+            mtime = None
+            for filename in filenames:
+                try:
+                    st = os.stat(os.path.join(self.logs_dir, filename))
+                except OSError:
+                    continue
+                size += st.st_size
+                mtime = max(mtime, st.st_mtime)
+            sizes[id] = (mtime, size)
+            total += size
+
+        if total <= self.max_size:
+            return
+
+        # Oldest first
+        for id in sorted(sizes, key=lambda id: sizes[id]):
+            if total <= self.max_size:
+                break
+            if self.is_live(id):
+                continue
+            LOG.info("Deleting the logs of task %s", id)
+            for filename in runs[id]:
+                try:
+                    os.unlink(os.path.join(self.logs_dir, filename))
+                except OSError as e:
+                    LOG.warning("Unable to delete %s: %s", filename, e)
+            total -= sizes[id][1]
@@ -0,0 +1,191 @@
+"""Sparse index of the lines of a log file, for reading lines without a scan
+
+Every INTERVAL lines, the offset at which the next line starts is appended
+to a sidecar file (the log's name plus .idx) as a 64-bit integer.  Line N is
+then found by seeking to the offset of line N // INTERVAL * INTERVAL and
+skipping fewer than INTERVAL lines, however large the log is.
+
+The index is written alongside the log by IndexWriter; logs without one
+(e.g. written by an older version) are indexed on first use.
+
+Logs are compressed by compress, into a gzip file (the log's name plus .gz)
+made of one gzip member for every INTERVAL lines.  Its index has the same
+format, but holds the offset of each member in the compressed file, so that
+lines are found in the same way, decompressing fewer than INTERVAL lines
+before the first one wanted.
+"""
+import contextlib
+import gzip
+import itertools
+import logging
+import os
+import struct
+import uuid
+
+LOG = logging.getLogger(__name__)
+
+INTERVAL = 1000
+
+ENTRY = struct.Struct('<Q')
+
+
+def index_file(logfile):
+    return logfile + '.idx'
+
+
+def compressed_file(logfile):
+    return logfile + '.gz'
+
+
+def is_compressed(logfile):
+    return logfile.endswith('.gz')
+
+
+@contextlib.contextmanager
+def open_log(logfile, offset=0):
+    """Open the log (compressed or not) for reading, starting at offset
+
+    The offset of a compressed log must be that of one of its members.
+    """
+    with open(logfile, 'rb') as f:
+        f.seek(offset)
+        if is_compressed(logfile):
+            # GzipFile reads the members that follow the one at offset
+            f = gzip.GzipFile(fileobj=f, mode='rb')
+        try:
+            yield f
+        finally:
+            f.close()
+
+
+class IndexWriter(object):
+    """Appends to the index of a log as data is appended to the log"""
+
+    def __init__(self, f):
+        self.f = f
+        self.interval = INTERVAL
+        self.lines = 0
+        self.offset = 0
+
+    def add(self, data):
+        newlines = data.count(b'\n')
+        if self.lines % self.interval + newlines < self.interval:
+            # No line in data starts a new interval
+            self.lines += newlines
+        else:
+            pos = data.find(b'\n')
+            while pos >= 0:
+                self.lines += 1
+                if self.lines % self.interval == 0:
+                    self.f.write(ENTRY.pack(self.offset + pos + 1))
+                pos = data.find(b'\n', pos + 1)
+            self.f.flush()
+        self.offset += len(data)
+
+
+def build_index(logfile):
+    """Write the index of an existing (complete) log"""
+    filename = index_file(logfile)
+    temp_file = '%s.%s.tmp' % (filename, uuid.uuid4().hex)
+    LOG.info("Indexing %s", logfile)
+    try:
+        with open(logfile, 'rb') as log, open(temp_file, 'wb') as f:
+            writer = IndexWriter(f)
+            for data in iter(lambda: log.read(1024 * 1024), b''):
+                writer.add(data)
+        os.rename(temp_file, filename)
+    except Exception:
+        try:
+            os.unlink(temp_file)
+        except OSError:
+            pass
+        raise
+
+
+def read_index(logfile):
+    """Return the offsets of lines 0, INTERVAL, 2 * INTERVAL, ..."""
+    filename = index_file(logfile)
+    if not os.path.exists(filename):
+        if is_compressed(logfile):
+            # The index is written with the compressed log, and without it
+            # the log can still be read from the start
+            LOG.warning("No index of %s", logfile)
+            return [0]
+        build_index(logfile)
+
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    # Ignore an entry that is still being written
+    count = len(data) // ENTRY.size
+    return [0] + list(struct.unpack('<%dQ' % count,
+                                    data[:count * ENTRY.size]))
+
+
+def read_lines(logfile, start, count=None, index=None):
+    """Return up to count lines of the log, starting from line start"""
+    if index is None:
+        index = read_index(logfile)
+    entry = min(start // INTERVAL, len(index) - 1)
+
+    with open_log(logfile, index[entry]) as f:
+        skip = start - entry * INTERVAL
+        stop = None if count is None else skip + count
+        return list(itertools.islice(f, skip, stop))
+
+
+def tail(logfile, count):
+    """Return the last count lines of the log, and the number of the first
+
+    A final line without a newline (e.g. one that is still being written)
+    counts as a line.
+    """
+    index = read_index(logfile)
+    with open_log(logfile, index[-1]) as f:
+        total = (len(index) - 1) * INTERVAL + sum(1 for _ in f)
+
+    start = max(0, total - count)
+    return read_lines(logfile, start, count, index), start
+
+
+def compress(logfile):
+    """Replace a (complete) log and its index with compressed versions"""
+    gzfile = compressed_file(logfile)
+    suffix = '.%s.tmp' % uuid.uuid4().hex
+    temp_files = [gzfile + suffix, index_file(gzfile) + suffix]
+    LOG.info("Compressing %s", logfile)
+    try:
+        with open(logfile, 'rb') as log, \
+                open(temp_files[0], 'wb') as out, \
+                open(temp_files[1], 'wb') as index:
+            while True:
+                lines = list(itertools.islice(log, INTERVAL))
+                if not lines:
+                    break
+                if out.tell():
+                    index.write(ENTRY.pack(out.tell()))
+                # Each member has to be complete, so that reading can start
+                # from it
+                member = gzip.GzipFile(filename='', mode='wb', fileobj=out,
+                                       mtime=0)
+                member.write(b''.join(lines))
+                member.close()
+
+        # The index is in place before the log, since the log without it
+        # is still usable
+        os.rename(temp_files[1], index_file(gzfile))
+        os.rename(temp_files[0], gzfile)
+    except Exception:
+        for temp_file in temp_files:
+            try:
+                os.unlink(temp_file)
+            except OSError:
+                pass
+        raise
+
+    for filename in (logfile, index_file(logfile)):
+        try:
+            os.unlink(filename)
+        except OSError:
+            pass
+    return gzfile
@@ -1,18 +1,35 @@
 import collections
 import copy
+import eventlet
+from eventlet import tpool
 from flask import abort
 from flask import Blueprint
+from flask import current_app
 from flask import jsonify
 from flask import request
+from flask import Response
+import hashlib
+import json
 import logging
 import os
 import random
+import shutil
+import threading
+import uuid
 import yaml
+import zlib
 
+from . import json_patch
+from . import single_flight
+from . import watcher
+from . import yaml_backend
 import config.config as config
 
 LOG = logging.getLogger(__name__)
 
+# The threading module as it was before eventlet monkey patched it
+native_threading = eventlet.patcher.original('threading')
+
 MODEL_DIR = config.get_dir("model_dir")
 
 CLOUD_CONFIG = "cloudConfig.yml"
@@ -27,26 +44,241 @@ ADDED = 'added'
 
 PASS_THROUGH = 'pass-through'
 
+# Maximum number of files that are written concurrently
+WRITE_WORKERS = config.get('model', 'write_workers')
+
+# Maximum number of files that are parsed concurrently
+READ_WORKERS = config.get('model', 'read_workers')
+
+# Compress json responses for clients that accept gzip
+GZIP_RESPONSES = config.get('model', 'gzip_responses')
+
+# Approximate size of the chunks in which json responses are sent
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class ParseCache(object):
+    """Size-bounded LRU cache of parsed yaml documents
+
+    Entries are keyed by file path and are only reused while the file's
+    (mtime, size, inode) stamp is unchanged, so an edited or replaced file is
+    always parsed again.  Callers link the returned documents into models
+    that may later be modified, so each caller gets its own deep copy.
+
+    The top-level section names of each parsed file are also remembered
+    (even after its document has been evicted), so that readers interested
+    in only some sections can skip files that cannot contain them.
+
+    The content_digest of each parsed file is also remembered, so that
+    writes can tell whether a file that has not changed since it was parsed
+    would be changed by new contents, without reading it again.
+
+    Loads are normally run in native threads (see load_docs), so the lock is
+    a native one rather than the green lock that monkey patching provides.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._sections = {}
+        self._digests = {}
+        self._lock = native_threading.Lock()
+
+    @staticmethod
+    def _stamp(st):
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def load(self, path):
+        with open(path) as f:
+            stamp = self._stamp(os.fstat(f.fileno()))
+
+            with self._lock:
+                entry = self._entries.pop(path, None)
+                if entry is not None and entry[0] == stamp:
+                    # Re-insert to mark as most recently used
+                    self._entries[path] = entry
+                    self.hits += 1
+                    return copy.deepcopy(entry[1])
+                self.misses += 1
+
+            content = f.read()
+
+        doc = yaml_backend.load(content)
+        digest = content_digest(doc)
+
+        with self._lock:
+            self._entries[path] = (stamp, doc)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._sections[path] = \
+                (stamp, list(doc.keys()) if isinstance(doc, dict) else [])
+            self._digests[path] = (stamp, digest)
+
+        return copy.deepcopy(doc)
+
+    def sections(self, path):
+        """Return the section names in path, or None if not known
+
+        The names are only known if the file has been parsed and not changed
+        since then.
+        """
+        try:
+            stamp = self._stamp(os.stat(path))
+        except OSError:
+            return
+
+        entry = self._sections.get(path)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+
+    def digest(self, path):
+        """Return the content_digest of path, or None if not known
+
+        The digest is only known if the file has been parsed and not changed
+        since then (and if its document has a digest at all).
+        """
+        try:
+            stamp = self._stamp(os.stat(path))
+        except OSError:
+            return
+
+        entry = self._digests.get(path)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sections.clear()
+            self._digests.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxSize': self.max_size}
+
+
+def content_digest(doc):
+    """Return a digest of the document that is independent of its formatting
+
+    Documents that cannot be represented as json (e.g. those containing
+    dates) have no digest, and None is returned.
+    """
+    try:
+        canonical = json.dumps(doc, sort_keys=True, separators=(',', ':'))
+    except (TypeError, ValueError):
+        return
+    return hashlib.sha1(canonical).hexdigest()
+
+
+parse_cache = ParseCache(config.get('model', 'parse_cache_size'))
+
+# Concurrent reads of the same model directory share a single read
+model_reads = single_flight.SingleFlight('model read')
+
 
-@bp.route("/api/v2/model", methods=['GET', 'POST'])
+@bp.route("/api/v2/model", methods=['GET', 'POST', 'PATCH'])
 def model():
     if request.method == 'GET':
+        sections = get_sections_arg()
         try:
-            return jsonify(read_model(MODEL_DIR))
+            if sections:
+                return etag_response(
+                    sections_etag(get_model_etag(), sections),
+                    lambda: get_model(sections))
+            return etag_response(get_model_etag(), get_model)
         except Exception as e:
             LOG.exception(e)
             abort(500)
 
+    elif request.method == 'PATCH':
+        return patch_model(request.get_json())
+
     else:
         model = request.get_json() or {}
         try:
-            write_model(model, MODEL_DIR)
+            written_files = write_model(model, MODEL_DIR)
         except Exception as e:
             LOG.exception(e)
             abort(500)
+
+        # Apply the changes now rather than waiting for the watcher, so that
+        # a subsequent read sees them
+        if live_model:
+            live_model.apply_changes(set(written_files))
+
         return 'Success'
 
 
+def patch_model(patch):
+    """Apply a JSON patch (RFC 6902) of the inputModel
+
+    Only the sections that the patch refers to are copied and patched, and
+    only the files holding those sections are written.
+    """
+    try:
+        sections = json_patch.patched_members(patch)
+    except json_patch.PatchError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        model = get_model()
+    except Exception as e:
+        LOG.exception(e)
+        abort(500)
+
+    if 'inputModel' not in model:
+        abort(404)
+
+    input_model = model['inputModel']
+    if sections is None:
+        sections = set(input_model.keys())
+
+    patched = {k: copy.deepcopy(v) for k, v in input_model.iteritems()
+               if k in sections}
+    try:
+        patched = json_patch.apply_patch(patched, patch)
+    except json_patch.PatchTestError as e:
+        return jsonify({'error': str(e)}), 409
+    except json_patch.PatchError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not isinstance(patched, dict):
+        return jsonify({'error': 'inputModel must be an object'}), 400
+
+    # Sections may have been added (or removed) by the patch
+    sections.update(patched.keys())
+
+    partial = partial_model(model, sections)
+    for section_name in sections:
+        if section_name in patched:
+            partial['inputModel'][section_name] = patched[section_name]
+        else:
+            partial['inputModel'].pop(section_name, None)
+
+    try:
+        written_files = write_model(partial, MODEL_DIR, partial=True)
+    except Exception as e:
+        LOG.exception(e)
+        abort(500)
+
+    if live_model:
+        live_model.apply_changes(set(written_files))
+
+    return 'Success'
+
+
+@bp.route("/api/v2/model/stats", methods=['GET'])
+def get_stats():
+    return jsonify({'parseCache': parse_cache.stats(),
+                    'modelReads': model_reads.stats()})
+
+
 @bp.route("/api/v2/model/is_encrypted", methods=['GET'])
 def get_encrypted():
     return jsonify({"isEncrypted": False})
@@ -54,20 +286,221 @@ def get_encrypted():
 
 @bp.route("/api/v2/model/entities", methods=['GET'])
 def get_all_entities():
-    return 'Success'
+    try:
+        return jsonify(sorted(get_model().get('inputModel', {}).keys()))
+    except Exception as e:
+        LOG.exception(e)
+        abort(500)
 
 
 @bp.route("/api/v2/model/entities/<entity>", methods=['GET', 'POST', 'PUT'])
 def whole_entity(entity):
+    if request.method == 'GET':
+        try:
+            input_model = get_model([entity]).get('inputModel', {})
+        except Exception as e:
+            LOG.exception(e)
+            abort(500)
+
+        if entity not in input_model:
+            abort(404)
+        return jsonify(input_model[entity])
+
+    data = request.get_json()
+    if data is None:
+        abort(400)
+
+    try:
+        model = read_model(MODEL_DIR)
+    except Exception as e:
+        LOG.exception(e)
+        abort(500)
+
+    if request.method == 'POST':
+        # Add a single entry to a (possibly new) list section
+        if not isinstance(data, dict):
+            abort(400)
+        items = model['inputModel'].setdefault(entity, [])
+        key_field = get_key_field(data)
+        if not isinstance(items, list) or not key_field:
+            abort(400)
+        if (entity, '%s' % data[key_field]) in get_entity_index(entity):
+            abort(409)
+        items.append(data)
+    else:
+        # A list section must remain a list of entries
+        if isinstance(model['inputModel'].get(entity), list) or \
+                isinstance(data, list):
+            if not isinstance(data, list) or \
+                    not all(get_key_field(e) for e in data):
+                abort(400)
+        model['inputModel'][entity] = data
+
+    try:
+        written_files = write_model(model, MODEL_DIR)
+    except Exception as e:
+        LOG.exception(e)
+        abort(500)
+
+    if live_model:
+        live_model.apply_changes(set(written_files))
+
     return 'Success'
 
 
 @bp.route("/api/v2/model/entities/<entity>/<id>",
           methods=['DELETE', 'GET', 'PUT'])
 def entry(entity, id):
+    index = get_entity_index(entity)
+    try:
+        item, filename = index[(entity, id)]
+    except KeyError:
+        abort(404)
+
+    if request.method == 'GET':
+        return jsonify(item)
+
+    if request.method == 'PUT':
+        data = request.get_json()
+        # The entry must keep its key field, and may only be renamed to an
+        # id that is not already taken
+        key_field = get_key_field(item)
+        if not isinstance(data, dict) or key_field not in data:
+            abort(400)
+        new_id = '%s' % data[key_field]
+        if new_id != id and (entity, new_id) in index:
+            abort(409)
+    else:
+        data = None
+
+    try:
+        write_entity(MODEL_DIR, filename, entity, id, data)
+    except KeyError:
+        abort(404)
+    except Exception as e:
+        LOG.exception(e)
+        abort(500)
+
+    if live_model:
+        live_model.apply_changes({filename})
+
     return 'Success'
 
 
+def etag_response(etag, get_data):
+    """Return get_data() as json, or 304 if the client already has it
+
+    get_data is only called when the client's If-None-Match does not match
+    etag, so unchanged data is neither read nor serialized
+    """
+    gzip = accepts_gzip()
+    if etag and gzip:
+        # The compressed representation needs an etag of its own
+        etag += '-gzip'
+
+    if etag and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.vary.add('Accept-Encoding')
+    else:
+        response = json_response(get_data(), gzip)
+
+    if etag:
+        response.set_etag(etag)
+    return response
+
+
+def accepts_gzip():
+    return GZIP_RESPONSES and request.accept_encodings['gzip'] > 0
+
+
+def json_response(data, gzip=False):
+    """Return a response that serializes data as json while it is sent
+
+    The output is the same as that of jsonify (without pretty printing), but
+    the members of the top-level object and of the objects within it (e.g.
+    the sections of the inputModel) are serialized one at a time, so the
+    whole document is never held in memory as a single string, and the first
+    bytes are sent without waiting for the rest to be serialized.
+    """
+    encoder = current_app.json_encoder(
+        ensure_ascii=current_app.config['JSON_AS_ASCII'],
+        sort_keys=current_app.config['JSON_SORT_KEYS'],
+        separators=(',', ':'))
+
+    chunks = join_chunks(iter_json(data, encoder, 2))
+    if gzip:
+        chunks = gzip_chunks(chunks)
+
+    response = Response(chunks, mimetype='application/json')
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def iter_json(data, encoder, depth):
+    # Yield the json of data in pieces, one for each member of the objects
+    # that are less than depth levels deep
+    if depth and isinstance(data, dict) and \
+            all(isinstance(k, basestring) for k in data):
+        keys = sorted(data) if encoder.sort_keys else data.keys()
+        yield '{'
+        for i, key in enumerate(keys):
+            yield '%s%s:' % (',' if i else '', encoder.encode(key))
+            for piece in iter_json(data[key], encoder, depth - 1):
+                yield piece
+        yield '}'
+    else:
+        yield encoder.encode(data)
+
+
+def join_chunks(pieces):
+    # Combine pieces of json into utf-8 encoded chunks of a reasonable size
+    chunk = []
+    size = 0
+    for piece in pieces:
+        if isinstance(piece, unicode):
+            piece = piece.encode('utf-8')
+        chunk.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    chunk.append('\n')
+    yield ''.join(chunk)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def get_sections_arg():
+    # Parse the sections query parameter, e.g. ?sections=servers,disk-models
+    sections = request.args.get('sections', '')
+    return [s.strip() for s in sections.split(',') if s.strip()]
+
+
+def sections_etag(etag, sections):
+    if etag:
+        return hashlib.sha1(
+            '%s\0%s' % (etag, ','.join(sorted(sections)))).hexdigest()
+
+
+def get_section_name(section):
+    # Return the section name from an entry in fileInfo / fileSectionMap,
+    # which is either the name itself or a dict describing an array or
+    # pass-through section
+    if isinstance(section, basestring):
+        return section
+    return [k for k in section.keys() if k not in ('type', 'keyField')][0]
+
+
 def get_key_field(obj):
 
     # Several kinds of ids are used in the input model:
@@ -76,51 +509,331 @@ def get_key_field(obj):
     #     node_name   : used for baremetalConfig.yml
     #     name        : all others
     # Figure out which one is populated and return it
-    if obj:
+    if isinstance(obj, dict):
         for key in ('name', 'id', 'region-name', 'node_name'):
             if key in obj:
                 return key
 
 
-def read_model(model_dir):
+def partial_model(model, sections):
+    """Return the part of model that is needed to write the given sections
+
+    This includes all files that hold any of the sections, and since those
+    files must be written in their entirety, all other sections in those
+    files (and in turn all files that hold those sections).  The product
+    section is always included, but does not pull in more files unless it
+    was one of the given sections.
+    """
+    file_info = model['fileInfo']
+
+    sections = set(sections)
+    files = set()
+    pending = set(sections)
+    while pending:
+        for filename in file_info['sections'].get(pending.pop(), []):
+            if filename in files:
+                continue
+            files.add(filename)
+            for entry in file_info['fileSectionMap'].get(filename, []):
+                section_name = get_section_name(entry)
+                if section_name not in sections and section_name != 'product':
+                    sections.add(section_name)
+                    pending.add(section_name)
+    sections.add('product')
+
+    partial = dict(model)
+    partial['fileInfo'] = dict(file_info)
+    partial['fileInfo']['files'] = [f for f in file_info['files']
+                                    if f in files]
+    partial['fileInfo']['sections'] = {
+        k: [f for f in v if f in files]
+        for k, v in file_info['sections'].iteritems() if k in sections}
+    partial['fileInfo']['fileSectionMap'] = {
+        k: v for k, v in file_info['fileSectionMap'].iteritems()
+        if k in files}
+    partial['inputModel'] = {k: v for k, v in model['inputModel'].iteritems()
+                             if k in sections}
+    return partial
+
+
+def build_entity_index(model):
+    """Index the entries of every list section of the model
+
+    Returns a dict mapping (section, id) to (entry, filename), where id is
+    the value of the section's key field (as a string, since that is how it
+    arrives in URLs) and filename is the file that the entry was read from,
+    according to fileInfo / fileSectionMap
+    """
+    key_fields = {}
+    owners = {}
+    for filename, sections in model['fileInfo']['fileSectionMap'].iteritems():
+        for section in sections:
+            if isinstance(section, dict) and section.get('type') == 'array':
+                section_name = get_section_name(section)
+                key_fields.setdefault(section_name, section.get('keyField'))
+                for id in section[section_name]:
+                    # As in plan_write, the first file that lists it wins
+                    owners.setdefault((section_name, '%s' % id), filename)
+
+    index = {}
+    for section_name, items in model['inputModel'].iteritems():
+        if not isinstance(items, list):
+            continue
+
+        key_field = key_fields.get(section_name)
+        for item in items:
+            if not key_field or key_field not in item:
+                continue
+            key = (section_name, '%s' % item[key_field])
+            index[key] = (item, owners.get(key))
+
+    return index
+
+
+def get_entity_index(section_name):
+    if live_model:
+        return live_model.entity_index()
+    model = read_model(MODEL_DIR, [section_name])
+    if 'inputModel' not in model:
+        return {}
+    return build_entity_index(model)
+
+
+def write_entity(model_dir, filename, section_name, id, item):
+    """Replace one entry of a list section in the file that holds it
+
+    If item is None, the entry is removed instead, along with the file itself
+    if nothing else remains in it.  Only the one file is read and written.
+    """
+    filepath = os.path.join(model_dir, filename)
+    doc = parse_cache.load(filepath)
+
+    items = doc.get(section_name) or []
+    key_field = get_key_field(items[0]) if items else None
+    for i, existing in enumerate(items):
+        if '%s' % existing.get(key_field) == id:
+            break
+    else:
+        raise KeyError(id)
+
+    if item is None:
+        del items[i]
+        if not items:
+            doc.pop(section_name)
+    else:
+        items[i] = item
+
+    if [k for k in doc.keys() if k != 'product']:
+        return write_file(model_dir, filename, doc, False)
+
+    LOG.info("Deleting emptied file %s", filepath)
+    os.unlink(filepath)
+    return DELETED
+
+
+def read_model(model_dir, sections=None):
     """Reads the input model directory structure into a big dictionary
 
     Reads all of the yaml files from the given directory and loads them into a
     single giant dictionary.  The dictionary includes tracking information to
     capture where each entry was loaded, so that the object can be written back
     out to the appropriate files
+
+    If a list of sections is given, only those sections of the input model
+    (and their fileInfo) are returned, and files that are known not to
+    contain any of them are not read.
     """
 
     # First read and process the top-level cloud config file
+    cloud_config_doc = load_cloud_config(model_dir)
+
+    if not cloud_config_doc:
+        return empty_model()
+
+    # Now read all yml files in the dir tree below
+    yml_files, readme_files = list_model_files(model_dir)
+    if sections:
+        wanted = set(sections)
+        yml_files = [relname for relname in yml_files
+                     if may_contain(model_dir, relname, wanted)]
+
+    docs = load_docs(model_dir, yml_files)
+    readmes = [(relname, read_readme(model_dir, relname))
+               for relname in readme_files]
+
+    model = assemble_model(model_dir, cloud_config_doc, docs, readmes)
+    if sections:
+        model = filter_model(model, sections)
+    return model
+
+
+def read_model_shared(model_dir, sections=None):
+    """Return read_model(model_dir, sections), sharing concurrent reads
+
+    Callers that ask for the same sections of the same, unchanged, model
+    while it is being read wait for that read instead of starting another.
+    The model returned may be shared, and must not be modified.
+    """
+    # The fingerprint is part of the key so that a caller never gets a read
+    # that started before a change it may already have seen (e.g. in an etag)
+    key = (model_dir, model_fingerprint(model_dir),
+           tuple(sorted(sections)) if sections else None)
+    return model_reads.do(key, read_model, model_dir, sections)
+
+
+def may_contain(model_dir, relname, sections):
+    known = parse_cache.sections(os.path.join(model_dir, relname))
+    return known is None or not sections.isdisjoint(known)
+
+
+def filter_model(model, sections):
+    """Return a copy of model with only the given input model sections
+
+    fileInfo is reduced to the files that contain those sections, and its
+    fileSectionMap to the entries for those sections.  The section contents
+    are shared with the given model.
+    """
+    if 'inputModel' not in model:
+        return model
+
+    wanted = set(sections)
+    file_info = model['fileInfo']
+
+    section_files = {k: v for k, v in file_info['sections'].iteritems()
+                     if k in wanted}
+    files = set(f for filenames in section_files.values() for f in filenames)
+
+    file_section_map = {}
+    for filename in files:
+        file_section_map[filename] = [
+            s for s in file_info['fileSectionMap'].get(filename, [])
+            if get_section_name(s) in wanted]
+
+    filtered = dict(model)
+    filtered['fileInfo'] = dict(file_info)
+    filtered['fileInfo']['files'] = [f for f in file_info['files']
+                                     if f in files]
+    filtered['fileInfo']['sections'] = section_files
+    filtered['fileInfo']['fileSectionMap'] = file_section_map
+    filtered['inputModel'] = {k: v for k, v in model['inputModel'].iteritems()
+                              if k in wanted}
+    return filtered
+
+
+def model_fingerprint(model_dir):
+    """Return a validator that changes whenever any file of the model does
+
+    Only the file names and stat info are used, so no files are read.  None
+    is returned if the model dir has no cloud config.
+    """
+    if not os.path.exists(os.path.join(model_dir, CLOUD_CONFIG)):
+        return
+
+    yml_files, readme_files = list_model_files(model_dir)
+
+    digest = hashlib.sha1()
+    for relname in [CLOUD_CONFIG] + sorted(yml_files + readme_files):
+        try:
+            st = os.stat(os.path.join(model_dir, relname))
+        except OSError:
+            continue
+        digest.update('%s\0%r\0%d\0' % (relname, st.st_mtime, st.st_size))
+
+    return digest.hexdigest()
+
+
+def empty_model():
+    return {'name': None,
+            'version': None,
+            'readme': {},
+            'fileInfo': {},
+            'errors': [],
+            }
+
+
+def load_cloud_config(model_dir):
     cloud_config_file = os.path.join(model_dir, CLOUD_CONFIG)
+    try:
+        return tpool.execute(parse_cache.load, cloud_config_file)
+    except yaml.YAMLError:
+        LOG.exception("Invalid yaml file")
+        raise
+    except IOError:
+        LOG.exception("Unable to read yaml file")
+        raise
+
+
+def list_model_files(model_dir):
+    """Return the yml and README files below model_dir, in walk order
+
+    The top-level cloud config file is not included since it is always
+    processed first
+    """
+    yml_files = []
+    readme_files = []
+    for root, dirs, files in os.walk(model_dir):
+        for file in files:
+            # avoid processing top-level cloud config again
+            if file == CLOUD_CONFIG:
+                continue
+
+            relname = os.path.relpath(os.path.join(root, file), model_dir)
+            if file.endswith('.yml'):
+                yml_files.append(relname)
+            elif file.startswith('README'):
+                readme_files.append(relname)
+
+    return yml_files, readme_files
+
 
-    model = {'name': None,
-             'version': None,
-             'readme': {},
-             'fileInfo': {},
-             'errors': [],
-             }
+def load_docs(model_dir, relnames):
+    """Return a list of (relname, doc) for the given files, in the same order
 
-    with open(cloud_config_file) as f:
+    Parsing yaml is CPU bound and would otherwise stall the eventlet hub, and
+    with it every socket.io stream, for as long as a large model takes to
+    read.  So the files are parsed concurrently in native threads, and the
+    results collected in the order the files were given.
+    """
+    pool = eventlet.GreenPool(READ_WORKERS)
+    threads = [pool.spawn(tpool.execute, parse_cache.load,
+                          os.path.join(model_dir, relname))
+               for relname in relnames]
+
+    docs = []
+    for relname, thread in zip(relnames, threads):
+        # Invalid files are still listed in the model, but contribute no
+        # content
+        doc = None
         try:
-            doc = yaml.safe_load(f)
+            doc = thread.wait()
         except yaml.YAMLError:
             LOG.exception("Invalid yaml file")
-            raise
-        except IOError:
-            LOG.exception("Unable to read yaml file")
-            raise
+        docs.append((relname, doc))
+    return docs
 
-    if not doc:
-        return model
+
+def read_readme(model_dir, relname):
+    with open(os.path.join(model_dir, relname)) as f:
+        lines = f.readlines()
+    return ''.join(lines)
+
+
+def assemble_model(model_dir, cloud_config_doc, docs, readmes):
+    """Build the model from documents that have already been loaded
+
+    docs is a list of (relname, doc) for each yml file other than the cloud
+    config, and readmes is a list of (relname, text) for each README file.
+    """
+    cloud_config_file = os.path.join(model_dir, CLOUD_CONFIG)
+    model = empty_model()
 
     try:
-        model['version'] = doc['product']['version']
+        model['version'] = cloud_config_doc['product']['version']
     except KeyError:
         raise 'Missing cloud config product version'
 
     try:
-        model['name'] = doc['cloud']['name']
+        model['name'] = cloud_config_doc['cloud']['name']
     except KeyError:
         raise 'Cloud config error: no name specified'
 
@@ -136,31 +849,16 @@ def read_model(model_dir):
     }
     model['inputModel'] = {}
 
-    add_doc_to_model(model, doc, relname)
+    add_doc_to_model(model, cloud_config_doc, relname)
 
-    # Now read and process all yml files in the dir tree below
-    for root, dirs, files in os.walk(model_dir):
-        for file in files:
-            # avoid processing top-level cloud config again
-            if file == CLOUD_CONFIG:
-                continue
-
-            relname = os.path.relpath(os.path.join(root, file), model_dir)
-            filename = os.path.join(root, file)
-            if file.endswith('.yml'):
-                model['fileInfo']['files'].append(relname)
-                with open(filename) as f:
-                    try:
-                        doc = yaml.safe_load(f)
-                        add_doc_to_model(model, doc, relname)
-                    except yaml.YAMLError:
-                        LOG.exception("Invalid yaml file")
+    for relname, doc in docs:
+        model['fileInfo']['files'].append(relname)
+        if doc:
+            add_doc_to_model(model, doc, relname)
 
-            elif file.startswith('README'):
-                ext = file[7:]
-                with open(filename) as f:
-                    lines = f.readlines()
-                model['readme'][ext] = ''.join(lines)
+    for relname, text in readmes:
+        ext = os.path.basename(relname)[7:]
+        model['readme'][ext] = text
 
     # Update metadata related to pass-through, if necessary
     update_pass_through(model)
@@ -234,16 +932,209 @@ def update_pass_through(model):
                 break
 
 
+class LiveModel(object):
+    """Input model kept resident in memory
+
+    The model directory is read once, and from then on only the files that
+    are reported as changed (normally by a watcher) are re-read and applied
+    to the in-memory model.  The model returned by get() is shared by all
+    callers and must not be modified.
+    """
+
+    def __init__(self, model_dir):
+        self.model_dir = model_dir
+        self._lock = threading.Lock()
+        self._cloud_config_doc = None
+        self._yml_files = []
+        self._readme_files = []
+        self._docs = {}
+        self._readmes = {}
+        self._model = None
+        self._fingerprint = None
+        self._entity_index = None
+        self._watcher = None
+
+    def start(self, interval):
+        # Watch first, so that the model is kept up to date even if it
+        # cannot be read yet (e.g. the model dir does not exist)
+        self._watcher = watcher.start_watcher(self.model_dir,
+                                              self.apply_changes,
+                                              interval)
+        self.reload()
+
+    def stop(self):
+        if self._watcher:
+            self._watcher.stop()
+            self._watcher = None
+
+    def get(self):
+        with self._lock:
+            if self._model is None:
+                self._reload()
+            return self._model
+
+    def entity_index(self):
+        """Return the build_entity_index of the current model"""
+        with self._lock:
+            if self._model is None:
+                self._reload()
+            if self._entity_index is None:
+                self._entity_index = build_entity_index(self._model) \
+                    if 'inputModel' in self._model else {}
+            return self._entity_index
+
+    def fingerprint(self):
+        """Return the model_fingerprint of the files in the current model"""
+        with self._lock:
+            if self._model is None:
+                self._reload()
+            return self._fingerprint
+
+    def yml_files(self):
+        """Return the yml files in the model dir, other than the cloud config
+
+        None is returned unless the model has been read and the watcher is
+        keeping the list up to date, in which case the model dir must be
+        walked instead.
+        """
+        with self._lock:
+            if self._model is None or self._watcher is None:
+                return None
+            return list(self._yml_files)
+
+    def reload(self):
+        with self._lock:
+            self._reload()
+
+    def _reload(self):
+        # Take the fingerprint before reading, so that the files that are
+        # read are never older than the fingerprint claims, but only keep it
+        # once the model has been rebuilt from them
+        fingerprint = model_fingerprint(self.model_dir)
+        self._cloud_config_doc = load_cloud_config(self.model_dir)
+        self._yml_files, self._readme_files = \
+            list_model_files(self.model_dir)
+        self._docs = dict(load_docs(self.model_dir, self._yml_files))
+        self._readmes = {relname: read_readme(self.model_dir, relname)
+                         for relname in self._readme_files}
+        self._rebuild()
+        self._fingerprint = fingerprint
+
+    def apply_changes(self, changed):
+        """Re-read the given files (relative to model_dir) into the model
+
+        A changed value of None causes the whole directory to be re-read.
+        """
+        with self._lock:
+            try:
+                if changed is None or CLOUD_CONFIG in changed:
+                    self._reload()
+                    return
+
+                # Ignore editor swap files and the like
+                changed = [relname for relname in changed
+                           if relname.endswith('.yml') or
+                           os.path.basename(relname).startswith('README')]
+                if not changed:
+                    return
+
+                fingerprint = model_fingerprint(self.model_dir)
+
+                known = set(self._yml_files) | set(self._readme_files)
+                if any(relname not in known or not os.path.exists(
+                        os.path.join(self.model_dir, relname))
+                       for relname in changed):
+                    # Files were added or removed, so the file list (and
+                    # therefore the order in which they are applied) changes
+                    self._yml_files, self._readme_files = \
+                        list_model_files(self.model_dir)
+                    self._docs = {k: v for k, v in self._docs.iteritems()
+                                  if k in self._yml_files}
+                    self._readmes = {k: v for k, v in self._readmes.iteritems()
+                                     if k in self._readme_files}
+
+                self._docs.update(load_docs(
+                    self.model_dir,
+                    [r for r in changed if r in self._yml_files]))
+                for relname in changed:
+                    if relname in self._readme_files:
+                        self._readmes[relname] = read_readme(self.model_dir,
+                                                             relname)
+
+                self._rebuild()
+                self._fingerprint = fingerprint
+
+            except Exception as e:
+                # Keep serving the previous model, since the files may be
+                # in the middle of being rewritten.  A subsequent change will
+                # trigger another attempt
+                LOG.exception(e)
+
+    def _rebuild(self):
+        self._entity_index = None
+        if not self._cloud_config_doc:
+            self._model = empty_model()
+            return
+
+        docs = [(relname, self._docs.get(relname))
+                for relname in self._yml_files]
+        readmes = [(relname, self._readmes[relname])
+                   for relname in self._readme_files]
+        self._model = assemble_model(self.model_dir, self._cloud_config_doc,
+                                     docs, readmes)
+
+
+# Resident model for MODEL_DIR, when enabled via start_live_model
+live_model = None
+
+
+def start_live_model():
+    global live_model
+
+    if not config.get('model', 'live_model'):
+        return
+
+    live_model = LiveModel(MODEL_DIR)
+    try:
+        live_model.start(config.get('model', 'watch_interval'))
+    except Exception as e:
+        # The model can still be read on demand
+        LOG.exception(e)
+
+
+def get_model(sections=None):
+    if live_model:
+        model = live_model.get()
+        return filter_model(model, sections) if sections else model
+    return read_model_shared(MODEL_DIR, sections)
+
+
+def get_model_etag():
+    # This should be called before get_model, so that the model returned is
+    # at least as new as the etag
+    if live_model:
+        return live_model.fingerprint()
+    return model_fingerprint(MODEL_DIR)
+
+
 #
 # Functions to write the model
 #
 
 # This function is long and should be modularized
-def write_model(in_model, model_dir, dry_run=False):  # noqa: C901
+def write_model(in_model, model_dir, dry_run=False,  # noqa: C901
+                partial=False):
+    """Write the model back out to the files in model_dir
+
+    If partial is set, the model only describes some of the files in the
+    model dir (see partial_model), and only those files are candidates for
+    removal
+    """
 
-    # Create a deep copy of the model to avoid munging the model that was
-    # passed in
-    model = copy.deepcopy(in_model)
+    # Sections and pass-through keys are removed from the model as they are
+    # written.  Rather than deep copying the model to avoid munging the one
+    # that was passed in, copy just the containers that are modified
+    model = copy_for_write(in_model)
 
     # Keep track of what was written, by creating a dict with this format:
     #    filename: {
@@ -255,6 +1146,13 @@ def write_model(in_model, model_dir, dry_run=False):  # noqa: C901
     # is lingering in the model dir and that needs to be removed
     written_files = {}
 
+    # Work out up front where each entry of the list sections goes
+    plan = plan_write(model)
+
+    # Files that need to be written, which are all committed together once
+    # their contents are known
+    pending = {}
+
     # Write portion of input model that correspond to existing files
     file_section_map = model['fileInfo']['fileSectionMap']
     for filename, sections in file_section_map.iteritems():
@@ -295,8 +1193,7 @@ def write_model(in_model, model_dir, dry_run=False):  # noqa: C901
                 #   }
 
                 section_type = section['type']
-                section_name = [k for k in section.keys()
-                                if k not in ('type', 'keyField')][0]
+                section_name = get_section_name(section)
 
                 # Skip the remaining processing if the entire section has been
                 # removed
@@ -305,7 +1202,7 @@ def write_model(in_model, model_dir, dry_run=False):  # noqa: C901
 
                 if section_type == 'array':
 
-                    if len(model['fileInfo']['sections'][section_name]) == 1:
+                    if section_name not in plan['spread']:
                         # This section of the input model is contained in a
                         # single file, so write out all members of this section
                         new_content[section_name] = \
@@ -314,23 +1211,11 @@ def write_model(in_model, model_dir, dry_run=False):  # noqa: C901
                     else:
                         # This section of the input model is contained in a
                         # several files.  Write out just the portions that
-                        # belong in this file
-
-                        # Get the list of ids for this file
-                        our_ids = section[section_name]
-                        key_field = section.get('keyField')
-
-                        for model_item in model['inputModel'][section_name]:
-                            id = model_item.get(key_field)
-                            if id in our_ids:
-                                if section_name not in new_content:
-                                    new_content[section_name] = []
-                                new_content[section_name].append(model_item)
-
-                        # Remove these from the model
-                        model['inputModel'][section_name] = \
-                            [k for k in model['inputModel'][section_name]
-                             if k[key_field] not in our_ids]
+                        # the plan assigned to this file
+                        items = plan['files'].get(filename, {}).get(
+                            section_name)
+                        if items:
+                            new_content[section_name] = items
 
                 else:
                     inputPassThru = model['inputModel'].get(PASS_THROUGH)
@@ -379,9 +1264,15 @@ def write_model(in_model, model_dir, dry_run=False):  # noqa: C901
 
         real_keys = [k for k in new_content.keys() if k != 'product']
         if real_keys:
-            status = write_file(model_dir, filename, new_content, dry_run)
+            status = queue_file(pending, model_dir, filename, new_content)
             written_files[filename] = {'data': new_content, 'status': status}
 
+    # Only the entries that were not assigned to any file remain in the
+    # sections that are spread over several files
+    for section_name, leftovers in plan['leftovers'].iteritems():
+        if section_name in model['inputModel']:
+            model['inputModel'][section_name] = leftovers
+
     # Write portion of input model that remain -- these have not been written
     # to any file
     for section_name, contents in model['inputModel'].iteritems():
@@ -402,27 +1293,27 @@ def write_model(in_model, model_dir, dry_run=False):  # noqa: C901
             filename = basename + '.yml'
 
             data[section_name] = contents
-            status = write_file(model_dir, filename, data, dry_run)
+            status = queue_file(pending, model_dir, filename, data)
             written_files[filename] = {'data': data, 'status': status}
 
         elif isinstance(contents, list):
 
-            key_field = get_section_key_field(model, section_name)
-            if is_split_into_equal_number_of_files(model, section_name):
+            key_field = plan['key_fields'].get(section_name)
+            if section_name not in plan['not_split_evenly']:
                 # each entry in the list should be written to a separate file,
                 # so create new files for each section
                 for elt in contents:
                     data[section_name] = [elt]
 
                     filename = "%s_%s.yml" % (basename, elt[key_field])
-                    status = write_file(model_dir, filename, data, dry_run)
+                    status = queue_file(pending, model_dir, filename, data)
                     written_files[filename] = {'data': data, 'status': status}
             else:
                 # place all elements of the list into a single file
                 data[section_name] = contents
                 filename = "%s_%s.yml" % (basename,
                                           contents[0][key_field])
-                status = write_file(model_dir, filename, data, dry_run)
+                status = queue_file(pending, model_dir, filename, data)
                 written_files[filename] = {'data': data, 'status': status}
         else:
             # Not a list, so therefore it must be pass-through data that did
@@ -432,101 +1323,310 @@ def write_model(in_model, model_dir, dry_run=False):  # noqa: C901
             filename = "%s_%s.yml" % (basename,
                                       '%4x' % random.randrange(2 ** 32))
 
-            status = write_file(model_dir, filename, data, dry_run)
+            status = queue_file(pending, model_dir, filename, data)
             written_files[filename] = {'data': data, 'status': status}
 
-    # Remove any existing files in the output directory that are obsolete
-    removed = remove_obsolete_files(model_dir, written_files.keys(), dry_run)
+    if not dry_run:
+        commit_files(model_dir, pending)
+
+    # Remove any existing files in the output directory that are obsolete.
+    # The live model already knows which files there are, so the model dir
+    # is only walked if there is no (current) live model
+    if partial:
+        candidates = model['fileInfo']['files']
+    elif live_model and live_model.model_dir == model_dir:
+        candidates = live_model.yml_files()
+    else:
+        candidates = None
+    removed = remove_obsolete_files(model_dir, written_files.keys(), dry_run,
+                                    candidates)
     for filename in removed:
         written_files[filename] = {'data': None, 'status': DELETED}
 
     return written_files
 
 
-def is_split_into_equal_number_of_files(model, section_name):
+def copy_for_write(model):
+    """Return a copy of model that write_model is free to modify
 
-    # Count the entries in the fileSectionMap that contain only one
-    # instance of the given section
+    write_model only removes top-level sections of the input model, replaces
+    the contents of list sections, and removes keys from the pass-through
+    section and the dicts nested within it.  Only those containers are
+    copied, and everything else is shared with the given model.
+    """
+    input_model = dict(model['inputModel'])
 
-    file_section_map = model['fileInfo']['fileSectionMap']
-    for sections in file_section_map.values():
-        for section in sections:
-            if isinstance(section, dict) and section_name in section:
-                id_list = section[section_name]
-                if len(id_list) != 1:
-                    return
+    pass_through = input_model.get(PASS_THROUGH)
+    if isinstance(pass_through, dict):
+        input_model[PASS_THROUGH] = {
+            k: dict(v) if isinstance(v, dict) else v
+            for k, v in pass_through.iteritems()}
 
-    return True
+    model = dict(model)
+    model['inputModel'] = input_model
+    return model
 
 
-def get_section_key_field(model, section_name):
+def plan_write(model):
+    """Work out which file each entry of the list sections belongs in
+
+    This makes a single pass over fileSectionMap and a single pass over the
+    entries of each list section that is spread over several files, and
+    returns a dict with:
+
+        spread           : set of list sections that are spread over several
+                           files
+        files            : {filename: {section: [entries]}} giving the
+                           entries of the spread sections that belong in
+                           each file.  An entry belongs in the first file (in
+                           fileSectionMap order) that lists its id
+        leftovers        : {section: [entries]} giving the entries of the
+                           spread sections that do not belong in any file
+        key_fields       : {section: key field}
+        not_split_evenly : set of sections that have a file with anything
+                           other than a single entry
+    """
+    file_info = model['fileInfo']
+    input_model = model['inputModel']
+
+    plan = {'spread': set(),
+            'files': collections.defaultdict(dict),
+            'leftovers': {},
+            'key_fields': {},
+            'not_split_evenly': set(),
+            }
 
-    # Find a file that contains the given section and get its key field
-    file_section_map = model['fileInfo']['fileSectionMap']
-    for filename, sections in file_section_map.iteritems():
+    # Map each section's (key field, id) to the first (position, filename)
+    # that lists it
+    owners = collections.defaultdict(dict)
+    for position, (filename, sections) in enumerate(
+            file_info['fileSectionMap'].iteritems()):
         for section in sections:
-            try:
-                if section_name in section:
-                    return section['keyField']
-            except (TypeError, KeyError, AttributeError):
-                pass
+            if not isinstance(section, dict):
+                continue
+
+            section_name = get_section_name(section)
+            if 'keyField' in section:
+                plan['key_fields'].setdefault(section_name,
+                                              section['keyField'])
+            if len(section[section_name]) != 1:
+                plan['not_split_evenly'].add(section_name)
+
+            if section['type'] != 'array' or \
+                    len(file_info['sections'].get(section_name, [])) == 1:
+                continue
+
+            plan['spread'].add(section_name)
+            section_owners = owners[section_name]
+            key_field = section.get('keyField')
+            for id in section[section_name]:
+                section_owners.setdefault((key_field, id), (position,
+                                                            filename))
+
+    for section_name, section_owners in owners.iteritems():
+        items = input_model.get(section_name)
+        if not isinstance(items, list):
+            continue
+
+        key_fields = set(k for k, id in section_owners)
+        leftovers = []
+        for item in items:
+            owner = None
+            for key_field in key_fields:
+                try:
+                    candidate = section_owners.get((key_field,
+                                                    item.get(key_field)))
+                except TypeError:
+                    # Unhashable id, which cannot have come from a file
+                    candidate = None
+                if candidate and (owner is None or candidate < owner):
+                    owner = candidate
+
+            if owner:
+                plan['files'][owner[1]].setdefault(section_name,
+                                                   []).append(item)
+            else:
+                leftovers.append(item)
+
+        plan['leftovers'][section_name] = leftovers
+
+    return plan
 
 
 def write_file(model_dir, filename, new_content, dry_run):
 
+    pending = {}
+    status = queue_file(pending, model_dir, filename, new_content)
+    if pending and not dry_run:
+        commit_files(model_dir, pending)
+    return status
+
+
+def queue_file(pending, model_dir, filename, new_content):
+    """Add the file to pending if its contents need to be written
+
+    Returns an indication of whether the file would be written (vs ignored)
+    """
+    if not in_model_dir(model_dir, filename):
+        raise ValueError("%s is outside of %s" % (filename, model_dir))
+    status = file_status(model_dir, filename, new_content)
+    if status != IGNORED:
+        # Take a copy since callers may reuse the dict for other files
+        pending[filename] = dict(new_content)
+    return status
+
+
+def file_status(model_dir, filename, new_content):
+
     filepath = os.path.join(model_dir, filename)
 
-    parent_dir = os.path.dirname(filepath)
-    if not os.access(parent_dir, os.R_OK):
-        if not dry_run:
-            os.makedirs(parent_dir)
+    # If the file is unchanged since it was parsed, compare digests of the
+    # contents rather than reading and parsing it again
+    old_digest = parse_cache.digest(filepath)
 
     old_content = {}
     existed = False
-    try:
-        if os.access(filepath, os.R_OK):
-            existed = True
-            with open(filepath) as f:
-                old_content = yaml.safe_load(f)
-    except yaml.YAMLError:
-        LOG.exception("Invalid yaml file %s", filepath)
-    except IOError as e:
-        LOG.error(e)
+    if old_digest is not None:
+        existed = True
+        unchanged = content_digest(new_content) == old_digest
+    else:
+        try:
+            if os.access(filepath, os.R_OK):
+                existed = True
+                with open(filepath) as f:
+                    old_content = yaml_backend.load(f)
+        except yaml.YAMLError:
+            LOG.exception("Invalid yaml file %s", filepath)
+        except IOError as e:
+            LOG.error(e)
+        unchanged = new_content == old_content
 
     # Avoid writing the file if the contents have not changes.  This preserves
     # any comments that may exist in the old file
-    if new_content == old_content:
+    if unchanged:
         LOG.info("Ignoring unchanged file %s", filename)
         return IGNORED
-    else:
-        LOG.info("Writing file %s", filename)
-        if not dry_run:
-            with open(filepath, "w") as f:
-                yaml.safe_dump(new_content, f,
-                               indent=2,
-                               default_flow_style=False,
-                               canonical=False)
 
     # Return an indication of whether a file was written (vs ignored)
     status = CHANGED if existed else ADDED
     return status
 
 
-def remove_obsolete_files(model_dir, keepers, dry_run):
+def commit_files(model_dir, contents):
+    """Write all of the given files, or none of them
+
+    contents maps filenames (relative to model_dir) to the data to write.
+    Each file is first dumped to a temporary file alongside it and fsynced,
+    in parallel using native threads so that slow (e.g. networked) storage
+    does not hold up the service.  Only once every file has been staged
+    successfully are they all renamed into place, followed by an fsync of
+    each affected directory.
+    """
+    pool = eventlet.GreenPool(WRITE_WORKERS)
+    threads = [pool.spawn(tpool.execute, stage_file, model_dir, filename,
+                          content)
+               for filename, content in sorted(contents.iteritems())]
+
+    staged = []
+    error = None
+    for thread in threads:
+        try:
+            staged.append(thread.wait())
+        except Exception as e:
+            LOG.exception(e)
+            error = error or e
+
+    if error:
+        for filepath, temp_path in staged:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+        raise error
+
+    for filepath, temp_path in staged:
+        LOG.info("Writing file %s", filepath)
+        os.rename(temp_path, filepath)
+
+    for directory in set(os.path.dirname(f) for f, t in staged):
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def stage_file(model_dir, filename, content):
+    """Dump content to a temporary file next to filename, and fsync it
+
+    Returns the path of the file and of its temporary
+    """
+    filepath = os.path.join(model_dir, filename)
+
+    parent_dir = os.path.dirname(filepath)
+    try:
+        os.makedirs(parent_dir)
+    except OSError:
+        if not os.path.isdir(parent_dir):
+            raise
+
+    # The name does not end in .yml so that it is never read as part of the
+    # model
+    temp_path = os.path.join(parent_dir, '.%s.%s.tmp' % (
+        os.path.basename(filepath), uuid.uuid4().hex))
+    try:
+        with open(temp_path, "w") as f:
+            yaml_backend.dump(content, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Keep the permissions of the file being replaced
+        if os.path.exists(filepath):
+            shutil.copymode(filepath, temp_path)
+    except Exception:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+    return filepath, temp_path
+
+
+def in_model_dir(model_dir, relname):
+    """Return whether relname (e.g. from a client) names a file in model_dir"""
+    model_dir = os.path.realpath(model_dir)
+    path = os.path.realpath(os.path.join(model_dir, relname))
+    return path.startswith(model_dir + os.sep)
+
+
+def remove_obsolete_files(model_dir, keepers, dry_run, candidates=None):
 
     # Report which files were deleted
     removed = []
 
+    # Only the given candidates are considered for removal, or all files in
+    # the model dir if there are none
+    if candidates is None:
+        candidates = []
+        for root, dirs, files in os.walk(model_dir):
+            for file in files:
+                candidates.append(
+                    os.path.relpath(os.path.join(root, file), model_dir))
+
     # Remove any yml files that are no longer relevant, i.e. not in keepers
-    for root, dirs, files in os.walk(model_dir):
-        for file in files:
-            fullname = os.path.join(root, file)
-            relname = os.path.relpath(fullname, model_dir)
-            if file.endswith('.yml'):
-                if relname not in keepers:
-                    LOG.info("Deleting obsolete file %s", fullname)
-                    if not dry_run:
-                        os.unlink(fullname)
-                    removed.append(relname)
+    for relname in candidates:
+        fullname = os.path.join(model_dir, relname)
+        if not in_model_dir(model_dir, relname):
+            LOG.warning("Not deleting %s, which is outside of %s", relname,
+                        model_dir)
+            continue
+        if relname.endswith('.yml') and relname not in keepers:
+            if not os.path.exists(fullname):
+                continue
+            LOG.info("Deleting obsolete file %s", fullname)
+            if not dry_run:
+                os.unlink(fullname)
+            removed.append(relname)
 
     return removed
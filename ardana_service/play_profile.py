@@ -0,0 +1,129 @@
+"""Where the time of a playbook run goes, by ansible task, role and host
+
+A PlayProfile is fed the events written by the ardana_events callback plugin
+as they arrive, and keeps running totals, so a profile of a run is
+available at any point without reading its log.
+
+The time of a task is from its start until the start of the next task (or
+play, or the end of the run).  The time of a role is the total time of its
+tasks, and the time of a host is the total time between the start of each
+task and its result on that host.
+"""
+import json
+import os
+import time
+import uuid
+
+# Host result events
+RESULTS = ('ok', 'changed', 'failed', 'unreachable', 'skipped')
+
+
+class PlayProfile(object):
+
+    def __init__(self):
+        self.start_time = None
+        self.end_time = None
+        # Totals by (role, task name), role and host
+        self._tasks = {}
+        self._roles = {}
+        self._hosts = {}
+        # Key and start time of the running task
+        self._current = None
+        self._current_start = None
+        # Start times of the tasks that have started, by key
+        self._starts = {}
+
+    def add(self, event):
+        kind = event.get('event')
+        now = event.get('time')
+        if not isinstance(now, (int, float)):
+            return
+        if self.start_time is None:
+            self.start_time = now
+
+        if kind in ('play', 'stats'):
+            self._end_task(now)
+            if kind == 'stats':
+                self.end_time = now
+        elif kind == 'task':
+            self._end_task(now)
+            key = (event.get('role'), event.get('name'))
+            self._current = key
+            self._current_start = now
+            self._starts[key] = now
+            self._total(self._tasks, key)['count'] += 1
+        elif kind in RESULTS:
+            key = (event.get('role'), event.get('task'))
+            start = self._starts.get(key)
+            host = self._total(self._hosts, event.get('host'))
+            host['results'] += 1
+            if start is not None:
+                host['time'] += max(0, now - start)
+
+    def _total(self, totals, key):
+        total = totals.get(key)
+        if total is None:
+            total = totals[key] = {'time': 0, 'count': 0, 'results': 0}
+        return total
+
+    def _end_task(self, now):
+        if self._current is None:
+            return
+        elapsed = max(0, now - self._current_start)
+        self._tasks[self._current]['time'] += elapsed
+        self._total(self._roles, self._current[0])['time'] += elapsed
+        self._current = None
+
+    def summary(self, now=None):
+        """Return the totals, longest first, as a JSON serializable dict
+
+        The time that the running task (if any) has taken so far, up to now
+        (default the current time), is included in its totals.
+        """
+        if now is None:
+            now = time.time()
+
+        tasks = dict((key, dict(total)) for key, total in self._tasks.items())
+        roles = dict((key, dict(total)) for key, total in self._roles.items())
+        current = None
+        if self._current is not None:
+            elapsed = max(0, now - self._current_start)
+            tasks[self._current]['time'] += elapsed
+            roles.setdefault(self._current[0], {'time': 0})
+            roles[self._current[0]]['time'] += elapsed
+            current = {'role': self._current[0], 'name': self._current[1],
+                       'time': elapsed}
+
+        def longest(totals):
+            return sorted(totals, key=lambda total: -total['time'])
+
+        end = self.end_time or now
+        return {
+            'elapsed': end - self.start_time if self.start_time else 0,
+            'finished': self.end_time is not None,
+            'current': current,
+            'tasks': longest({'role': role, 'name': name,
+                              'time': total['time'],
+                              'count': total['count']}
+                             for (role, name), total in tasks.items()),
+            'roles': longest({'name': role, 'time': total['time']}
+                             for role, total in roles.items()
+                             if role is not None),
+            'hosts': longest({'name': host, 'time': total['time'],
+                              'results': total['results']}
+                             for host, total in self._hosts.items()),
+        }
+
+    def save(self, filename):
+        """Write the summary to filename, replacing it atomically"""
+        temp_file = '%s.%s.tmp' % (filename, uuid.uuid4().hex)
+        try:
+            with open(temp_file, 'w') as f:
+                json.dump(self.summary(), f)
+            os.rename(temp_file, filename)
+        except Exception:
+            try:
+                os.unlink(temp_file)
+            except OSError:
+                pass
+            raise
@@ -0,0 +1,112 @@
+"""The outcome of a playbook run, extracted from its output as it streams
+
+A PlaySummary is fed each line of ansible-playbook's stdout and keeps track
+of which tasks failed on which hosts, which hosts were unreachable, and the
+counts in the PLAY RECAP at the end.  Lines that cannot be of interest are
+rejected on their first character, so following even very large logs costs
+little.
+
+Both the ansible 2.x and 1.9 output formats are understood.
+"""
+import re
+
+# Maximum number of failures kept
+MAX_FAILURES = 100
+
+ANSI_RE = re.compile(r'\x1b\[[0-9;]*m')
+
+# TASK [role : name] ***, TASK: [role | name] ***, RUNNING HANDLER [name] ***
+TASK_RE = re.compile(r'(?:TASK|RUNNING HANDLER):? \[(.*)\] \**$')
+
+# fatal: [host]: FAILED! => ..., failed: [host] (item=x) => ...,
+# fatal: [host]: UNREACHABLE! => ...
+RESULT_RE = re.compile(r'(?:fatal|failed): \[([^\]]+)\](.*)')
+
+# host : ok=1 changed=0 unreachable=0 failed=0
+RECAP_RE = re.compile(r'(\S+)\s+:\s+((?:[a-z]+=\d+\s*)+)$')
+
+# First characters of the lines that are parsed, including that of colored
+# lines
+FIRST_CHARS = frozenset('TRPf.\x1b')
+
+
+class PlaySummary(object):
+
+    def __init__(self):
+        self.task = None
+        # List of {'host', 'task'} in the order they failed
+        self.failures = []
+        self.unreachable = []
+        # Map of host to its recap counts
+        self.recap = {}
+        self._failed = set()
+        self._in_recap = False
+
+    def feed(self, line):
+        """Parse a line, returning whether failures or unreachable changed"""
+        if self._in_recap:
+            return self._feed_recap(line)
+        if not line or line[0] not in FIRST_CHARS:
+            return False
+
+        line = ANSI_RE.sub('', line.rstrip())
+        if line.startswith('PLAY RECAP'):
+            self._in_recap = True
+            return False
+
+        match = TASK_RE.match(line)
+        if match:
+            self.task = match.group(1)
+            return False
+
+        match = RESULT_RE.match(line)
+        if match:
+            host = match.group(1)
+            if 'UNREACHABLE!' in match.group(2):
+                return self._add_unreachable(host)
+            return self._add_failure(host)
+
+        if line.startswith('...ignoring') and self.failures:
+            # The last failure was ignored
+            failure = self.failures.pop()
+            self._failed.discard((failure['host'], failure['task']))
+            return True
+        return False
+
+    def _add_failure(self, host):
+        key = (host, self.task)
+        if key in self._failed or len(self.failures) >= MAX_FAILURES:
+            return False
+        self._failed.add(key)
+        self.failures.append({'host': host, 'task': self.task})
+        return True
+
+    def _add_unreachable(self, host):
+        if host in self.unreachable:
+            return False
+        self.unreachable.append(host)
+        return True
+
+    def _feed_recap(self, line):
+        line = ANSI_RE.sub('', line).strip()
+        if not line:
+            return False
+        match = RECAP_RE.match(line)
+        if not match:
+            # Whatever follows the recap, e.g. the output of another plugin
+            self._in_recap = False
+            return self.feed(line)
+
+        host = match.group(1)
+        self.recap[host] = dict((name, int(count)) for name, count in
+                                (item.split('=')
+                                 for item in match.group(2).split()))
+        if self.recap[host].get('unreachable'):
+            return self._add_unreachable(host)
+        return False
+
+    def fields(self):
+        """Return the summary as task fields"""
+        return {'failures': list(self.failures),
+                'unreachable': list(self.unreachable),
+                'recap': dict(self.recap) or None}
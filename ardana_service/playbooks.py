@@ -1,19 +1,33 @@
+import collections
+import eventlet
+import fcntl
 from flask import abort
 from flask import Blueprint
 from flask import jsonify
 from flask import request
+from flask import Response
+from flask import safe_join
 from flask import send_from_directory
 from flask import url_for
 from flask_socketio import emit
 from flask_socketio import join_room
+import heapq
+import itertools
+import json
 import logging
 import os
 import re
+import select
 import subprocess
 import threading
 import time
 
+from . import log_archive
+from . import log_index
+from . import play_profile
+from . import play_summary
 from . import socketio
+from . import task_registry
 import config.config as config
 
 LOG = logging.getLogger(__name__)
@@ -23,8 +37,176 @@ bp = Blueprint('playbooks', __name__)
 PLAYBOOKS_DIR = config.get_dir("playbooks_dir")
 LOGS_DIR = config.get_dir("log_dir")
 
-# Dictionary of all running tasks
-tasks = {}
+# Limits on the age (seconds) and size (bytes) of a batch of output lines
+LOG_BATCH_INTERVAL = config.get('playbooks', 'log_batch_interval')
+LOG_BATCH_SIZE = config.get('playbooks', 'log_batch_size')
+
+# Bytes of recent output kept in memory for replay to joining clients
+REPLAY_BUFFER_SIZE = config.get('playbooks', 'replay_buffer_size')
+
+# Number of log lines returned by default, and at most, by line requests
+LOG_LINES_DEFAULT = config.get('playbooks', 'log_lines_default')
+LOG_LINES_MAX = config.get('playbooks', 'log_lines_max')
+
+# Limit on the total size of the logs of playbook runs
+ARCHIVE_THRESHOLD_MB = config.get('general', 'archiveThresholdMb')
+
+# Output streams of a process
+STDOUT = 'stdout'
+STDERR = 'stderr'
+EVENTS = 'events'
+
+# Ansible callback plugin that writes JSON progress events to the file
+# descriptor given in EVENT_FD_VAR
+CALLBACK_PLUGINS_DIR = os.path.join(os.path.dirname(__file__),
+                                    'callback_plugins')
+CALLBACK_PLUGIN = 'ardana_events'
+EVENT_FD_VAR = 'ARDANA_EVENT_FD'
+
+# Maximum number of bytes read from a pipe at once
+READ_SIZE = 64 * 1024
+
+# Task states
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+
+# All tasks, whether queued, running or finished
+registry = task_registry.TaskRegistry(config.get_dir("tasks_db"))
+
+# LogBatchers of the running tasks, by task id
+live_logs = {}
+
+# PlayProfiles of the running tasks that have an events pipe, by task id
+live_profiles = {}
+
+
+class Scheduler(object):
+    """Starts playbook processes, running at most max_running at a time
+
+    Further runs are queued, and are started as running ones finish, highest
+    priority first and otherwise in the order they were submitted.  A run
+    with the same command line (and working dir) as one that is already
+    queued or running is not started again; the existing task is returned
+    instead.
+
+    The output of each started process is handed to reader, and the process
+    is considered finished once the reader reports that it has exited.
+    Besides stdout and stderr, each process is given a pipe for events,
+    whose file descriptor is passed in the EVENT_FD_VAR environment
+    variable.
+    """
+
+    def __init__(self, max_running, reader):
+        self.max_running = max_running
+        self.reader = reader
+        self._queue = []
+        self._running = set()
+        # Map of command line to the id of its queued or running task
+        self._active = {}
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, cmd_args, cwd=None, env=None, priority=0,
+               client_id=None):
+        """Queue a command, returning its task id and whether it is new"""
+        key = (tuple(cmd_args), cwd)
+        with self._lock:
+            id = self._active.get(key)
+            if id is not None:
+                LOG.info("Not starting duplicate of task %s", id)
+                return id, False
+
+            queue_time = int(1000 * time.time())
+            id = "%d_%d" % (queue_time, next(self._ids))
+            registry.add({'id': id,
+                          'status': QUEUED,
+                          'command': list(cmd_args),
+                          'priority': priority,
+                          'client_id': client_id,
+                          'queue_time': queue_time})
+            self._active[key] = id
+            heapq.heappush(self._queue,
+                           (-priority, next(self._seq), id, key, env))
+
+            self._start_queued()
+        return id, True
+
+    def queued(self):
+        """Return the ids of the queued tasks, in the order they will run"""
+        with self._lock:
+            return [entry[2] for entry in sorted(self._queue)]
+
+    def _start_queued(self):
+        while self._queue and len(self._running) < self.max_running:
+            _, _, id, key, env = heapq.heappop(self._queue)
+            cmd_args, cwd = key
+            events_r, events_w = os.pipe()
+            # Neither end is inherited by other processes, which would keep
+            # the pipe open after this process exits
+            set_cloexec(events_r, True)
+            set_cloexec(events_w, True)
+            env = dict(os.environ if env is None else env)
+            env[EVENT_FD_VAR] = str(events_w)
+            try:
+                ps = subprocess.Popen(
+                    cmd_args, cwd=cwd, env=env,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    preexec_fn=lambda: set_cloexec(events_w, False))
+            except OSError as e:
+                LOG.error("Unable to start task %s: %s", id, e)
+                os.close(events_r)
+                del self._active[key]
+                registry.update(id, status=FAILED, error=str(e),
+                                end_time=int(1000 * time.time()))
+                continue
+
+            finally:
+                os.close(events_w)
+
+            registry.update(id, status=RUNNING, pid=ps.pid,
+                            start_time=int(1000 * time.time()))
+            try:
+                self.reader.add(ps, id, lambda returncode, id=id, key=key:
+                                self._finished(id, key, returncode),
+                                os.fdopen(events_r, 'rb'))
+            except Exception as e:
+                # Without a reader the process could block on a full pipe
+                LOG.exception(e)
+                ps.kill()
+                ps.wait()
+                del self._active[key]
+                registry.update(id, status=FAILED, error=str(e),
+                                end_time=int(1000 * time.time()))
+                continue
+
+            self._running.add(id)
+
+    def _finished(self, id, key, returncode):
+        with self._lock:
+            self._running.discard(id)
+            del self._active[key]
+            try:
+                log_size = os.path.getsize(get_log_file(id))
+            except OSError:
+                log_size = None
+            registry.update(id,
+                            status=COMPLETE if returncode == 0 else FAILED,
+                            code=returncode,
+                            log_size=log_size,
+                            end_time=int(1000 * time.time()))
+            self._start_queued()
+
+
+def set_cloexec(fd, cloexec):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    if cloexec:
+        flags |= fcntl.FD_CLOEXEC
+    else:
+        flags &= ~fcntl.FD_CLOEXEC
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags)
 
 
 @bp.route("/api/v2/playbooks")
@@ -104,8 +286,12 @@ def run_playbook(name):
 
     If the http header "clientid" is supplied, it will be passed as
     a command-line argument named ClientId.
+
+    The optional priority query parameter (an integer, default 0) orders
+    the run among others that are waiting to start; higher runs first.
     """
     opts = request.get_json() or {}
+    priority = request.args.get('priority', 0, type=int)
 
     client_id = request.headers.get('clientid')   # TODO(gary) Remove "hlm"
 
@@ -119,7 +305,8 @@ def run_playbook(name):
         return run_ready_deployment(opts, client_id)
     elif name == "blather":
         temp_name = os.path.join(os.curdir, 'blather')
-        return spawn_process(temp_name)
+        return spawn_process(temp_name, priority=priority,
+                             client_id=client_id)
     else:
         try:
             name += ".yml"
@@ -130,7 +317,8 @@ def run_playbook(name):
                 abort(404)
 
             playbook_name = os.path.join(PLAYBOOKS_DIR, name)
-            return spawn_process('ansible-playbook', [playbook_name])
+            return spawn_process('ansible-playbook', [playbook_name],
+                                 priority=priority, client_id=client_id)
 
         except OSError:
             LOG.warning("Playbooks directory %s doesn't exist. This could "
@@ -141,42 +329,441 @@ def run_playbook(name):
     return jsonify(opts)
 
 
-# TODO(gary): support (and require), maxSize parameter
 @bp.route("/api/v2/plays/<id>/log")
 def get_log(id):
-    # For security, send_from_directory avoids sending any files
-    # outside of the specified directory
-    return send_from_directory(LOGS_DIR, id + ".log")
+    """Return the log of a play, or some of its lines
+
+    With no parameters the whole log is returned, and byte ranges can be
+    requested with the standard Range header.  ?tail=N returns the last N
+    lines, and ?offset=N&limit=M returns M lines starting from line N
+    (numbered from 0), by default LOG_LINES_DEFAULT of them.  At most
+    LOG_LINES_MAX lines are returned at once.  For line requests, the number
+    of the first line returned is given in the X-Log-Line-Offset header.
+    """
+    tail = get_count_arg('tail')
+    offset = get_count_arg('offset')
+    limit = get_count_arg('limit')
+    if max(tail, limit) > LOG_LINES_MAX:
+        abort(400)
+
+    # safe_join refuses paths outside of LOGS_DIR
+    logfile = find_log_file(safe_join(LOGS_DIR, id + ".log"))
+    if logfile is None:
+        abort(404)
+
+    if tail is None and offset is None and limit is None:
+        if not log_index.is_compressed(logfile):
+            # For security, send_from_directory likewise avoids sending any
+            # files outside of the specified directory
+            return send_from_directory(LOGS_DIR, id + ".log")
+        return compressed_log_response(id, logfile)
+
+    if tail is not None:
+        lines, first = log_index.tail(logfile, tail)
+    else:
+        first = offset or 0
+        lines = log_index.read_lines(
+            logfile, first, LOG_LINES_DEFAULT if limit is None else limit)
+
+    return Response(b''.join(lines), mimetype='text/plain',
+                    headers={'X-Log-Line-Offset': str(first)})
+
+
+def get_count_arg(name):
+    # Return the non-negative integer query parameter, or None if not given
+    value = request.args.get(name)
+    if value is None:
+        return
+    if not value.isdigit():
+        abort(400)
+    return int(value)
+
+
+def find_log_file(logfile):
+    # Return the name of the log or of its compressed version, whichever
+    # exists, or None
+    for filename in (logfile, log_index.compressed_file(logfile)):
+        if os.path.exists(filename):
+            return filename
+
+
+def compressed_log_response(id, logfile):
+    """Return a compressed log, decompressing it if the client can't"""
+    if request.accept_encodings['gzip'] > 0:
+        response = send_from_directory(
+            LOGS_DIR, os.path.basename(logfile), mimetype='text/plain')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        def generate():
+            with log_index.open_log(logfile) as f:
+                for data in iter(lambda: f.read(READ_SIZE), b''):
+                    yield data
+
+        response = Response(generate(), mimetype='text/plain')
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 def get_log_file(id):
     return os.path.join(LOGS_DIR, id + ".log")
 
 
-def process_output(ps, id):
+@bp.route("/api/v2/plays/<id>/profile")
+def get_profile(id):
+    """Return the time taken by each ansible task, role and host of a play
+
+    Each list is ordered longest first.  While the play is running, the
+    profile is of the play so far.
+    """
+    profile = live_profiles.get(id)
+    if profile is not None:
+        return jsonify(profile.summary())
+
+    return send_from_directory(LOGS_DIR, id + ".profile",
+                               mimetype='application/json')
+
+
+def get_profile_file(id):
+    return os.path.join(LOGS_DIR, id + ".profile")
 
-    with open(get_log_file(id), 'w') as f:
-        with ps.stdout:
-            # Can use this in python3: for line in ps.stdout:
-            # Using iter() per https://stackoverflow.com/a/17698359/190597
-            for line in iter(ps.stdout.readline, b''):
-                # python 2 returns bytes that must be converted to a string
-                if isinstance(line, bytes):
-                    line = line.decode("utf-8")
 
-                f.write(line)
-                f.flush()
-                msg = id + " " + line
-                socketio.emit("log", msg, room=id)
+def send_log(id, send, start=0, end=None):
+    """Call send(text) with the log between the start and end offsets
 
-    socketio.close_room(id)
-    ps.wait()
+    The log is sent in pieces of about READ_SIZE bytes that end at the end
+    of a line, yielding to other green threads between them, so that a
+    large log is neither held in memory nor holds up everything else.
+    Returns the offset up to which the log was sent, which is start if
+    there is no log (yet).
+    """
+    logfile = find_log_file(get_log_file(id))
+    if logfile is None:
+        return start
 
-    # TODO(gary): Need to read from stdout AND stderr
-    # TODO(gary): write final state to status file
+    pos = start
+    partial = b''
+    try:
+        with log_index.open_log(logfile) as f:
+            f.seek(start)
+            while end is None or pos < end:
+                size = READ_SIZE - len(partial)
+                data = f.read(size if end is None else min(size, end - pos))
+                if not data:
+                    break
+                pos += len(data)
+
+                data = partial + data
+                cut = data.rfind(b'\n') + 1
+                if not cut and len(data) < READ_SIZE:
+                    # Wait for the end of the line
+                    partial = data
+                    continue
+                cut = cut or len(data)
+                partial = data[cut:]
+                send(decode(data[:cut]))
+                eventlet.sleep(0)
+    except IOError as e:
+        LOG.warning("Unable to read the log of task %s: %s", id, e)
+
+    if partial:
+        send(decode(partial))
+    return pos
+
+
+class LogBatcher(object):
+    """Writes the output lines of a task to its log and its room in batches
+
+    Each batch is written and flushed to the log file, and emitted as a
+    single message (in the same "<id> <lines>" format as a single line),
+    when its oldest line has waited interval seconds or it has reached size
+    bytes.  Lines are neither dropped nor reordered.
+
+    A batch only holds lines of one stream.  Both streams are written to the
+    log file, but stdout is emitted as "log" events and stderr as "stderr"
+    events.
+
+    The most recent batches are kept in memory, identified by their offset
+    in the log file, so that clients joining the task can be sent what they
+    missed without reading the log (see replay).
+
+    If index (a log_index.IndexWriter) is given, it is kept up to date with
+    what is written to the log.
+    """
 
+    def __init__(self, id, f, interval=None, size=None, buffer_size=None,
+                 index=None):
+        self.id = id
+        self.f = f
+        self.index = index
+        self.interval = LOG_BATCH_INTERVAL if interval is None else interval
+        self.size = LOG_BATCH_SIZE if size is None else size
+        self.buffer_size = REPLAY_BUFFER_SIZE if buffer_size is None \
+            else buffer_size
+        # Number of bytes written to the log so far
+        self.offset = 0
+        self._recent = collections.deque()
+        self._recent_size = 0
+        self._lines = []
+        self._size = 0
+        self._stream = STDOUT
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, line, stream=STDOUT):
+        with self._lock:
+            if stream != self._stream:
+                self._flush()
+                self._stream = stream
+            self._lines.append(line)
+            self._size += len(line)
+            if self._size >= self.size or not self.interval:
+                self._flush()
+            elif self._timer is None:
+                # Timers are not cancelled once the batch is sent, but expire
+                # harmlessly since they no longer match _timer
+                self._timer = object()
+                eventlet.spawn_after(self.interval, self._expire, self._timer)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _expire(self, timer):
+        with self._lock:
+            if timer is self._timer:
+                self._flush()
+
+    def _flush(self):
+        self._timer = None
+        if not self._lines:
+            return
+
+        text = ''.join(self._lines)
+        self._lines = []
+        self._size = 0
+
+        data = text.encode('utf-8')
+        self.f.write(data)
+        self.f.flush()
+        if self.index:
+            self.index.add(data)
+
+        self._recent.append((self.offset, data))
+        self._recent_size += len(data)
+        self.offset += len(data)
+        while self._recent_size > self.buffer_size and len(self._recent) > 1:
+            self._recent_size -= len(self._recent.popleft()[1])
+
+        event = "log" if self._stream == STDOUT else "stderr"
+        socketio.emit(event, self.id + " " + text, room=self.id)
+
+    def replay(self, offset, send, join):
+        """Pass on the output written after offset to send and join
+
+        Any output that is no longer buffered is first read from the log
+        file and passed to send(text), in pieces (see send_log), while
+        batches carry on being sent.  The rest comes from memory and is
+        passed to join(text).  No batch is sent while join runs, so if join
+        also adds the client to the task's room, the client gets every line
+        exactly once.
+        """
+        while True:
+            with self._lock:
+                start = self._recent[0][0] if self._recent else self.offset
+                if offset >= start:
+                    join(decode(b''.join(
+                        data[max(0, offset - batch_offset):]
+                        for batch_offset, data in self._recent
+                        if batch_offset + len(data) > offset)))
+                    return
+            # More may have been evicted by the time this is sent, in which
+            # case the loop sends that too
+            offset = max(offset, send_log(self.id, send, offset, start))
+            if offset < start:
+                # The log is not readable, so skip what cannot be sent
+                offset = start
+
+
+class ProcessOutput(object):
+    # The state of a process whose output is being read by OutputReader
+
+    def __init__(self, ps, id, on_exit, events=None):
+        self.ps = ps
+        self.id = id
+        self.on_exit = on_exit
+        self.f = open(get_log_file(id), 'wb')
+        self.index_f = open(log_index.index_file(get_log_file(id)), 'wb')
+        self.batcher = LogBatcher(id, self.f,
+                                  index=log_index.IndexWriter(self.index_f))
+        live_logs[id] = self.batcher
+        self.pipes = {STDOUT: ps.stdout, STDERR: ps.stderr}
+        self.partial = {STDOUT: b'', STDERR: b''}
+        self.summary = play_summary.PlaySummary()
+        self.profile = None
+        if events is not None:
+            self.pipes[EVENTS] = events
+            self.partial[EVENTS] = b''
+            self.profile = play_profile.PlayProfile()
+            live_profiles[id] = self.profile
+
+    def feed(self, stream, data):
+        # Pass on the complete lines of data, keeping any incomplete one
+        lines = (self.partial[stream] + data).split(b'\n')
+        self.partial[stream] = lines.pop()
+        if stream == EVENTS:
+            self.send_events(lines)
+            return
+        self.add_lines([decode(line + b'\n') for line in lines], stream)
+
+    def close(self, stream):
+        self.pipes.pop(stream).close()
+        if self.partial[stream]:
+            if stream == EVENTS:
+                self.send_events([self.partial[stream]])
+            else:
+                self.add_lines([decode(self.partial[stream])], stream)
+            self.partial[stream] = b''
+
+    def add_lines(self, lines, stream):
+        changed = False
+        for line in lines:
+            self.batcher.add(line, stream)
+            if stream == STDOUT:
+                changed = self.summary.feed(line) or changed
+        if changed:
+            # New failures are recorded straight away, so that they can be
+            # seen in the task before the run ends
+            registry.update(self.id, **self.summary.fields())
+
+    def send_events(self, lines):
+        # Emit the events read at once as a single "events" message
+        events = []
+        for line in lines:
+            try:
+                event = json.loads(decode(line))
+            except ValueError:
+                LOG.warning("Ignoring invalid event from task %s: %r",
+                            self.id, line)
+                continue
+            if isinstance(event, dict):
+                self.profile.add(event)
+                events.append(event)
+        if events:
+            socketio.emit("events", {'id': self.id, 'events': events},
+                          room=self.id)
+
+    def finish(self, returncode):
+        try:
+            registry.update(self.id, **self.summary.fields())
+            self.batcher.flush()
+            self.f.close()
+            self.index_f.close()
+            # Clients that join from now on get the whole log from the file
+            live_logs.pop(self.id, None)
+            socketio.close_room(self.id)
+            live_profiles.pop(self.id, None)
+            # Only runs that sent events (i.e. ansible runs) have a profile
+            if self.profile is not None and \
+                    self.profile.start_time is not None:
+                self.profile.save(get_profile_file(self.id))
+        finally:
+            self.on_exit(returncode)
+
+
+def decode(line):
+    # python 2 returns bytes that must be converted to a string
+    return line.decode("utf-8", "replace")
+
+
+class OutputReader(object):
+    """Reads the output of all running playbook processes in one task
+
+    The stdout and stderr pipes of every process (and its events pipe, if
+    any) are serviced by a single select loop, so that no process can block
+    on a full pipe without needing a task per process.  Lines are passed to
+    the process's LogBatcher tagged with their stream, and once all pipes
+    are closed and the process has exited, its on_exit(returncode) is
+    called.
+    """
 
-def spawn_process(command, args=[], cwd=None, opts={}):
+    # Seconds between checks of whether processes whose pipes are closed
+    # have exited
+    REAP_INTERVAL = 0.1
+
+    def __init__(self):
+        # Map of the fds being read to (ProcessOutput, stream)
+        self._pipes = {}
+        # Processes that have closed their pipes but not yet exited
+        self._exiting = []
+        self._task = None
+        self._wakeup_r, self._wakeup_w = os.pipe()
+
+    def add(self, ps, id, on_exit, events=None):
+        output = ProcessOutput(ps, id, on_exit, events)
+        for stream, pipe in output.pipes.items():
+            self._pipes[pipe.fileno()] = (output, stream)
+
+        if self._task is None:
+            # Since the task will interact with socketio, we have to use that
+            # library's function for creating threads
+            self._task = socketio.start_background_task(self._run)
+        else:
+            # Have the loop pick up the new pipes
+            os.write(self._wakeup_w, b'x')
+
+    def _run(self):
+        # The loop ends once there is nothing left to read, and is started
+        # again by the next add
+        while self._pipes or self._exiting:
+            try:
+                self._poll()
+            except Exception as e:
+                LOG.exception(e)
+        self._task = None
+
+    def _poll(self):
+        timeout = self.REAP_INTERVAL if self._exiting else None
+        readable, _, _ = select.select(list(self._pipes) + [self._wakeup_r],
+                                       [], [], timeout)
+        for fd in readable:
+            if fd == self._wakeup_r:
+                os.read(fd, READ_SIZE)
+            elif fd in self._pipes:
+                self._read(fd)
+        self._reap()
+
+    def _read(self, fd):
+        output, stream = self._pipes[fd]
+        try:
+            data = os.read(fd, READ_SIZE)
+        except OSError as e:
+            LOG.warning("Unable to read %s of task %s: %s", stream,
+                        output.id, e)
+            data = b''
+
+        if data:
+            output.feed(stream, data)
+            return
+
+        del self._pipes[fd]
+        output.close(stream)
+        if not output.pipes:
+            self._exiting.append(output)
+
+    def _reap(self):
+        for output in list(self._exiting):
+            returncode = output.ps.poll()
+            if returncode is not None:
+                self._exiting.remove(output)
+                LOG.debug("Task %s exited with %d", output.id, returncode)
+                try:
+                    output.finish(returncode)
+                except Exception as e:
+                    LOG.exception(e)
+
+
+def spawn_process(command, args=[], cwd=None, opts={}, priority=0,
+                  client_id=None):
 
     # The code explicitly create processes with the subprocess module rather
     # than using a more advanced mechanism like Celery
@@ -185,43 +772,66 @@ def spawn_process(command, args=[], cwd=None, opts={}):
     # this program will be used in an installation scenario where those sytems
     # are not yet running.
 
-    # TODO(gary): Add logic to avoid spawning duplicate playbooks when
-    # indicated, by looking at all running playbooks for one with the same
-    # command line
-
     cmdArgs = [command]
     if args:
         cmdArgs.extend(args)
 
-    try:
-        ps = subprocess.Popen(cmdArgs, cwd=cwd, env=opts.get('env', None),
-                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except OSError:
-        pass
+    env = opts.get('env', None)
+    if os.path.basename(command) == 'ansible-playbook':
+        env = event_plugin_env(env)
 
-    start_time = int(1000 * time.time())
+    # The process is started by the scheduler, immediately unless too many
+    # are already running.  If the same command is already queued or
+    # running, its task is returned instead
+    id, created = scheduler.submit(cmdArgs, cwd, env, priority, client_id)
 
-    id = "%d_%d" % (start_time, ps.pid)
+    return '', 202, {'Location': url_for('tasks.get_task', id=id)}
 
-    # Use a thread to read the pipe to avoid blocking this process.  Since
-    # the thread will interact with socketio, we have to use that library's
-    # function for creating threads
 
-    # Use a thread to read the pipe to avoid blocking this process
-    use_threading = False
-    if use_threading:
-        tasks[id] = {'task': threading.Thread(target=process_output,
-                                              args=(ps, id)),
-                     'start_time': start_time}
-        tasks[id]['task'].start()
-    else:
-        tasks[id] = {'task': socketio.start_background_task(process_output,
-                                                            ps, id),
-                     'start_time': start_time}
+def event_plugin_env(env=None):
+    """Return env (default os.environ) with the event plugin enabled
 
-    LOG.debug("Spwaned thread with task %s", id)
+    The plugin is added to any other callback plugins and whitelisted
+    callbacks already configured in the environment.
+    """
+    env = dict(os.environ if env is None else env)
 
-    return '', 202, {'Location': url_for('tasks.get_task', id=id)}
+    paths = [CALLBACK_PLUGINS_DIR]
+    if env.get('ANSIBLE_CALLBACK_PLUGINS'):
+        paths.append(env['ANSIBLE_CALLBACK_PLUGINS'])
+    env['ANSIBLE_CALLBACK_PLUGINS'] = os.pathsep.join(paths)
+
+    # Named callbacks_enabled as of ansible 2.11
+    for var in ('ANSIBLE_CALLBACK_WHITELIST', 'ANSIBLE_CALLBACKS_ENABLED'):
+        names = [CALLBACK_PLUGIN]
+        if env.get(var):
+            names.append(env[var])
+        env[var] = ','.join(names)
+    return env
+
+
+scheduler = Scheduler(config.get('playbooks', 'max_running'), OutputReader())
+
+
+def log_in_use(id):
+    """Return whether the log of a task may still be written"""
+    if id in live_logs:
+        return True
+    # The task may also be run by another process of the service
+    task = registry.get(id)
+    return task is not None and task['status'] in (QUEUED, RUNNING)
+
+
+archiver = log_archive.LogArchiver(LOGS_DIR,
+                                   ARCHIVE_THRESHOLD_MB * 1024 * 1024,
+                                   log_in_use,
+                                   config.get('playbooks', 'compress_logs'))
+
+
+def start_log_archiver():
+    if not os.path.isdir(LOGS_DIR):
+        os.makedirs(LOGS_DIR)
+    archiver.start(config.get('playbooks', 'log_archive_interval'))
 
 
 @socketio.on('connect')
@@ -235,22 +845,43 @@ def on_disconnect():
 
 
 @socketio.on('join')  # , namespace='/log')
-def on_join(id):
-
-    logfile = get_log_file(id)
-
-    # replay existing log as messages before joining the room
-    with open(logfile) as f:
-        LOG.info("Replaying %s", logfile)
-        for line in f:
-            msg = id + " " + line + "from file"
-            emit("log", msg)
-
-    # If it is critical not to miss any messages, then thread synchronizcation
-    # needs to be introduced so that if any thread is in this function, the
-    # pipe reader will pause.  That comes at a cost in code complexity and
-    # performance
+def on_join(data):
+    """Send the task's log so far, then join its room
 
-    LOG.info("Joining room %s", id)
+    data is the task id, or an object with the task id and the offset in
+    the log (i.e. the number of bytes) that the client already has
+    """
+    if isinstance(data, dict):
+        id = data.get('id')
+        offset = data.get('offset', 0)
+    else:
+        id = data
+        offset = 0
 
-    join_room(id)
+    if not isinstance(id, basestring) or not id or os.sep in id:
+        LOG.warning("Ignoring join with invalid task id: %r", data)
+        return
+    try:
+        offset = max(0, int(offset))
+    except (TypeError, ValueError):
+        LOG.warning("Replaying task %s from the start, since the offset is "
+                    "invalid: %r", id, offset)
+        offset = 0
+
+    def send(text):
+        if text:
+            emit("log", id + " " + text)
+
+    def join(text):
+        send(text)
+        LOG.info("Joining room %s", id)
+        join_room(id)
+
+    batcher = live_logs.get(id)
+    if batcher:
+        batcher.replay(offset, send, join)
+    else:
+        # The task has finished (or not yet started), so its log is not
+        # changing
+        send_log(id, send, offset)
+        join('')
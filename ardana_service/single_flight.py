@@ -0,0 +1,82 @@
+"""Coalesce concurrent calls that compute the same result
+
+While a call for a key is in progress, further calls for the same key wait
+for it and share its result (or its exception) rather than repeating the
+work.  Nothing is kept once the call completes, so this is not a cache: a
+call made after the previous one has finished always does the work again.
+
+Since results are shared between callers, they must not be modified.
+"""
+import eventlet.event
+import logging
+import sys
+import threading
+
+LOG = logging.getLogger(__name__)
+
+# Sent to the waiters when the call in progress does not complete
+_ABANDONED = object()
+
+
+class SingleFlight(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.executions = 0
+        self.shared = 0
+        self.errors = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """Return func(*args, **kwargs), or the result of a call in progress
+
+        key identifies the result, and must be hashable
+        """
+        with self._lock:
+            self.calls += 1
+            event = self._in_flight.get(key)
+            if event is None:
+                event = self._in_flight[key] = eventlet.event.Event()
+                self.executions += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            LOG.debug("Waiting for %s %r in progress", self.name, key)
+            result = event.wait()
+            if result is _ABANDONED:
+                # The call was interrupted (e.g. killed or timed out) rather
+                # than failing, so make it again
+                return self.do(key, func, *args, **kwargs)
+            return result
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            exc_info = sys.exc_info()
+            with self._lock:
+                self.errors += 1
+                del self._in_flight[key]
+            event.send_exception(*exc_info)
+            raise
+        except BaseException:
+            with self._lock:
+                del self._in_flight[key]
+            event.send(_ABANDONED)
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+        event.send(result)
+        return result
+
+    def stats(self):
+        return {'calls': self.calls,
+                'executions': self.executions,
+                'shared': self.shared,
+                'errors': self.errors,
+                'inFlight': len(self._in_flight)}
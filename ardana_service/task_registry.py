@@ -0,0 +1,177 @@
+"""Record of playbook tasks, kept in a SQLite database across restarts
+
+Records of tasks that have not finished are also kept in memory, and are
+written through to the database on every change, so the status lookups that
+clients poll for are served without a query.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+# Columns of the tasks table, other than id
+FIELDS = ('status', 'command', 'priority', 'client_id', 'queue_time',
+          'start_time', 'end_time', 'pid', 'code', 'error', 'log_size',
+          'failures', 'unreachable', 'recap')
+
+# Fields stored as JSON
+JSON_FIELDS = ('command', 'failures', 'unreachable', 'recap')
+
+# Columns added since the table was first created, with their types
+ADDED_COLUMNS = (('failures', 'TEXT'), ('unreachable', 'TEXT'),
+                 ('recap', 'TEXT'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    command TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    client_id TEXT,
+    queue_time INTEGER,
+    start_time INTEGER,
+    end_time INTEGER,
+    pid INTEGER,
+    code INTEGER,
+    error TEXT,
+    log_size INTEGER,
+    failures TEXT,
+    unreachable TEXT,
+    recap TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, queue_time);
+CREATE INDEX IF NOT EXISTS tasks_by_queue_time ON tasks (queue_time);
+CREATE INDEX IF NOT EXISTS tasks_by_start_time ON tasks (start_time);
+"""
+
+# Statuses of tasks that have not finished
+ACTIVE = ('queued', 'running')
+
+
+class TaskRegistry(object):
+    """Tasks by id, stored in the SQLite database at path
+
+    The database is opened on first use.  Tasks that were still queued or
+    running when the service last stopped are marked failed at that point,
+    since nothing is tracking them any more.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is not None:
+            return self._db
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        db = sqlite3.connect(self.path, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        # With write-ahead logging, readers never wait for writers, and
+        # commits need no fsync with synchronous=NORMAL
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.executescript(SCHEMA)
+        columns = set(row[1] for row in db.execute('PRAGMA table_info(tasks)'))
+        for column, column_type in ADDED_COLUMNS:
+            if column not in columns:
+                db.execute('ALTER TABLE tasks ADD COLUMN %s %s' % (
+                    column, column_type))
+
+        interrupted = db.execute(
+            'UPDATE tasks SET status = ?, error = ?, end_time = ? '
+            'WHERE status IN (?, ?)',
+            ('failed', 'Interrupted by a restart of the service',
+             int(1000 * time.time())) + ACTIVE)
+        if interrupted.rowcount:
+            LOG.warning("Marked %d interrupted tasks as failed",
+                        interrupted.rowcount)
+
+        self._db = db
+        return db
+
+    @staticmethod
+    def _to_row(record):
+        row = dict(record)
+        for field in JSON_FIELDS:
+            if row.get(field) is not None:
+                row[field] = json.dumps(row[field])
+        return row
+
+    @staticmethod
+    def _from_row(row):
+        record = dict(zip(row.keys(), row))
+        for field in JSON_FIELDS:
+            if record[field] is not None:
+                record[field] = json.loads(record[field])
+        return record
+
+    def add(self, record):
+        """Add a task, given a dict with its id and (some of) FIELDS"""
+        row = self._to_row(record)
+        # Give the kept record the same keys as one read from the database
+        record = dict(dict.fromkeys(FIELDS), **record)
+        columns = ['id'] + [f for f in FIELDS if f in row]
+        with self._lock:
+            self._connect().execute(
+                'INSERT INTO tasks (%s) VALUES (%s)' % (
+                    ', '.join(columns), ', '.join('?' * len(columns))),
+                [row[c] for c in columns])
+            if record.get('status') in ACTIVE:
+                self._active[record['id']] = record
+
+    def update(self, id, **fields):
+        row = self._to_row(fields)
+        columns = [f for f in FIELDS if f in row]
+        with self._lock:
+            self._connect().execute(
+                'UPDATE tasks SET %s WHERE id = ?' % ', '.join(
+                    '%s = ?' % c for c in columns),
+                [row[c] for c in columns] + [id])
+
+            record = self._active.get(id)
+            if record is not None:
+                record.update(fields)
+                if record.get('status') not in ACTIVE:
+                    del self._active[id]
+
+    def get(self, id):
+        """Return the record of a task, or None if there is no such task"""
+        with self._lock:
+            record = self._active.get(id)
+            if record is not None:
+                return dict(record)
+
+            row = self._connect().execute(
+                'SELECT * FROM tasks WHERE id = ?', (id,)).fetchone()
+            return self._from_row(row) if row else None
+
+    def list(self, status=None, limit=100, offset=0):
+        """Return a page of tasks, most recently queued first, and the total
+
+        If status is given, only tasks with that status are included.
+        """
+        where, args = ('WHERE status = ?', [status]) if status else ('', [])
+        with self._lock:
+            db = self._connect()
+            total = db.execute('SELECT COUNT(*) FROM tasks ' + where,
+                               args).fetchone()[0]
+            rows = db.execute(
+                'SELECT * FROM tasks %s ORDER BY queue_time DESC, id DESC '
+                'LIMIT ? OFFSET ?' % where, args + [limit, offset]).fetchall()
+        return [self._from_row(row) for row in rows], total
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,11 +1,43 @@
+from flask import abort
 from flask import Blueprint
+from flask import jsonify
+from flask import request
 import logging
 
+from . import playbooks
+
 LOG = logging.getLogger(__name__)
 
 bp = Blueprint('tasks', __name__)
 
+# Maximum number of tasks returned at once
+MAX_LIMIT = 1000
+
+
+@bp.route("/api/v2/tasks")
+def get_tasks():
+    """List tasks, most recently queued first
+
+    Optional parameters are status, to only list tasks with that status,
+    and limit (default 100) and offset for paging
+    """
+    try:
+        limit = int(request.args.get('limit', 100))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        abort(400)
+    if not 0 <= limit <= MAX_LIMIT or offset < 0:
+        abort(400)
+
+    tasks, total = playbooks.registry.list(request.args.get('status'),
+                                           limit, offset)
+    return jsonify({'tasks': tasks, 'total': total})
+
 
 @bp.route("/api/v2/tasks/<id>")
 def get_task(id):
-    pass
+    task = playbooks.registry.get(id)
+    if task is None:
+        abort(404)
+
+    return jsonify(task)
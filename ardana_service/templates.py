@@ -1,23 +1,134 @@
 import config.config as config
+import cPickle as pickle
+import eventlet
 from flask import abort
 from flask import Blueprint
 from flask import jsonify
+import hashlib
 import logging
 import model
 import os
+import single_flight
+import uuid
 
 LOG = logging.getLogger(__name__)
 bp = Blueprint('templates', __name__)
 TEMPLATES_DIR = config.get_dir("templates_dir")
+SNAPSHOT_FILE = config.get_dir("template_snapshot")
 
+# Changed whenever the contents of the catalog change, so that snapshots
+# written by older versions are not used
+SNAPSHOT_VERSION = 1
 
-@bp.route("/api/v2/templates")
-def get_all_templates():
 
+class TemplateCatalog(object):
+    """The templates in templates_dir, with their models already read
+
+    Templates do not change while the service is running, so they are read
+    just once.  The catalog is also saved to snapshot_file, which is used
+    instead of reading the templates again as long as none of their files
+    have changed.
+    """
+
+    def __init__(self, templates_dir, snapshot_file):
+        self.templates_dir = templates_dir
+        self.snapshot_file = snapshot_file
+        self._catalog = None
+        self._loads = single_flight.SingleFlight('template catalog load')
+
+    def start(self):
+        """Load the catalog in the background"""
+        eventlet.spawn_n(self._warm_up)
+
+    def _warm_up(self):
+        try:
+            self.get()
+        except Exception as e:
+            LOG.exception(e)
+
+    def get(self):
+        """Return a dict with the templates list and the template models
+
+        Callers that arrive while the catalog is being loaded wait for it.
+        The catalog is shared and must not be modified.
+        """
+        if self._catalog is None:
+            self._catalog = self._loads.do(None, self._load)
+        return self._catalog
+
+    def _load(self):
+        fingerprint = catalog_fingerprint(self.templates_dir)
+        catalog = self._read_snapshot(fingerprint)
+        if catalog is None:
+            LOG.info("Reading templates from %s", self.templates_dir)
+            catalog = build_catalog(self.templates_dir, fingerprint)
+            self._write_snapshot(catalog)
+        return catalog
+
+    def _read_snapshot(self, fingerprint):
+        try:
+            with open(self.snapshot_file, 'rb') as f:
+                catalog = pickle.load(f)
+        except IOError:
+            return
+        except Exception as e:
+            LOG.warning("Ignoring unreadable template snapshot %s: %s",
+                        self.snapshot_file, e)
+            return
+
+        if not isinstance(catalog, dict) or \
+                catalog.get('version') != SNAPSHOT_VERSION or \
+                catalog.get('fingerprint') != fingerprint:
+            LOG.info("Template snapshot %s is out of date",
+                     self.snapshot_file)
+            return
+
+        LOG.info("Loaded templates from %s", self.snapshot_file)
+        return catalog
+
+    def _write_snapshot(self, catalog):
+        directory = os.path.dirname(self.snapshot_file)
+        temp_file = os.path.join(directory, '.%s.%s.tmp' % (
+            os.path.basename(self.snapshot_file), uuid.uuid4().hex))
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(temp_file, 'wb') as f:
+                pickle.dump(catalog, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_file, self.snapshot_file)
+        except Exception as e:
+            # The catalog is still usable, it will just be read again on the
+            # next start
+            LOG.warning("Unable to write template snapshot %s: %s",
+                        self.snapshot_file, e)
+            try:
+                os.unlink(temp_file)
+            except OSError:
+                pass
+
+
+def catalog_fingerprint(templates_dir):
+    """Return a validator that changes whenever any template file does"""
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(templates_dir)):
+        readme = os.path.join(templates_dir, name, "README.html")
+        try:
+            st = os.stat(readme)
+            digest.update('%s\0%r\0%d\0' % (name, st.st_mtime, st.st_size))
+        except OSError:
+            digest.update('%s\0\0' % name)
+        digest.update('%s\0' % model.model_fingerprint(
+            os.path.join(templates_dir, name)))
+    return digest.hexdigest()
+
+
+def build_catalog(templates_dir, fingerprint):
     templates = []
-    for name in os.listdir(TEMPLATES_DIR):
+    models = {}
+    for name in os.listdir(templates_dir):
+        template_dir = os.path.join(templates_dir, name)
 
-        readme = os.path.join(TEMPLATES_DIR, name, "README.html")
+        readme = os.path.join(template_dir, "README.html")
         try:
             with open(readme) as f:
                 lines = f.readlines()
@@ -32,15 +143,52 @@ def get_all_templates():
         except IOError:
             pass
 
-    return jsonify(sorted(templates))
+        try:
+            template_model = model.read_model(template_dir)
+        except Exception as e:
+            # Requests for this template fail, as they did before there was
+            # a catalog
+            LOG.warning("Unable to read template %s: %s", name, e)
+            template_model = None
+
+        models[name] = {'fingerprint': model.model_fingerprint(template_dir),
+                        'model': template_model}
+
+    return {'version': SNAPSHOT_VERSION,
+            'fingerprint': fingerprint,
+            'templates': sorted(templates),
+            'models': models}
+
+
+catalog = TemplateCatalog(TEMPLATES_DIR, SNAPSHOT_FILE)
+
+
+def start_catalog():
+    catalog.start()
+
+
+@bp.route("/api/v2/templates")
+def get_all_templates():
+
+    try:
+        return jsonify(catalog.get()['templates'])
+    except Exception as e:
+        LOG.exception(e)
+        abort(500)
 
 
 @bp.route("/api/v2/templates/<name>")
 def get_template(name):
 
-    model_dir = os.path.join(TEMPLATES_DIR, name)
     try:
-        return jsonify(model.read_model(model_dir))
+        entry = catalog.get()['models'].get(name)
     except Exception as e:
         LOG.exception(e)
         abort(500)
+
+    if entry is None:
+        abort(404)
+    if entry['model'] is None:
+        abort(500)
+
+    return model.etag_response(entry['fingerprint'], lambda: entry['model'])
@@ -0,0 +1,83 @@
+import unittest
+
+from .. import json_patch
+
+
+class TestApplyPatch(unittest.TestCase):
+
+    def patch(self, doc, *operations):
+        return json_patch.apply_patch(doc, list(operations))
+
+    def test_add(self):
+        doc = self.patch({'foo': 'bar'},
+                         {'op': 'add', 'path': '/baz', 'value': 'qux'})
+        self.assertEqual({'foo': 'bar', 'baz': 'qux'}, doc)
+
+    def test_add_to_list(self):
+        doc = self.patch({'foo': ['bar', 'baz']},
+                         {'op': 'add', 'path': '/foo/1', 'value': 'qux'},
+                         {'op': 'add', 'path': '/foo/-', 'value': 'end'})
+        self.assertEqual({'foo': ['bar', 'qux', 'baz', 'end']}, doc)
+
+    def test_remove(self):
+        doc = self.patch({'foo': ['bar', 'qux', 'baz'], 'x': 1},
+                         {'op': 'remove', 'path': '/foo/1'},
+                         {'op': 'remove', 'path': '/x'})
+        self.assertEqual({'foo': ['bar', 'baz']}, doc)
+
+    def test_replace(self):
+        doc = self.patch({'baz': 'qux', 'list': [1, 2]},
+                         {'op': 'replace', 'path': '/baz', 'value': 'boo'},
+                         {'op': 'replace', 'path': '/list/0', 'value': 3})
+        self.assertEqual({'baz': 'boo', 'list': [3, 2]}, doc)
+
+    def test_move(self):
+        doc = self.patch({'foo': {'bar': 'baz', 'waldo': 'fred'},
+                          'qux': {'corge': 'grault'}},
+                         {'op': 'move', 'from': '/foo/waldo',
+                          'path': '/qux/thud'})
+        self.assertEqual({'foo': {'bar': 'baz'},
+                          'qux': {'corge': 'grault', 'thud': 'fred'}}, doc)
+
+    def test_copy(self):
+        doc = self.patch({'foo': {'bar': [1]}},
+                         {'op': 'copy', 'from': '/foo', 'path': '/baz'})
+        doc['baz']['bar'].append(2)
+        self.assertEqual({'foo': {'bar': [1]}, 'baz': {'bar': [1, 2]}}, doc)
+
+    def test_escaped_pointer(self):
+        doc = self.patch({'a/b': 1, 'm~n': 2},
+                         {'op': 'test', 'path': '/a~1b', 'value': 1},
+                         {'op': 'remove', 'path': '/m~0n'})
+        self.assertEqual({'a/b': 1}, doc)
+
+    def test_replace_document(self):
+        doc = self.patch({'foo': 1}, {'op': 'replace', 'path': '',
+                                      'value': {'bar': 2}})
+        self.assertEqual({'bar': 2}, doc)
+
+    def test_failed_test(self):
+        with self.assertRaises(json_patch.PatchTestError):
+            self.patch({'baz': 'qux'},
+                       {'op': 'test', 'path': '/baz', 'value': 'bar'})
+
+    def test_errors(self):
+        for operation in ({'op': 'remove', 'path': '/missing'},
+                          {'op': 'add', 'path': '/list/5', 'value': 1},
+                          {'op': 'add', 'path': '/list/01', 'value': 1},
+                          {'op': 'add', 'path': 'noslash', 'value': 1},
+                          {'op': 'add', 'path': '/x'},
+                          {'op': 'move', 'from': '/list', 'path': '/list/0'},
+                          {'op': 'bogus', 'path': '/x'},
+                          'notanoperation'):
+            with self.assertRaises(json_patch.PatchError):
+                self.patch({'list': [1]}, operation)
+
+    def test_patched_members(self):
+        self.assertEqual({'servers', 'disk-models'},
+                         json_patch.patched_members([
+                             {'op': 'remove', 'path': '/servers/0'},
+                             {'op': 'move', 'from': '/disk-models/1',
+                              'path': '/servers/0'}]))
+        self.assertIsNone(json_patch.patched_members([
+            {'op': 'replace', 'path': '', 'value': {}}]))
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import log_archive
+
+
+class TestLogArchiver(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.live = set()
+        self.archiver = log_archive.LogArchiver(
+            self.temp_dir, 10000, lambda id: id in self.live)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, filename, data, mtime):
+        filename = os.path.join(self.temp_dir, filename)
+        with open(filename, 'wb') as f:
+            f.write(data)
+        os.utime(filename, (mtime, mtime))
+
+    def files(self):
+        return sorted(os.listdir(self.temp_dir))
+
+    def test_compress(self):
+        self.write('1_1.log', 'line\n' * 1000, 1)
+        self.write('2_1.log', 'line\n' * 1000, 2)
+        self.write('tasks.db', '', 1)
+        self.live.add('2_1')
+
+        self.archiver.archive()
+        self.assertEqual(['1_1.log.gz', '1_1.log.gz.idx', '2_1.log',
+                          'tasks.db'], self.files())
+
+    def test_no_compress(self):
+        self.write('1_1.log', 'line\n' * 1000, 1)
+        self.archiver.compress = False
+        self.archiver.archive()
+        self.assertEqual(['1_1.log'], self.files())
+
+    def test_evict(self):
+        for n in range(1, 6):
+            self.write('%d_1.log' % n, 'x' * 3000, n)
+        self.write('1_1.profile', '{}', 1)
+        self.write('tasks.db', 'x' * 10000, 0)
+        # A live run is kept, however old
+        self.write('0_1.log', 'x' * 1000, 0)
+        self.live.add('0_1')
+
+        self.archiver.evict()
+        # The oldest runs are deleted until the rest fit; tasks.db is not
+        # counted
+        self.assertEqual(['0_1.log', '3_1.log', '4_1.log', '5_1.log',
+                          'tasks.db'], self.files())
+
+    def test_runs(self):
+        for filename in ('1_1.log', '1_1.log.idx', '1_1.profile',
+                         '2_1.log.gz', '2_1.log.gz.idx',
+                         '2_1.log.gz.abc.tmp', 'tasks.db', 'other.log'):
+            self.write(filename, '', 1)
+        runs = self.archiver.runs()
+        self.assertEqual(['1_1', '2_1'], sorted(runs))
+        self.assertEqual(['2_1.log.gz', '2_1.log.gz.idx'],
+                         sorted(runs['2_1']))
@@ -0,0 +1,103 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import log_index
+
+
+class TestLogIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.logfile = os.path.join(self.temp_dir, 'play.log')
+        self.saved_interval = log_index.INTERVAL
+        log_index.INTERVAL = 10
+        self.lines = ['line %d\n' % i for i in range(95)]
+
+    def tearDown(self):
+        log_index.INTERVAL = self.saved_interval
+        shutil.rmtree(self.temp_dir)
+
+    def write_log(self, chunks):
+        # Write the chunks to the log, indexing as they are written
+        with open(self.logfile, 'wb') as log, \
+                open(log_index.index_file(self.logfile), 'wb') as f:
+            writer = log_index.IndexWriter(f)
+            for chunk in chunks:
+                log.write(chunk)
+                writer.add(chunk)
+
+    def test_index(self):
+        self.write_log(self.lines)
+        index = log_index.read_index(self.logfile)
+        self.assertEqual(10, len(index))
+        for i, offset in enumerate(index):
+            self.assertEqual(len(''.join(self.lines[:i * 10])), offset)
+
+    def test_chunks(self):
+        # Chunks spanning several intervals, and splitting lines
+        data = ''.join(self.lines)
+        self.write_log([data[i:i + 77] for i in range(0, len(data), 77)])
+        expected = [len(''.join(self.lines[:i * 10])) for i in range(10)]
+        self.assertEqual(expected, log_index.read_index(self.logfile))
+
+    def test_build_index(self):
+        with open(self.logfile, 'wb') as f:
+            f.write(''.join(self.lines))
+        expected = [len(''.join(self.lines[:i * 10])) for i in range(10)]
+        self.assertEqual(expected, log_index.read_index(self.logfile))
+        self.assertTrue(os.path.exists(log_index.index_file(self.logfile)))
+
+    def test_read_lines(self):
+        self.write_log(self.lines)
+        for start, count in ((0, 5), (8, 5), (20, 10), (37, 100), (95, 1)):
+            self.assertEqual(self.lines[start:start + count],
+                             log_index.read_lines(self.logfile, start, count))
+        self.assertEqual(self.lines[42:],
+                         log_index.read_lines(self.logfile, 42))
+
+    def test_tail(self):
+        self.write_log(self.lines)
+        self.assertEqual((self.lines[-5:], 90),
+                         log_index.tail(self.logfile, 5))
+        self.assertEqual((self.lines[-25:], 70),
+                         log_index.tail(self.logfile, 25))
+        self.assertEqual((self.lines, 0), log_index.tail(self.logfile, 500))
+        self.assertEqual(([], 95), log_index.tail(self.logfile, 0))
+
+    def test_tail_partial_line(self):
+        self.write_log(self.lines + ['partial'])
+        self.assertEqual((self.lines[-1:] + ['partial'], 94),
+                         log_index.tail(self.logfile, 2))
+
+    def test_compress(self):
+        self.write_log(self.lines + ['partial'])
+        gzfile = log_index.compress(self.logfile)
+        self.assertEqual(self.logfile + '.gz', gzfile)
+        self.assertEqual(['play.log.gz', 'play.log.gz.idx'],
+                         sorted(os.listdir(self.temp_dir)))
+
+        with gzip.open(gzfile) as f:
+            self.assertEqual(''.join(self.lines) + 'partial', f.read())
+
+        lines = self.lines + ['partial']
+        self.assertEqual(10, len(log_index.read_index(gzfile)))
+        for start, count in ((0, 5), (8, 5), (20, 10), (37, 100), (95, 1)):
+            self.assertEqual(lines[start:start + count],
+                             log_index.read_lines(gzfile, start, count))
+        self.assertEqual((lines[-25:], 71), log_index.tail(gzfile, 25))
+
+    def test_compressed_without_index(self):
+        self.write_log(self.lines)
+        gzfile = log_index.compress(self.logfile)
+        os.unlink(log_index.index_file(gzfile))
+        self.assertEqual(self.lines[42:47],
+                         log_index.read_lines(gzfile, 42, 5))
+        self.assertEqual((self.lines[-5:], 90), log_index.tail(gzfile, 5))
+
+    def test_compress_empty(self):
+        self.write_log([])
+        gzfile = log_index.compress(self.logfile)
+        self.assertEqual(([], 0), log_index.tail(gzfile, 5))
@@ -1,9 +1,20 @@
+import collections
 import copy
+import eventlet
+import flask
+import gc
+import json
 import os
+import shutil
+import tempfile
+import time
 import unittest
 import yaml
+import zlib
 
+from .. import json_patch
 from .. import model
+from .. import yaml_backend
 
 TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data')
 
@@ -25,6 +36,997 @@ class TestReadInvalidModels(unittest.TestCase):
             model.read_model(model_dir)
 
 
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.model_dir = os.path.join(self.temp_dir, 'model')
+        shutil.copytree(os.path.join(TEST_DATA_DIR, 'no_passthrough'),
+                        self.model_dir)
+        model.parse_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        model.parse_cache.clear()
+
+    def test_reread_uses_cache(self):
+        first = model.read_model(self.model_dir)
+        misses = model.parse_cache.misses
+        self.assertEqual(0, model.parse_cache.hits)
+
+        second = model.read_model(self.model_dir)
+        self.assertEqual(misses, model.parse_cache.misses)
+        self.assertEqual(misses, model.parse_cache.hits)
+        self.assertEqual(first['inputModel'], second['inputModel'])
+
+    def test_changed_file_is_reparsed(self):
+        model.read_model(self.model_dir)
+        misses = model.parse_cache.misses
+
+        filename = os.path.join(self.model_dir, 'data', 'control_plane.yml')
+        with open(filename) as f:
+            doc = yaml_backend.load(f)
+        doc['control-planes'][0]['name'] = 'changed'
+        with open(filename, 'w') as f:
+            yaml_backend.dump(doc, f)
+
+        data = model.read_model(self.model_dir)
+        self.assertEqual(misses + 1, model.parse_cache.misses)
+        self.assertEqual('changed',
+                         data['inputModel']['control-planes'][0]['name'])
+
+    def test_returned_docs_are_private(self):
+        first = model.read_model(self.model_dir)
+        first['inputModel']['servers'][0]['id'] = 'munged'
+
+        second = model.read_model(self.model_dir)
+        self.assertNotEqual('munged', second['inputModel']['servers'][0]['id'])
+
+    def test_eviction(self):
+        cache = model.ParseCache(2)
+        names = ('cloudConfig.yml', 'data/servers.yml', 'data/networks.yml')
+        for name in names:
+            cache.load(os.path.join(self.model_dir, name))
+        self.assertEqual(2, cache.stats()['size'])
+
+        # The least recently used entry was evicted
+        cache.load(os.path.join(self.model_dir, names[0]))
+        self.assertEqual(4, cache.misses)
+        cache.load(os.path.join(self.model_dir, names[2]))
+        self.assertEqual(1, cache.hits)
+
+    def test_hub_runs_while_parsing(self):
+        saved_load = yaml_backend.load
+        native_sleep = eventlet.patcher.original('time').sleep
+
+        def slow_load(stream):
+            native_sleep(0.05)
+            return saved_load(stream)
+
+        ticks = []
+
+        def ticker():
+            while True:
+                ticks.append(1)
+                eventlet.sleep(0.01)
+
+        expected = model.read_model(self.model_dir)
+        model.parse_cache.clear()
+
+        yaml_backend.load = slow_load
+        thread = eventlet.spawn(ticker)
+        try:
+            data = model.read_model(self.model_dir)
+        finally:
+            thread.kill()
+            yaml_backend.load = saved_load
+
+        self.assertGreater(len(ticks), 1)
+        self.assertEqual(expected['fileInfo']['files'],
+                         data['fileInfo']['files'])
+        self.assertEqual(expected['inputModel'], data['inputModel'])
+
+
+class TestSharedReads(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.model_dir = os.path.join(self.temp_dir, 'model')
+        shutil.copytree(os.path.join(TEST_DATA_DIR, 'no_passthrough'),
+                        self.model_dir)
+        model.parse_cache.clear()
+        self.saved_read_model = model.read_model
+        model.read_model = self.slow_read_model
+        self.reads = 0
+
+    def tearDown(self):
+        model.read_model = self.saved_read_model
+        shutil.rmtree(self.temp_dir)
+        model.parse_cache.clear()
+
+    def slow_read_model(self, model_dir, sections=None):
+        self.reads += 1
+        eventlet.sleep(0.05)
+        return self.saved_read_model(model_dir, sections)
+
+    def read_concurrently(self, *sections):
+        threads = [eventlet.spawn(model.read_model_shared, self.model_dir, s)
+                   for s in sections]
+        return [t.wait() for t in threads]
+
+    def test_concurrent_reads_are_shared(self):
+        shared = model.model_reads.stats()['shared']
+        results = self.read_concurrently(None, None, None)
+
+        self.assertEqual(1, self.reads)
+        self.assertIs(results[0], results[1])
+        self.assertIs(results[0], results[2])
+        self.assertEqual(shared + 2, model.model_reads.stats()['shared'])
+
+    def test_different_sections(self):
+        results = self.read_concurrently(['servers'], ['servers'], None)
+
+        self.assertEqual(2, self.reads)
+        self.assertIs(results[0], results[1])
+        self.assertEqual({'servers'}, set(results[0]['inputModel'].keys()))
+        self.assertIn('disk-models', results[2]['inputModel'])
+
+    def test_changed_model_is_not_shared(self):
+        thread = eventlet.spawn(model.read_model_shared, self.model_dir)
+        eventlet.sleep(0)
+
+        with open(os.path.join(self.model_dir, 'data', 'new.yml'), 'w') as f:
+            f.write('foo: bar\n')
+        data = model.read_model_shared(self.model_dir)
+
+        self.assertEqual(2, self.reads)
+        self.assertIn('data/new.yml', data['fileInfo']['files'])
+        self.assertIsNot(data, thread.wait())
+
+
+class TestReadSections(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model_dir = os.path.join(TEST_DATA_DIR, 'two_passthroughs')
+        cls.full = model.read_model(cls.model_dir)
+
+    def test_only_requested_sections(self):
+        data = model.read_model(self.model_dir, ['servers', 'disk-models'])
+
+        self.assertEqual({'servers', 'disk-models'},
+                         set(data['inputModel'].keys()))
+        self.assertEqual(self.full['inputModel']['servers'],
+                         data['inputModel']['servers'])
+        self.assertEqual(self.full['inputModel']['disk-models'],
+                         data['inputModel']['disk-models'])
+
+        file_info = data['fileInfo']
+        self.assertEqual({'servers', 'disk-models'},
+                         set(file_info['sections'].keys()))
+        self.assertEqual(set(file_info['files']),
+                         set(file_info['fileSectionMap'].keys()))
+        for sections in file_info['fileSectionMap'].values():
+            for section in sections:
+                self.assertIn(model.get_section_name(section),
+                              ('servers', 'disk-models'))
+
+    def test_only_relevant_files_read(self):
+        model.parse_cache.clear()
+        model.read_model(self.model_dir)
+
+        misses = model.parse_cache.misses
+        hits = model.parse_cache.hits
+        model.read_model(self.model_dir, ['servers'])
+
+        # cloudConfig.yml plus the one file holding servers
+        self.assertEqual(misses, model.parse_cache.misses)
+        self.assertEqual(hits + 2, model.parse_cache.hits)
+
+    def test_unknown_section(self):
+        data = model.read_model(self.model_dir, ['doesnotexist'])
+        self.assertEqual({}, data['inputModel'])
+        self.assertEqual([], data['fileInfo']['files'])
+
+
+class TestLiveModel(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.model_dir = os.path.join(self.temp_dir, 'model')
+        shutil.copytree(os.path.join(TEST_DATA_DIR, 'one_passthrough'),
+                        self.model_dir)
+        self.live = model.LiveModel(self.model_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def assertMatchesDisk(self):
+        expected = model.read_model(self.model_dir)
+        actual = self.live.get()
+        self.assertEqual(expected['inputModel'], actual['inputModel'])
+        self.assertEqual(expected['fileInfo'], actual['fileInfo'])
+        self.assertEqual(expected['readme'], actual['readme'])
+
+    def write_yaml(self, relname, doc):
+        with open(os.path.join(self.model_dir, relname), 'w') as f:
+            yaml_backend.dump(doc, f)
+
+    def test_initial_load(self):
+        self.assertMatchesDisk()
+
+    def test_start_before_model_exists(self):
+        shutil.move(self.model_dir, self.model_dir + '.later')
+        self.assertRaises(IOError, self.live.start, 0.01)
+        try:
+            shutil.move(self.model_dir + '.later', self.model_dir)
+            # Read by the watcher, rather than by get()
+            deadline = time.time() + 5
+            while self.live._model is None:
+                self.assertLess(time.time(), deadline)
+                eventlet.sleep(0.01)
+            self.assertMatchesDisk()
+        finally:
+            self.live.stop()
+
+    def test_modified_file(self):
+        self.live.get()
+        relname = 'data/control_plane.yml'
+        with open(os.path.join(self.model_dir, relname)) as f:
+            doc = yaml_backend.load(f)
+        doc['control-planes'][0]['name'] = 'changed'
+        self.write_yaml(relname, doc)
+
+        self.live.apply_changes({relname})
+        self.assertEqual(
+            'changed',
+            self.live.get()['inputModel']['control-planes'][0]['name'])
+        self.assertMatchesDisk()
+
+    def test_added_and_removed_files(self):
+        self.live.get()
+        self.write_yaml('data/more_servers.yml',
+                        {'servers': [{'id': 'extra', 'role': 'foo'}]})
+        os.unlink(os.path.join(self.model_dir, 'data', 'pass_through.yml'))
+
+        self.live.apply_changes({'data/more_servers.yml',
+                                 'data/pass_through.yml'})
+        self.assertNotIn('pass-through', self.live.get()['inputModel'])
+        self.assertMatchesDisk()
+
+    def test_unrelated_files_ignored(self):
+        before = self.live.get()
+        self.live.apply_changes({'data/.servers.yml.swp'})
+        self.assertIs(before, self.live.get())
+
+    def test_full_reload(self):
+        self.live.get()
+        os.unlink(os.path.join(self.model_dir, 'data', 'servers.yml'))
+        self.live.apply_changes(None)
+        self.assertNotIn('servers', self.live.get()['inputModel'])
+        self.assertMatchesDisk()
+
+    def test_failed_read_keeps_fingerprint(self):
+        model_before = self.live.get()
+        fingerprint = self.live.fingerprint()
+
+        # A file that cannot be read fails both a partial and a full reload,
+        # neither of which is applied, so the fingerprint still matches the
+        # model
+        for relname in ('data/control_plane.yml', model.CLOUD_CONFIG):
+            path = os.path.join(self.model_dir, relname)
+            shutil.move(path, path + '.saved')
+            os.mkdir(path)
+            try:
+                self.live.apply_changes({relname})
+                self.assertIs(model_before, self.live.get())
+                self.assertEqual(fingerprint, self.live.fingerprint())
+            finally:
+                os.rmdir(path)
+                shutil.move(path + '.saved', path)
+
+        with open(os.path.join(self.model_dir, 'data',
+                               'control_plane.yml'), 'a') as f:
+            f.write('\n')
+        self.live.apply_changes({'data/control_plane.yml'})
+        self.assertNotEqual(fingerprint, self.live.fingerprint())
+        self.assertEqual(model.model_fingerprint(self.model_dir),
+                         self.live.fingerprint())
+
+
+class TestModelEtag(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.model_dir = os.path.join(self.temp_dir, 'model')
+        shutil.copytree(os.path.join(TEST_DATA_DIR, 'no_passthrough'),
+                        self.model_dir)
+
+        self.saved_model_dir = model.MODEL_DIR
+        model.MODEL_DIR = self.model_dir
+        app = flask.Flask(__name__)
+        app.register_blueprint(model.bp)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        model.MODEL_DIR = self.saved_model_dir
+        shutil.rmtree(self.temp_dir)
+
+    def touch(self, relname):
+        with open(os.path.join(self.model_dir, relname), 'a') as f:
+            f.write('\n')
+
+    def test_fingerprint_is_stable(self):
+        self.assertEqual(model.model_fingerprint(self.model_dir),
+                         model.model_fingerprint(self.model_dir))
+
+    def test_fingerprint_changes(self):
+        before = model.model_fingerprint(self.model_dir)
+        self.touch('data/servers.yml')
+        self.assertNotEqual(before, model.model_fingerprint(self.model_dir))
+
+    def test_fingerprint_missing_model(self):
+        self.assertIsNone(model.model_fingerprint(
+            os.path.join(self.temp_dir, 'doesnotexist')))
+
+    def test_not_modified(self):
+        response = self.client.get('/api/v2/model')
+        self.assertEqual(200, response.status_code)
+        etag = response.headers['ETag']
+
+        response = self.client.get('/api/v2/model',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('', response.get_data())
+        self.assertEqual(etag, response.headers['ETag'])
+
+    def test_sections_arg(self):
+        full = self.client.get('/api/v2/model')
+        response = self.client.get('/api/v2/model?sections=servers')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['servers'],
+                         flask.json.loads(response.get_data())
+                         ['inputModel'].keys())
+        self.assertNotEqual(full.headers['ETag'], response.headers['ETag'])
+
+    def test_modified(self):
+        etag = self.client.get('/api/v2/model').headers['ETag']
+        self.touch('data/servers.yml')
+
+        response = self.client.get('/api/v2/model',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers['ETag'])
+
+
+class TestJsonResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        self.app.register_blueprint(model.bp)
+        # As configured in defaults.cfg; responses are never pretty printed
+        self.app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+        self.data = model.read_model(os.path.join(TEST_DATA_DIR,
+                                                  'two_passthroughs'))
+
+        self.saved_model_dir = model.MODEL_DIR
+        model.MODEL_DIR = os.path.join(TEST_DATA_DIR, 'two_passthroughs')
+        self.saved_live_model = model.live_model
+        model.live_model = None
+
+    def tearDown(self):
+        model.MODEL_DIR = self.saved_model_dir
+        model.live_model = self.saved_live_model
+
+    def test_same_as_jsonify(self):
+        with self.app.test_request_context():
+            expected = flask.jsonify(self.data).get_data()
+            response = model.json_response(self.data)
+            self.assertTrue(response.is_streamed)
+            self.assertEqual(expected, response.get_data())
+
+    def test_unicode(self):
+        data = {'inputModel': {'servers': [{'id': u'caf\xe9'}]}, 'n': 1}
+        for as_ascii in (True, False):
+            self.app.config['JSON_AS_ASCII'] = as_ascii
+            with self.app.test_request_context():
+                self.assertEqual(flask.jsonify(data).get_data(),
+                                 model.json_response(data).get_data())
+
+    def test_chunks(self):
+        data = {'inputModel': {'section%d' % i: ['x' * 1000] * 100
+                               for i in range(10)}}
+        with self.app.test_request_context():
+            chunks = list(model.json_response(data).response)
+
+        self.assertGreater(len(chunks), 5)
+        for chunk in chunks:
+            self.assertLess(len(chunk), 2 * model.STREAM_CHUNK_SIZE)
+        self.assertEqual(data, json.loads(''.join(chunks)))
+
+    def test_gzip(self):
+        client = self.app.test_client()
+        plain = client.get('/api/v2/model')
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+        response = client.get('/api/v2/model',
+                              headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(plain.get_data(),
+                         zlib.decompress(response.get_data(),
+                                         16 + zlib.MAX_WBITS))
+
+        etag = response.headers['ETag']
+        self.assertNotEqual(plain.headers['ETag'], etag)
+        response = client.get('/api/v2/model',
+                              headers={'Accept-Encoding': 'gzip',
+                                       'If-None-Match': etag})
+        self.assertEqual(304, response.status_code)
+
+
+class TestEntities(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.model_dir = os.path.join(self.temp_dir, 'model')
+        shutil.copytree(os.path.join(TEST_DATA_DIR, 'two_passthroughs'),
+                        self.model_dir)
+
+        self.saved_model_dir = model.MODEL_DIR
+        model.MODEL_DIR = self.model_dir
+        app = flask.Flask(__name__)
+        app.register_blueprint(model.bp)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        model.MODEL_DIR = self.saved_model_dir
+        model.live_model = None
+        shutil.rmtree(self.temp_dir)
+
+    def get_json(self, url):
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        return flask.json.loads(response.get_data())
+
+    def send_json(self, method, url, data):
+        return self.client.open(url, method=method,
+                                data=flask.json.dumps(data),
+                                content_type='application/json')
+
+    def mtimes(self):
+        return {f: os.stat(os.path.join(self.model_dir, f)).st_mtime
+                for f in model.list_model_files(self.model_dir)[0]}
+
+    def test_index(self):
+        data = model.read_model(self.model_dir)
+        index = model.build_entity_index(data)
+
+        item, filename = index[('disk-models', 'COMPUTE-DISKS')]
+        self.assertEqual('COMPUTE-DISKS', item['name'])
+        self.assertEqual('data/disks_compute.yml', filename)
+
+        item, filename = index[('servers', 'controller1')]
+        self.assertEqual('data/servers.yml', filename)
+
+    def test_index_first_file_wins(self):
+        data = model.read_model(self.model_dir)
+        file_section_map = collections.OrderedDict(
+            data['fileInfo']['fileSectionMap'])
+        file_section_map['data/more_servers.yml'] = [
+            {'type': 'array', 'keyField': 'id', 'servers': ['controller1']}]
+        data['fileInfo']['fileSectionMap'] = file_section_map
+
+        item, filename = model.build_entity_index(data)[
+            ('servers', 'controller1')]
+        self.assertEqual('data/servers.yml', filename)
+
+    def test_list_entities(self):
+        entities = self.get_json('/api/v2/model/entities')
+        self.assertIn('servers', entities)
+        self.assertIn('disk-models', entities)
+
+    def test_get_section(self):
+        servers = self.get_json('/api/v2/model/entities/servers')
+        self.assertIn('controller1', [s['id'] for s in servers])
+
+        response = self.client.get('/api/v2/model/entities/doesnotexist')
+        self.assertEqual(404, response.status_code)
+
+    def test_get_entry(self):
+        server = self.get_json('/api/v2/model/entities/servers/controller1')
+        self.assertEqual('controller1', server['id'])
+
+        response = self.client.get(
+            '/api/v2/model/entities/servers/doesnotexist')
+        self.assertEqual(404, response.status_code)
+
+    def test_put_entry_writes_one_file(self):
+        before = self.mtimes()
+
+        disk_model = self.get_json(
+            '/api/v2/model/entities/disk-models/COMPUTE-DISKS')
+        disk_model['device-groups'] = []
+        response = self.send_json(
+            'PUT', '/api/v2/model/entities/disk-models/COMPUTE-DISKS',
+            disk_model)
+        self.assertEqual(200, response.status_code)
+
+        after = self.mtimes()
+        self.assertEqual(['data/disks_compute.yml'],
+                         [f for f in before if before[f] != after[f]])
+
+        self.assertEqual(disk_model, self.get_json(
+            '/api/v2/model/entities/disk-models/COMPUTE-DISKS'))
+
+    def test_delete_entry(self):
+        response = self.client.delete(
+            '/api/v2/model/entities/servers/controller1')
+        self.assertEqual(200, response.status_code)
+
+        servers = model.read_model(self.model_dir)['inputModel']['servers']
+        self.assertNotIn('controller1', [s['id'] for s in servers])
+
+    def test_delete_last_entry_removes_file(self):
+        response = self.client.delete(
+            '/api/v2/model/entities/disk-models/COMPUTE-DISKS')
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.model_dir, 'data', 'disks_compute.yml')))
+
+    def test_post_entry(self):
+        server = self.get_json('/api/v2/model/entities/servers/controller1')
+
+        response = self.send_json('POST', '/api/v2/model/entities/servers',
+                                  server)
+        self.assertEqual(409, response.status_code)
+
+        for data in ([server], 'identity'):
+            response = self.send_json(
+                'POST', '/api/v2/model/entities/servers', data)
+            self.assertEqual(400, response.status_code)
+
+        server['id'] = 'newserver'
+        response = self.send_json('POST', '/api/v2/model/entities/servers',
+                                  server)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(server, self.get_json(
+            '/api/v2/model/entities/servers/newserver'))
+
+    def test_put_entry_rejected(self):
+        url = '/api/v2/model/entities/servers/controller1'
+        server = self.get_json(url)
+        before = self.mtimes()
+
+        for data in ('identity', [server], {'name': 'x'}):
+            response = self.send_json('PUT', url, data)
+            self.assertEqual(400, response.status_code)
+
+        other = self.get_json('/api/v2/model/entities/servers')[1]
+        server['id'] = other['id']
+        response = self.send_json('PUT', url, server)
+        self.assertEqual(409, response.status_code)
+
+        self.assertEqual(before, self.mtimes())
+        self.assertEqual(200, self.client.get('/api/v2/model').status_code)
+
+    def test_put_entry_renamed(self):
+        server = self.get_json('/api/v2/model/entities/servers/controller1')
+        server['id'] = 'renamed'
+        response = self.send_json(
+            'PUT', '/api/v2/model/entities/servers/controller1', server)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(server, self.get_json(
+            '/api/v2/model/entities/servers/renamed'))
+
+    def test_put_section_rejected(self):
+        url = '/api/v2/model/entities/disk-models'
+        disk_models = self.get_json(url)
+        before = self.mtimes()
+
+        for data in (['identity'], disk_models[0], [{'no': 'key'}]):
+            response = self.send_json('PUT', url, data)
+            self.assertEqual(400, response.status_code)
+
+        response = self.send_json(
+            'PUT', '/api/v2/model/entities/new-section', ['identity'])
+        self.assertEqual(400, response.status_code)
+
+        self.assertEqual(before, self.mtimes())
+        self.assertEqual(200, self.client.get('/api/v2/model').status_code)
+
+    def test_live_model_sees_writes(self):
+        model.live_model = model.LiveModel(self.model_dir)
+        response = self.client.delete(
+            '/api/v2/model/entities/servers/controller1')
+        self.assertEqual(200, response.status_code)
+
+        response = self.client.get(
+            '/api/v2/model/entities/servers/controller1')
+        self.assertEqual(404, response.status_code)
+
+
+class TestPatchModel(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.model_dir = os.path.join(self.temp_dir, 'model')
+        shutil.copytree(os.path.join(TEST_DATA_DIR, 'two_passthroughs'),
+                        self.model_dir)
+
+        self.saved_model_dir = model.MODEL_DIR
+        model.MODEL_DIR = self.model_dir
+        app = flask.Flask(__name__)
+        app.register_blueprint(model.bp)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        model.MODEL_DIR = self.saved_model_dir
+        shutil.rmtree(self.temp_dir)
+
+    def patch(self, *operations):
+        return self.client.open('/api/v2/model', method='PATCH',
+                                data=flask.json.dumps(list(operations)),
+                                content_type='application/json')
+
+    def mtimes(self):
+        return {f: os.stat(os.path.join(self.model_dir, f)).st_mtime
+                for f in model.list_model_files(self.model_dir)[0]}
+
+    def changed_files(self, before):
+        after = self.mtimes()
+        return sorted(set(f for f in set(before) | set(after)
+                          if before.get(f) != after.get(f)))
+
+    def test_patch_one_field(self):
+        before = self.mtimes()
+        response = self.patch({'op': 'replace',
+                               'path': '/servers/0/ip-addr',
+                               'value': '10.0.0.1'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['data/servers.yml'], self.changed_files(before))
+
+        data = model.read_model(self.model_dir)
+        self.assertEqual('10.0.0.1',
+                         data['inputModel']['servers'][0]['ip-addr'])
+        self.assertIn('baremetal', data['inputModel'])
+
+    def test_patch_split_section(self):
+        num_disk_models = len(model.read_model(self.model_dir)
+                              ['inputModel']['disk-models'])
+        before = self.mtimes()
+        response = self.patch({'op': 'remove', 'path': '/disk-models/0'})
+        self.assertEqual(200, response.status_code)
+
+        # Only the file holding the removed disk model changes
+        changed = self.changed_files(before)
+        self.assertEqual(1, len(changed))
+        self.assertTrue(changed[0].startswith('data/disks_'))
+        self.assertEqual(num_disk_models - 1,
+                         len(model.read_model(self.model_dir)
+                             ['inputModel']['disk-models']))
+
+    def test_patch_remove_section(self):
+        response = self.patch({'op': 'remove', 'path': '/control-planes'})
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.model_dir, 'data', 'control_plane.yml')))
+        self.assertIn('servers',
+                      model.read_model(self.model_dir)['inputModel'])
+
+    def test_patch_matches_full_write(self):
+        operation = {'op': 'replace',
+                     'path': '/pass-through/global/esx_cloud2',
+                     'value': False}
+        data = model.read_model(self.model_dir)
+        data['inputModel'] = json_patch.apply_patch(data['inputModel'],
+                                                    [operation])
+        expected = model.write_model(data, self.model_dir, dry_run=True)
+        expected = {k: v for k, v in expected.iteritems()
+                    if v['status'] != model.IGNORED}
+
+        before = self.mtimes()
+        self.assertEqual(200, self.patch(operation).status_code)
+        self.assertEqual(sorted(expected.keys()), self.changed_files(before))
+
+    def test_bad_patch(self):
+        before = self.mtimes()
+        self.assertEqual(400, self.patch({'op': 'remove',
+                                          'path': '/doesnotexist'})
+                         .status_code)
+        self.assertEqual(409, self.patch({'op': 'test',
+                                          'path': '/cloud/name',
+                                          'value': 'wrong'})
+                         .status_code)
+        self.assertEqual([], self.changed_files(before))
+
+
+class TestWritePlan(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model_dir = os.path.join(TEST_DATA_DIR, 'two_passthroughs')
+        cls.test_data = model.read_model(cls.model_dir)
+
+    def setUp(self):
+        self.data = copy.deepcopy(self.test_data)
+
+    def test_spread_sections(self):
+        plan = model.plan_write(self.data)
+        self.assertIn('disk-models', plan['spread'])
+        self.assertNotIn('servers', plan['spread'])
+        self.assertEqual('name', plan['key_fields']['disk-models'])
+        self.assertEqual('id', plan['key_fields']['servers'])
+        self.assertNotIn('disk-models', plan['not_split_evenly'])
+        self.assertIn('servers', plan['not_split_evenly'])
+
+        self.assertEqual(['COMPUTE-DISKS'],
+                         [d['name'] for d in
+                          plan['files']['data/disks_compute.yml']
+                          ['disk-models']])
+        self.assertEqual([], plan['leftovers']['disk-models'])
+
+    def test_leftovers(self):
+        self.data['inputModel']['disk-models'].append({'name': 'NEW'})
+        plan = model.plan_write(self.data)
+        self.assertEqual([{'name': 'NEW'}], plan['leftovers']['disk-models'])
+
+    def test_first_listed_file_wins(self):
+        # List COMPUTE-DISKS in a second file as well
+        file_section_map = self.data['fileInfo']['fileSectionMap']
+        filenames = [f for f in file_section_map
+                     if f in self.data['fileInfo']['sections']['disk-models']]
+        for section in file_section_map[filenames[-1]]:
+            if isinstance(section, dict) and 'disk-models' in section:
+                section['disk-models'].append('COMPUTE-DISKS')
+
+        plan = model.plan_write(self.data)
+        owners = [f for f in filenames
+                  if 'COMPUTE-DISKS' in [d['name'] for d in plan['files'].get(
+                      f, {}).get('disk-models', [])]]
+        self.assertEqual(1, len(owners))
+        self.assertEqual(filenames.index('data/disks_compute.yml'),
+                         min(filenames.index('data/disks_compute.yml'),
+                             filenames.index(owners[0])))
+
+    def test_many_files(self):
+        # Spread servers over one file per server, as with per-rack files
+        file_info = self.data['fileInfo']
+        servers = self.data['inputModel']['servers']
+        file_info['fileSectionMap']['data/servers.yml'] = [
+            s for s in file_info['fileSectionMap']['data/servers.yml']
+            if model.get_section_name(s) != 'servers']
+        file_info['sections']['servers'] = []
+        for server in servers:
+            filename = 'data/servers_%s.yml' % server['id']
+            file_info['files'].append(filename)
+            file_info['sections']['servers'].append(filename)
+            file_info['fileSectionMap'][filename] = [
+                'product', {'type': 'array', 'keyField': 'id',
+                            'servers': [server['id']]}]
+
+        plan = model.plan_write(self.data)
+        self.assertIn('servers', plan['spread'])
+        for server in servers:
+            self.assertEqual(
+                [server], plan['files']['data/servers_%s.yml' %
+                                        server['id']]['servers'])
+
+
+class TestWriteLargeModel(unittest.TestCase):
+
+    NUM_SERVERS = 5000
+
+    @classmethod
+    def setUpClass(cls):
+        data = model.read_model(os.path.join(TEST_DATA_DIR,
+                                             'two_passthroughs'))
+        servers = data['inputModel']['servers']
+        data['inputModel']['servers'] = []
+        for i in range(cls.NUM_SERVERS):
+            server = copy.deepcopy(servers[i % len(servers)])
+            server['id'] = 'server-%d' % i
+            data['inputModel']['servers'].append(server)
+        cls.test_data = data
+
+    def setUp(self):
+        # Write to an empty dir, so that all time is spent in write_model
+        # rather than in reading the existing files
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_model_is_not_modified(self):
+        snapshot = copy.deepcopy(self.test_data)
+        changes = model.write_model(self.test_data, self.temp_dir,
+                                    dry_run=True)
+        self.assertEqual(snapshot, self.test_data)
+
+        # The written data is the model's own data, not a copy of it
+        servers = changes['data/servers.yml']['data']['servers']
+        self.assertIs(self.test_data['inputModel']['servers'], servers)
+
+    def test_memory(self):
+        # A copy of the model would create several objects per server
+        gc.collect()
+        before = len(gc.get_objects())
+        changes = model.write_model(self.test_data, self.temp_dir,
+                                    dry_run=True)
+        gc.collect()
+        created = len(gc.get_objects()) - before
+
+        self.assertEqual(self.NUM_SERVERS,
+                         len(changes['data/servers.yml']['data']['servers']))
+        self.assertLess(created, self.NUM_SERVERS)
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.model_dir = os.path.join(self.temp_dir, 'model')
+        shutil.copytree(os.path.join(TEST_DATA_DIR, 'one_passthrough'),
+                        self.model_dir)
+        self.data = model.read_model(self.model_dir)
+
+        # Fail if anything is parsed from now on
+        self.saved_load = yaml_backend.load
+        yaml_backend.load = self.fail_parse
+
+    def tearDown(self):
+        yaml_backend.load = self.saved_load
+        shutil.rmtree(self.temp_dir)
+
+    def fail_parse(self, stream):
+        self.fail("Unexpected parse")
+
+    def statuses(self):
+        changes = model.write_model(self.data, self.model_dir, dry_run=True)
+        return {k: v['status'] for k, v in changes.iteritems()
+                if v['status'] != model.IGNORED}
+
+    def test_not_in_model(self):
+        # What was read is only known to the server
+        self.assertNotIn('manifest', self.data['fileInfo'])
+
+    def test_no_changes_without_reading(self):
+        self.assertEqual({}, self.statuses())
+
+    def test_touched_file(self):
+        # The mtime moves, so the file has to be parsed to find that its
+        # contents are still the same
+        yaml_backend.load = self.saved_load
+        filename = os.path.join(self.model_dir, 'data', 'servers.yml')
+        st = os.stat(filename)
+        os.utime(filename, (st.st_atime, st.st_mtime + 10))
+        self.assertEqual({}, self.statuses())
+
+    def test_changed_without_reading(self):
+        self.data['inputModel']['servers'][0]['role'] = 'foo'
+        self.assertEqual({'data/servers.yml': model.CHANGED},
+                         self.statuses())
+
+    def test_file_changed_since_read(self):
+        yaml_backend.load = self.saved_load
+        filename = os.path.join(self.model_dir, 'data', 'servers.yml')
+        with open(filename, 'a') as f:
+            f.write('extra: true\n')
+
+        # The file no longer matches the model, and must be parsed to tell
+        self.assertEqual({'data/servers.yml': model.CHANGED},
+                         self.statuses())
+
+    def test_files_outside_model_dir(self):
+        outside = os.path.join(self.temp_dir, 'outside.yml')
+        with open(outside, 'w') as f:
+            f.write('foo: bar\n')
+
+        # A manifest from the client is ignored
+        self.data['fileInfo']['manifest'] = {'../outside.yml': {}}
+        self.assertEqual({}, self.statuses())
+        self.assertEqual([], model.remove_obsolete_files(
+            self.model_dir, [], False, ['../outside.yml']))
+        self.assertTrue(os.path.exists(outside))
+
+        self.data['fileInfo']['fileSectionMap']['../outside.yml'] = \
+            ['servers']
+        self.assertRaises(ValueError, self.statuses)
+
+    def test_live_model_files(self):
+        yaml_backend.load = self.saved_load
+        with open(os.path.join(self.model_dir, 'data', 'extra.yml'),
+                  'w') as f:
+            f.write('foo: bar\n')
+
+        saved_live_model = model.live_model
+        model.live_model = model.LiveModel(self.model_dir)
+        model.live_model.start(0.01)
+        saved_walk = os.walk
+        walked = []
+
+        def walk(top, *args, **kwargs):
+            walked.append(top)
+            return saved_walk(top, *args, **kwargs)
+
+        os.walk = walk
+        try:
+            # The obsolete file is found without walking the model dir
+            self.assertEqual({'data/extra.yml': model.DELETED},
+                             self.statuses())
+            self.assertNotIn(self.model_dir, walked)
+        finally:
+            os.walk = saved_walk
+            model.live_model.stop()
+            model.live_model = saved_live_model
+
+
+class TestCommitFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.model_dir = os.path.join(self.temp_dir, 'model')
+        shutil.copytree(os.path.join(TEST_DATA_DIR, 'two_passthroughs'),
+                        self.model_dir)
+        self.data = model.read_model(self.model_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def all_files(self):
+        files = {}
+        for root, dirs, filenames in os.walk(self.model_dir):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                with open(path) as f:
+                    files[os.path.relpath(path, self.model_dir)] = f.read()
+        return files
+
+    def test_write(self):
+        self.data['inputModel']['servers'][0]['role'] = 'foo'
+        for name in ('FOO', 'BAR'):
+            self.data['inputModel']['disk-models'].append({'name': name})
+
+        changes = model.write_model(self.data, self.model_dir)
+        self.assertEqual(model.CHANGED, changes['data/servers.yml']['status'])
+
+        data = model.read_model(self.model_dir)
+        self.assertEqual(self.data['inputModel']['servers'],
+                         data['inputModel']['servers'])
+        self.assertEqual(
+            sorted(d['name'] for d in self.data['inputModel']['disk-models']),
+            sorted(d['name'] for d in data['inputModel']['disk-models']))
+        self.assertEqual([], [f for f in self.all_files()
+                              if f.endswith('.tmp')])
+
+        # Each new file gets its own disk model
+        for name in ('FOO', 'BAR'):
+            with open(os.path.join(self.model_dir, 'data',
+                                   'disk_models_%s.yml' % name)) as f:
+                self.assertEqual([{'name': name}],
+                                 yaml_backend.load(f)['disk-models'])
+
+    def test_keeps_mode(self):
+        filename = os.path.join(self.model_dir, 'data', 'servers.yml')
+        os.chmod(filename, 0o640)
+        self.data['inputModel']['servers'][0]['role'] = 'foo'
+        model.write_model(self.data, self.model_dir)
+        self.assertEqual(0o640, os.stat(filename).st_mode & 0o777)
+
+    def test_all_or_nothing(self):
+        before = self.all_files()
+
+        self.data['inputModel']['servers'][0]['role'] = 'foo'
+        self.data['inputModel']['control-planes'][0]['bad'] = object()
+        self.data['inputModel'].pop('networks')
+
+        with self.assertRaises(yaml.YAMLError):
+            model.write_model(self.data, self.model_dir)
+
+        self.assertEqual(before, self.all_files())
+
+
 # Note that this class does not inherit from TestCase, but its descendants do
 class TestWriteModels(object):
 
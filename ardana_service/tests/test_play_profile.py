@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import play_profile
+
+
+class TestPlayProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.profile = play_profile.PlayProfile()
+
+    def add(self, event, time, **fields):
+        fields.update({'event': event, 'time': time})
+        self.profile.add(fields)
+
+    def run_play(self):
+        self.add('play', 100, name='site')
+        self.add('task', 100, name='install', role='nova')
+        self.add('ok', 102, host='host1', task='install', role='nova')
+        self.add('changed', 105, host='host2', task='install', role='nova')
+        self.add('task', 106, name='start', role='nova')
+        self.add('ok', 107, host='host1', task='start', role='nova')
+        self.add('task', 107, name='install', role='swift')
+        self.add('failed', 117, host='host2', task='install', role='swift')
+        self.add('task', 118, name='start', role='nova')
+        self.add('ok', 119, host='host1', task='start', role='nova')
+
+    def test_running(self):
+        self.run_play()
+        summary = self.profile.summary(now=121)
+
+        self.assertFalse(summary['finished'])
+        self.assertEqual(21, summary['elapsed'])
+        self.assertEqual({'role': 'nova', 'name': 'start', 'time': 3},
+                         summary['current'])
+        self.assertEqual(
+            [{'role': 'swift', 'name': 'install', 'time': 11, 'count': 1},
+             {'role': 'nova', 'name': 'install', 'time': 6, 'count': 1},
+             {'role': 'nova', 'name': 'start', 'time': 4, 'count': 2}],
+            summary['tasks'])
+        self.assertEqual([{'name': 'swift', 'time': 11},
+                          {'name': 'nova', 'time': 10}],
+                         summary['roles'])
+        self.assertEqual([{'name': 'host2', 'time': 15, 'results': 2},
+                          {'name': 'host1', 'time': 4, 'results': 3}],
+                         summary['hosts'])
+
+        # The running task is not counted twice
+        self.assertEqual(summary, self.profile.summary(now=121))
+
+    def test_finished(self):
+        self.run_play()
+        self.add('stats', 120, hosts={})
+        summary = self.profile.summary(now=1000)
+
+        self.assertTrue(summary['finished'])
+        self.assertEqual(20, summary['elapsed'])
+        self.assertIsNone(summary['current'])
+        self.assertEqual({'name': 'nova', 'time': 9}, summary['roles'][1])
+
+    def test_ignores_invalid_events(self):
+        self.profile.add({'event': 'task'})
+        self.profile.add({'event': 'ok', 'time': 'x'})
+        self.assertEqual([], self.profile.summary()['tasks'])
+
+    def test_save(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            self.run_play()
+            self.add('stats', 120, hosts={})
+            filename = os.path.join(temp_dir, '1_1.profile')
+            self.profile.save(filename)
+            with open(filename) as f:
+                self.assertEqual(self.profile.summary(), json.load(f))
+            self.assertEqual(['1_1.profile'], os.listdir(temp_dir))
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,86 @@
+import unittest
+
+from .. import play_summary
+
+OUTPUT_2 = """
+PLAY [compute] *****
+
+TASK [nova : install] *****
+ok: [host1]
+fatal: [host2]: FAILED! => {"changed": false, "msg": "No package"}
+fatal: [host3]: UNREACHABLE! => {"changed": false, "unreachable": true}
+
+TASK [nova : check] *****
+fatal: [host1]: FAILED! => {"changed": false}
+...ignoring
+
+RUNNING HANDLER [nova : restart] *****
+failed: [host1] (item=api) => {"item": "api"}
+failed: [host1] (item=scheduler) => {"item": "scheduler"}
+
+PLAY RECAP *****
+host1                      : ok=2    changed=0    unreachable=0    failed=1
+host2                      : ok=0    changed=0    unreachable=0    failed=1
+host3                      : ok=0    changed=0    unreachable=1    failed=0
+
+"""
+
+OUTPUT_1_9 = """
+TASK: [nova | install] *****
+failed: [host2] => {"failed": true}
+
+PLAY RECAP *****
+host2                      : ok=0    changed=0    unreachable=0    failed=1
+"""
+
+
+class TestPlaySummary(unittest.TestCase):
+
+    def feed(self, output):
+        summary = play_summary.PlaySummary()
+        changes = [line for line in output.splitlines(True)
+                   if summary.feed(line)]
+        return summary, changes
+
+    def test_ansible_2(self):
+        summary, changes = self.feed(OUTPUT_2)
+        self.assertEqual([{'host': 'host2', 'task': 'nova : install'},
+                          {'host': 'host1', 'task': 'nova : restart'}],
+                         summary.failures)
+        self.assertEqual(['host3'], summary.unreachable)
+        self.assertEqual({'ok': 2, 'changed': 0, 'unreachable': 0,
+                          'failed': 1}, summary.recap['host1'])
+        self.assertEqual(['host1', 'host2', 'host3'], sorted(summary.recap))
+        self.assertEqual(5, len(changes))
+
+    def test_ansible_1_9(self):
+        summary, changes = self.feed(OUTPUT_1_9)
+        self.assertEqual([{'host': 'host2', 'task': 'nova | install'}],
+                         summary.failures)
+        self.assertEqual({'host2': {'ok': 0, 'changed': 0,
+                                    'unreachable': 0, 'failed': 1}},
+                         summary.recap)
+
+    def test_unreachable_from_recap(self):
+        summary, changes = self.feed(
+            'PLAY RECAP ***\n'
+            'host1 : ok=0 changed=0 unreachable=1 failed=0\n')
+        self.assertEqual(['host1'], summary.unreachable)
+
+    def test_colored(self):
+        summary, changes = self.feed(
+            '\x1b[0;32mTASK [install] ***\x1b[0m\n'
+            '\x1b[0;31mfatal: [host1]: FAILED! => {}\x1b[0m\n')
+        self.assertEqual([{'host': 'host1', 'task': 'install'}],
+                         summary.failures)
+
+    def test_limit(self):
+        summary, changes = self.feed(''.join(
+            'fatal: [host%d]: FAILED! => {}\n' % i
+            for i in range(play_summary.MAX_FAILURES + 10)))
+        self.assertEqual(play_summary.MAX_FAILURES, len(summary.failures))
+
+    def test_fields(self):
+        summary, changes = self.feed('')
+        self.assertEqual({'failures': [], 'unreachable': [], 'recap': None},
+                         summary.fields())
@@ -0,0 +1,632 @@
+import eventlet
+import fcntl
+import flask
+import gzip
+import imp
+import json
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import time
+import unittest
+
+from .. import log_index
+from .. import playbooks
+from .. import socketio
+from .. import task_registry
+from .. import tasks
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.saved_logs_dir = playbooks.LOGS_DIR
+        playbooks.LOGS_DIR = self.temp_dir
+        self.saved_playbooks_dir = playbooks.PLAYBOOKS_DIR
+        playbooks.PLAYBOOKS_DIR = self.temp_dir
+
+        self.app = flask.Flask(__name__)
+        self.app.register_blueprint(playbooks.bp)
+        self.app.register_blueprint(tasks.bp)
+        socketio.init_app(self.app)
+        self.client = self.app.test_client()
+
+        self.saved_scheduler = playbooks.scheduler
+        self.scheduler = playbooks.Scheduler(1, playbooks.OutputReader())
+        playbooks.scheduler = self.scheduler
+        self.saved_registry = playbooks.registry
+        playbooks.registry = task_registry.TaskRegistry(
+            os.path.join(self.temp_dir, 'tasks.db'))
+
+    def tearDown(self):
+        for task in playbooks.registry.list(limit=-1)[0]:
+            self.wait(task['id'])
+        playbooks.registry.close()
+        playbooks.registry = self.saved_registry
+        playbooks.scheduler = self.saved_scheduler
+        playbooks.LOGS_DIR = self.saved_logs_dir
+        playbooks.PLAYBOOKS_DIR = self.saved_playbooks_dir
+        shutil.rmtree(self.temp_dir)
+
+    def wait(self, id, timeout=10):
+        deadline = time.time() + timeout
+        while self.status(id) in (playbooks.QUEUED, playbooks.RUNNING):
+            self.assertLess(time.time(), deadline)
+            eventlet.sleep(0.01)
+        return playbooks.registry.get(id)
+
+    def status(self, id):
+        return playbooks.registry.get(id)['status']
+
+    def test_run(self):
+        id, created = self.scheduler.submit(['echo', 'hello'])
+        self.assertTrue(created)
+
+        task = self.wait(id)
+        self.assertEqual(playbooks.COMPLETE, task['status'])
+        self.assertEqual(0, task['code'])
+        self.assertEqual(6, task['log_size'])
+        with open(playbooks.get_log_file(id)) as f:
+            self.assertEqual('hello\n', f.read())
+
+    def test_stderr(self):
+        events = []
+        self.saved_emit = socketio.emit
+        socketio.emit = lambda event, msg, room: events.append((event, msg))
+        try:
+            id, created = self.scheduler.submit(
+                ['sh', '-c', 'echo out; sleep 0.1; echo err >&2; sleep 0.1; '
+                             'printf last'])
+            self.wait(id)
+        finally:
+            socketio.emit = self.saved_emit
+
+        with open(playbooks.get_log_file(id)) as f:
+            self.assertEqual('out\nerr\nlast', f.read())
+        self.assertEqual([('log', id + ' out\n'),
+                          ('stderr', id + ' err\n'),
+                          ('log', id + ' last')], events)
+
+    def test_events(self):
+        events = []
+        self.saved_emit = socketio.emit
+        socketio.emit = lambda event, msg, room: events.append((event, msg))
+        try:
+            id, created = self.scheduler.submit([sys.executable, '-c', (
+                'import os, time\n'
+                'fd = int(os.environ["ARDANA_EVENT_FD"])\n'
+                'os.write(fd, b\'{"event": "play"}\\ninvalid\\n\')\n'
+                'time.sleep(0.1)\n'
+                'os.write(fd, b\'{"event": "stats"}\')\n')])
+            self.wait(id)
+        finally:
+            socketio.emit = self.saved_emit
+
+        self.assertEqual(
+            [('events', {'id': id, 'events': [{'event': 'play'}]}),
+             ('events', {'id': id, 'events': [{'event': 'stats'}]})],
+            [e for e in events if e[0] == 'events'])
+
+    def test_profile(self):
+        id, created = self.scheduler.submit([sys.executable, '-c', (
+            'import os\n'
+            'fd = int(os.environ["ARDANA_EVENT_FD"])\n'
+            'os.write(fd, b\'{"event": "task", "time": 1, "name": "t", '
+            '"role": "r"}\\n\')\n'
+            'os.write(fd, b\'{"event": "ok", "time": 3, "task": "t", '
+            '"role": "r", "host": "h"}\\n\')\n'
+            'os.write(fd, b\'{"event": "stats", "time": 4, "hosts": {}}\')\n'
+        )])
+        self.wait(id)
+        self.assertNotIn(id, playbooks.live_profiles)
+
+        response = self.client.get('/api/v2/plays/%s/profile' % id)
+        self.assertEqual(200, response.status_code)
+        profile = json.loads(response.get_data())
+        self.assertTrue(profile['finished'])
+        self.assertEqual([{'role': 'r', 'name': 't', 'time': 3, 'count': 1}],
+                         profile['tasks'])
+        self.assertEqual([{'name': 'h', 'time': 2, 'results': 1}],
+                         profile['hosts'])
+
+        # Nothing to profile without events
+        id, created = self.scheduler.submit(['true'])
+        self.wait(id)
+        response = self.client.get('/api/v2/plays/%s/profile' % id)
+        self.assertEqual(404, response.status_code)
+
+    def test_event_pipe_not_inherited(self):
+        # A long running process started by another task must not keep the
+        # events pipe of this one open
+        self.scheduler.max_running = 2
+        sleeper, created = self.scheduler.submit(['sleep', '1'])
+        id, created = self.scheduler.submit(['true'])
+        started = time.time()
+        self.wait(id)
+        self.assertLess(time.time() - started, 0.9)
+        self.wait(sleeper)
+
+    def test_event_plugin_env(self):
+        env = playbooks.event_plugin_env({'PATH': '/bin'})
+        self.assertEqual('/bin', env['PATH'])
+        self.assertEqual(playbooks.CALLBACK_PLUGINS_DIR,
+                         env['ANSIBLE_CALLBACK_PLUGINS'])
+        self.assertEqual('ardana_events', env['ANSIBLE_CALLBACK_WHITELIST'])
+
+        env = playbooks.event_plugin_env(
+            {'ANSIBLE_CALLBACK_PLUGINS': '/plugins',
+             'ANSIBLE_CALLBACK_WHITELIST': 'profile_tasks'})
+        self.assertEqual(playbooks.CALLBACK_PLUGINS_DIR + ':/plugins',
+                         env['ANSIBLE_CALLBACK_PLUGINS'])
+        self.assertEqual('ardana_events,profile_tasks',
+                         env['ANSIBLE_CALLBACK_WHITELIST'])
+
+        self.assertTrue(os.path.exists(os.path.join(
+            playbooks.CALLBACK_PLUGINS_DIR, 'ardana_events.py')))
+
+    def test_summary(self):
+        id, created = self.scheduler.submit(
+            ['printf', 'TASK [install] ***\\n'
+                       'fatal: [host1]: FAILED! => {}\\n'
+                       'PLAY RECAP ***\\n'
+                       'host1 : ok=0 changed=0 unreachable=0 failed=1\\n'])
+        task = self.wait(id)
+        self.assertEqual([{'host': 'host1', 'task': 'install'}],
+                         task['failures'])
+        self.assertEqual([], task['unreachable'])
+        self.assertEqual({'host1': {'ok': 0, 'changed': 0, 'unreachable': 0,
+                                    'failed': 1}}, task['recap'])
+
+    def test_large_stderr(self):
+        # More than fits in a pipe, so the process would block if stderr
+        # were not read
+        id, created = self.scheduler.submit(
+            ['sh', '-c', 'head -c 1000000 /dev/zero | tr "\\0" e >&2; '
+                         'echo done'])
+        self.assertEqual(playbooks.COMPLETE, self.wait(id)['status'])
+        self.assertEqual(1000005, os.path.getsize(playbooks.get_log_file(id)))
+
+    def test_concurrent_runs(self):
+        self.scheduler.max_running = 10
+        ids = [self.scheduler.submit(['sh', '-c', 'seq %d; sleep 0.1' % i])[0]
+               for i in range(1, 11)]
+        for i, id in enumerate(ids, 1):
+            self.assertEqual(playbooks.COMPLETE, self.wait(id)['status'])
+            with open(playbooks.get_log_file(id)) as f:
+                self.assertEqual(''.join('%d\n' % n for n in range(1, i + 1)),
+                                 f.read())
+
+    def test_failed_run(self):
+        id, created = self.scheduler.submit(['false'])
+        task = self.wait(id)
+        self.assertEqual(playbooks.FAILED, task['status'])
+        self.assertEqual(1, task['code'])
+
+    def test_unable_to_start(self):
+        id, created = self.scheduler.submit(['/doesnotexist'])
+        self.assertEqual(playbooks.FAILED, self.status(id))
+        self.assertIsNotNone(playbooks.registry.get(id)['error'])
+
+    def test_queued_beyond_limit(self):
+        first, created = self.scheduler.submit(['sleep', '0.2'])
+        second, created = self.scheduler.submit(['echo', 'second'])
+        self.assertEqual(playbooks.RUNNING, self.status(first))
+        self.assertEqual(playbooks.QUEUED, self.status(second))
+        self.assertEqual([second], self.scheduler.queued())
+
+        self.wait(first)
+        self.assertEqual(playbooks.COMPLETE, self.wait(second)['status'])
+        self.assertLessEqual(playbooks.registry.get(first)['end_time'],
+                             playbooks.registry.get(second)['start_time'])
+
+    def test_priority(self):
+        self.scheduler.submit(['sleep', '0.2'])
+        low, created = self.scheduler.submit(['echo', 'low'], priority=-1)
+        normal, created = self.scheduler.submit(['echo', 'normal'])
+        high, created = self.scheduler.submit(['echo', 'high'], priority=5)
+        later, created = self.scheduler.submit(['echo', 'later'])
+
+        self.assertEqual([high, normal, later, low], self.scheduler.queued())
+
+    def test_duplicate(self):
+        first, created = self.scheduler.submit(['sleep', '0.2'])
+        second, created = self.scheduler.submit(['sleep', '0.2'])
+        self.assertEqual(first, second)
+        self.assertFalse(created)
+
+        other, created = self.scheduler.submit(['sleep', '0.2'], cwd='/')
+        self.assertNotEqual(first, other)
+        self.assertTrue(created)
+
+        # Once finished, the same command runs again
+        self.wait(first)
+        again, created = self.scheduler.submit(['sleep', '0.2'])
+        self.assertNotEqual(first, again)
+        self.assertTrue(created)
+
+    def test_post_playbook(self):
+        with open(os.path.join(self.temp_dir, 'deploy.yml'), 'w') as f:
+            f.write('- hosts: localhost\n')
+        self.scheduler.submit(['sleep', '0.2'])
+
+        response = self.client.post('/api/v2/playbooks/deploy?priority=3')
+        self.assertEqual(202, response.status_code)
+        location = response.headers['Location']
+
+        response = self.client.get(location)
+        self.assertEqual(200, response.status_code)
+        task = json.loads(response.get_data())
+        self.assertEqual(playbooks.QUEUED, task['status'])
+        self.assertEqual(3, task['priority'])
+        self.assertEqual('ansible-playbook', task['command'][0])
+
+        # The same playbook is not queued twice
+        response = self.client.post('/api/v2/playbooks/deploy')
+        self.assertEqual(location, response.headers['Location'])
+
+    def test_log_lines(self):
+        lines = ''.join('%d\n' % i for i in range(3000))
+        id, created = self.scheduler.submit(['seq', '0', '2999'])
+        self.wait(id)
+        url = '/api/v2/plays/%s/log' % id
+
+        response = self.client.get(url)
+        self.assertEqual(lines, response.get_data())
+
+        response = self.client.get(url + '?tail=3')
+        self.assertEqual('2997\n2998\n2999\n', response.get_data())
+        self.assertEqual('2997', response.headers['X-Log-Line-Offset'])
+
+        response = self.client.get(url + '?offset=1500&limit=2')
+        self.assertEqual('1500\n1501\n', response.get_data())
+        self.assertEqual('1500', response.headers['X-Log-Line-Offset'])
+
+        response = self.client.get(url + '?offset=2998')
+        self.assertEqual('2998\n2999\n', response.get_data())
+
+        response = self.client.get(url + '?offset=5')
+        self.assertEqual(playbooks.LOG_LINES_DEFAULT,
+                         response.get_data().count('\n'))
+
+        response = self.client.get(
+            url + '?tail=%d' % (playbooks.LOG_LINES_MAX + 1))
+        self.assertEqual(400, response.status_code)
+        response = self.client.get(
+            url + '?offset=0&limit=%d' % (playbooks.LOG_LINES_MAX + 1))
+        self.assertEqual(400, response.status_code)
+
+        response = self.client.get(url, headers={'Range': 'bytes=0-3'})
+        self.assertEqual(206, response.status_code)
+        self.assertEqual('0\n1\n', response.get_data())
+
+    def test_compressed_log(self):
+        lines = ''.join('%d\n' % i for i in range(3000))
+        id, created = self.scheduler.submit(['seq', '0', '2999'])
+        self.wait(id)
+        log_index.compress(playbooks.get_log_file(id))
+        url = '/api/v2/plays/%s/log' % id
+
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(lines, response.get_data())
+
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual(lines, gzip.GzipFile(
+            fileobj=StringIO.StringIO(response.get_data())).read())
+
+        response = self.client.get(url + '?tail=3')
+        self.assertEqual('2997\n2998\n2999\n', response.get_data())
+
+        sent = []
+        self.assertEqual(26, playbooks.send_log(id, sent.append, 20, 26))
+        self.assertEqual(['10\n11\n'], sent)
+
+    def test_log_in_use(self):
+        first, created = self.scheduler.submit(['sleep', '0.2'])
+        second, created = self.scheduler.submit(['true'])
+        self.assertTrue(playbooks.log_in_use(first))
+        # Queued tasks (e.g. of another process) have no live log yet
+        self.assertNotIn(second, playbooks.live_logs)
+        self.assertTrue(playbooks.log_in_use(second))
+
+        self.wait(second)
+        self.assertFalse(playbooks.log_in_use(first))
+        self.assertFalse(playbooks.log_in_use(second))
+        self.assertFalse(playbooks.log_in_use('doesnotexist'))
+
+    def test_log_errors(self):
+        response = self.client.get('/api/v2/plays/doesnotexist/log?tail=5')
+        self.assertEqual(404, response.status_code)
+
+        response = self.client.get('/api/v2/plays/1_1/log?tail=-1')
+        self.assertEqual(400, response.status_code)
+
+        response = self.client.get('/api/v2/plays/1_1/log?tail=x')
+        self.assertEqual(400, response.status_code)
+
+        response = self.client.get('/api/v2/plays/..%2f..%2fetc/log?tail=5')
+        self.assertEqual(404, response.status_code)
+
+    def test_list_tasks(self):
+        first, created = self.scheduler.submit(['true'])
+        self.wait(first)
+        second, created = self.scheduler.submit(['false'])
+        self.wait(second)
+
+        response = self.client.get('/api/v2/tasks')
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.get_data())
+        self.assertEqual(2, data['total'])
+        self.assertEqual([second, first], [t['id'] for t in data['tasks']])
+
+        response = self.client.get('/api/v2/tasks?status=failed')
+        data = json.loads(response.get_data())
+        self.assertEqual([second], [t['id'] for t in data['tasks']])
+
+        response = self.client.get('/api/v2/tasks?limit=1&offset=1')
+        data = json.loads(response.get_data())
+        self.assertEqual(2, data['total'])
+        self.assertEqual([first], [t['id'] for t in data['tasks']])
+
+        response = self.client.get('/api/v2/tasks?limit=x')
+        self.assertEqual(400, response.status_code)
+
+    def test_unknown_task(self):
+        response = self.client.get('/api/v2/tasks/doesnotexist')
+        self.assertEqual(404, response.status_code)
+
+
+class TestLogBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.messages = []
+        self.saved_emit = socketio.emit
+        socketio.emit = self.emit
+        self.log = StringIO.StringIO()
+
+    def tearDown(self):
+        socketio.emit = self.saved_emit
+
+    def emit(self, event, msg, room=None):
+        self.assertEqual('log', event)
+        self.assertEqual('1_1', room)
+        self.messages.append(msg)
+
+    def lines(self, count):
+        return ['line %d\n' % i for i in range(count)]
+
+    def test_batched_by_time(self):
+        batcher = playbooks.LogBatcher('1_1', self.log, 0.05, 1000)
+        for line in self.lines(3):
+            batcher.add(line)
+        self.assertEqual([], self.messages)
+        self.assertEqual('', self.log.getvalue())
+
+        eventlet.sleep(0.1)
+        self.assertEqual(['1_1 line 0\nline 1\nline 2\n'], self.messages)
+        self.assertEqual(''.join(self.lines(3)), self.log.getvalue())
+
+    def test_batched_by_size(self):
+        batcher = playbooks.LogBatcher('1_1', self.log, 10, 20)
+        for line in self.lines(6):
+            batcher.add(line)
+
+        self.assertEqual(['1_1 line 0\nline 1\nline 2\n',
+                          '1_1 line 3\nline 4\nline 5\n'], self.messages)
+
+    def test_unbatched(self):
+        batcher = playbooks.LogBatcher('1_1', self.log, 0, 1000)
+        for line in self.lines(3):
+            batcher.add(line)
+        self.assertEqual(['1_1 ' + line for line in self.lines(3)],
+                         self.messages)
+
+    def test_lossless(self):
+        batcher = playbooks.LogBatcher('1_1', self.log, 0.01, 500)
+        lines = self.lines(1000)
+        for i, line in enumerate(lines):
+            batcher.add(line)
+            if i % 100 == 0:
+                eventlet.sleep(0.02)
+        batcher.flush()
+
+        self.assertEqual(''.join(lines), self.log.getvalue())
+        self.assertEqual(''.join(lines),
+                         ''.join(m[len('1_1 '):] for m in self.messages))
+        self.assertLess(len(self.messages), 100)
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.saved_logs_dir = playbooks.LOGS_DIR
+        playbooks.LOGS_DIR = self.temp_dir
+
+        self.app = flask.Flask(__name__)
+        socketio.init_app(self.app)
+        self.id = '1_1'
+        self.f = open(playbooks.get_log_file(self.id), 'wb')
+
+    def tearDown(self):
+        self.f.close()
+        playbooks.live_logs.clear()
+        playbooks.LOGS_DIR = self.saved_logs_dir
+        shutil.rmtree(self.temp_dir)
+
+    def batcher(self, buffer_size=1000):
+        batcher = playbooks.LogBatcher(self.id, self.f, 0, 1000, buffer_size)
+        playbooks.live_logs[self.id] = batcher
+        return batcher
+
+    def replay(self, batcher, offset):
+        sent = []
+        joined = []
+        batcher.replay(offset, sent.append, joined.append)
+        return ''.join(sent) + joined[0]
+
+    def received(self, client):
+        return [(m['name'], m['args'][0]) for m in client.get_received()]
+
+    def test_replay_from_memory(self):
+        batcher = self.batcher()
+        for line in ('one\n', 'two\n', 'three\n'):
+            batcher.add(line)
+
+        self.assertEqual('one\ntwo\nthree\n', self.replay(batcher, 0))
+        self.assertEqual('wo\nthree\n', self.replay(batcher, 5))
+        self.assertEqual('', self.replay(batcher, 14))
+
+        # Nothing is read from the log
+        os.unlink(playbooks.get_log_file(self.id))
+        self.assertEqual('one\ntwo\nthree\n', self.replay(batcher, 0))
+
+    def test_replay_evicted(self):
+        batcher = self.batcher(buffer_size=10)
+        lines = ['line %d\n' % i for i in range(10)]
+        for line in lines:
+            batcher.add(line)
+        self.assertLess(len(batcher._recent), 3)
+
+        self.assertEqual(''.join(lines), self.replay(batcher, 0))
+        self.assertEqual(''.join(lines)[10:], self.replay(batcher, 10))
+
+    def test_join_running(self):
+        batcher = self.batcher()
+        batcher.add('before\n')
+
+        client = socketio.test_client(self.app)
+        client.emit('join', self.id)
+        batcher.add('after\n')
+
+        self.assertEqual([('log', '1_1 before\n'), ('log', '1_1 after\n')],
+                         self.received(client))
+
+    def test_join_with_offset(self):
+        batcher = self.batcher()
+        batcher.add('before\n')
+        batcher.add('more\n')
+
+        client = socketio.test_client(self.app)
+        client.emit('join', {'id': self.id, 'offset': 7})
+        self.assertEqual([('log', '1_1 more\n')], self.received(client))
+
+    def test_join_finished(self):
+        self.f.write('line 1\nline 2\n')
+        self.f.flush()
+
+        client = socketio.test_client(self.app)
+        client.emit('join', self.id)
+        self.assertEqual([('log', '1_1 line 1\nline 2\n')],
+                         self.received(client))
+
+    def test_join_large_log(self):
+        lines = ''.join('line %d\n' % i for i in range(20000))
+        self.f.write(lines)
+        self.f.flush()
+
+        client = socketio.test_client(self.app)
+        client.emit('join', self.id)
+        received = self.received(client)
+        self.assertGreater(len(received), 1)
+        for name, text in received:
+            self.assertLessEqual(len(text), playbooks.READ_SIZE + 4)
+            self.assertTrue(text.endswith('\n'))
+        self.assertEqual(lines, ''.join(text[4:] for name, text in received))
+
+    def test_send_log_long_line(self):
+        line = 'x' * (2 * playbooks.READ_SIZE + 10) + '\n'
+        self.f.write(line + 'end')
+        self.f.flush()
+
+        sent = []
+        self.assertEqual(len(line) + 3,
+                         playbooks.send_log(self.id, sent.append))
+        self.assertEqual(line + 'end', ''.join(sent))
+        self.assertTrue(all(len(text) <= playbooks.READ_SIZE
+                            for text in sent))
+
+    def test_join_invalid_offset(self):
+        batcher = self.batcher()
+        batcher.add('before\n')
+        batcher.add('more\n')
+
+        for offset, expected in (('7', 'more\n'), (7.0, 'more\n'),
+                                 (-1, 'before\nmore\n'),
+                                 ('x', 'before\nmore\n'),
+                                 (None, 'before\nmore\n')):
+            client = socketio.test_client(self.app)
+            client.emit('join', {'id': self.id, 'offset': offset})
+            self.assertEqual([('log', '1_1 ' + expected)],
+                             self.received(client))
+
+    def test_join_invalid_id(self):
+        for data in ({'offset': 0}, {'id': 5}, None, '', '../1_1'):
+            client = socketio.test_client(self.app)
+            client.emit('join', data)
+            self.assertEqual([], self.received(client))
+
+    def test_join_queued(self):
+        client = socketio.test_client(self.app)
+        client.emit('join', '2_2')
+        self.assertEqual([], self.received(client))
+
+        socketio.emit('log', '2_2 started\n', room='2_2')
+        self.assertEqual([('log', '2_2 started\n')], self.received(client))
+
+
+class TestEventPlugin(unittest.TestCase):
+
+    def setUp(self):
+        plugin = imp.load_source('ardana_events', os.path.join(
+            playbooks.CALLBACK_PLUGINS_DIR, 'ardana_events.py'))
+        self.r, w = os.pipe()
+        os.environ[playbooks.EVENT_FD_VAR] = str(w)
+        try:
+            self.callback = plugin.CallbackModule()
+        finally:
+            del os.environ[playbooks.EVENT_FD_VAR]
+
+    def tearDown(self):
+        os.close(self.r)
+        os.close(self.callback.fd)
+
+    def test_fd_not_inherited(self):
+        flags = fcntl.fcntl(self.callback.fd, fcntl.F_GETFD)
+        self.assertTrue(flags & fcntl.FD_CLOEXEC)
+
+    def events(self):
+        return [json.loads(line) for line in
+                os.read(self.r, 65536).splitlines()]
+
+    def test_ansible_1_9_callbacks(self):
+        class Stats(object):
+            processed = {'host1': 1}
+
+            def summarize(self, host):
+                return {'ok': 1, 'changed': 1, 'failures': 0}
+
+        self.callback.playbook_on_play_start('site')
+        self.callback.playbook_on_task_start('nova | start', False)
+        self.callback.runner_on_ok('host1', {'changed': True})
+        self.callback.runner_on_failed('host2', {}, ignore_errors=True)
+        self.callback.playbook_on_stats(Stats())
+
+        events = self.events()
+        for event in events:
+            self.assertIsInstance(event.pop('time'), float)
+        self.assertEqual(
+            [{'event': 'play', 'name': 'site'},
+             {'event': 'task', 'name': 'start', 'role': 'nova'},
+             {'event': 'changed', 'host': 'host1', 'task': 'start',
+              'role': 'nova'},
+             {'event': 'failed', 'host': 'host2', 'task': 'start',
+              'role': 'nova', 'ignored': True},
+             {'event': 'stats', 'hosts': {
+                 'host1': {'ok': 1, 'changed': 1, 'failures': 0}}}],
+            events)
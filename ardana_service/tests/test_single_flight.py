@@ -0,0 +1,76 @@
+import eventlet
+import unittest
+
+from .. import single_flight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = single_flight.SingleFlight('test')
+        self.executions = []
+
+    def slow(self, value):
+        self.executions.append(value)
+        eventlet.sleep(0.05)
+        return [value]
+
+    def failing(self):
+        self.executions.append(None)
+        eventlet.sleep(0.05)
+        raise ValueError("failed")
+
+    def test_concurrent_calls_are_shared(self):
+        threads = [eventlet.spawn(self.flight.do, 'key', self.slow, 1)
+                   for i in range(5)]
+        results = [t.wait() for t in threads]
+
+        self.assertEqual([1], self.executions)
+        for result in results:
+            self.assertIs(results[0], result)
+        self.assertEqual({'calls': 5, 'executions': 1, 'shared': 4,
+                          'errors': 0, 'inFlight': 0}, self.flight.stats())
+
+    def test_different_keys(self):
+        threads = [eventlet.spawn(self.flight.do, key, self.slow, key)
+                   for key in (1, 2, 1)]
+        self.assertEqual([[1], [2], [1]], [t.wait() for t in threads])
+        self.assertEqual([1, 2], self.executions)
+
+    def test_sequential_calls_are_not_shared(self):
+        self.flight.do('key', self.slow, 1)
+        self.flight.do('key', self.slow, 1)
+        self.assertEqual([1, 1], self.executions)
+        self.assertEqual(0, self.flight.stats()['shared'])
+
+    def test_exception_is_shared(self):
+        threads = [eventlet.spawn(self.flight.do, 'key', self.failing)
+                   for i in range(3)]
+        for thread in threads:
+            with self.assertRaises(ValueError):
+                thread.wait()
+
+        self.assertEqual([None], self.executions)
+        self.assertEqual(1, self.flight.stats()['errors'])
+
+        # The failure is not remembered
+        self.assertEqual([2], self.flight.do('key', self.slow, 2))
+
+    def test_interrupted_call(self):
+        leader = eventlet.spawn(self.flight.do, 'key', self.slow, 1)
+        eventlet.sleep(0)
+        follower = eventlet.spawn(self.flight.do, 'key', self.slow, 2)
+        eventlet.sleep(0)
+        leader.kill()
+
+        self.assertEqual([2], follower.wait())
+        self.assertEqual([1, 2], self.executions)
+        self.assertEqual(0, self.flight.stats()['inFlight'])
+
+    def test_timed_out_call(self):
+        with self.assertRaises(eventlet.Timeout):
+            with eventlet.Timeout(0.01):
+                self.flight.do('key', self.slow, 1)
+
+        self.assertEqual(0, self.flight.stats()['inFlight'])
+        self.assertEqual([2], self.flight.do('key', self.slow, 2))
@@ -0,0 +1,129 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from .. import task_registry
+
+
+class TestTaskRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'log', 'tasks.db')
+        self.registry = task_registry.TaskRegistry(self.path)
+
+    def tearDown(self):
+        self.registry.close()
+        shutil.rmtree(self.temp_dir)
+
+    def add(self, id, queue_time, status='queued'):
+        self.registry.add({'id': id,
+                           'status': status,
+                           'command': ['ansible-playbook', id],
+                           'priority': 0,
+                           'client_id': 'client',
+                           'queue_time': queue_time})
+
+    def test_add_and_update(self):
+        self.add('1_1', 1)
+        task = self.registry.get('1_1')
+        self.assertEqual('queued', task['status'])
+        self.assertEqual(['ansible-playbook', '1_1'], task['command'])
+
+        self.registry.update('1_1', status='running', pid=42, start_time=2)
+        self.assertEqual(42, self.registry.get('1_1')['pid'])
+
+        self.registry.update('1_1', status='complete', code=0, end_time=3,
+                             log_size=10)
+        task = self.registry.get('1_1')
+        self.assertEqual('complete', task['status'])
+        self.assertEqual(10, task['log_size'])
+        self.assertEqual('client', task['client_id'])
+
+        self.assertIsNone(self.registry.get('doesnotexist'))
+
+    def test_active_record_has_all_fields(self):
+        self.add('1_1', 1)
+        self.add('2_1', 2, 'complete')
+        active = self.registry.get('1_1')
+        finished = self.registry.get('2_1')
+        self.assertEqual(sorted(finished), sorted(active))
+        self.assertIsNone(active['pid'])
+
+    def test_returned_records_are_copies(self):
+        self.add('1_1', 1)
+        self.registry.get('1_1')['status'] = 'changed'
+        self.assertEqual('queued', self.registry.get('1_1')['status'])
+
+    def test_list(self):
+        for n in range(5):
+            self.add('%d_1' % n, n, 'complete' if n % 2 else 'failed')
+
+        tasks, total = self.registry.list()
+        self.assertEqual(5, total)
+        self.assertEqual(['4_1', '3_1', '2_1', '1_1', '0_1'],
+                         [t['id'] for t in tasks])
+
+        tasks, total = self.registry.list(limit=2, offset=1)
+        self.assertEqual(5, total)
+        self.assertEqual(['3_1', '2_1'], [t['id'] for t in tasks])
+
+        tasks, total = self.registry.list(status='complete')
+        self.assertEqual(2, total)
+        self.assertEqual(['3_1', '1_1'], [t['id'] for t in tasks])
+
+    def test_kept_across_restarts(self):
+        self.add('1_1', 1)
+        self.registry.update('1_1', status='complete', code=0)
+        self.add('2_1', 2)
+        self.add('3_1', 3)
+        self.registry.update('3_1', status='running')
+        self.registry.close()
+
+        self.registry = task_registry.TaskRegistry(self.path)
+        self.assertEqual('complete', self.registry.get('1_1')['status'])
+        for id in ('2_1', '3_1'):
+            task = self.registry.get(id)
+            self.assertEqual('failed', task['status'])
+            self.assertIn('restart', task['error'])
+            self.assertIsNotNone(task['end_time'])
+        self.assertIsNone(self.registry.get('1_1')['end_time'])
+
+    def test_json_fields(self):
+        self.add('1_1', 1)
+        self.registry.update('1_1', status='failed',
+                             failures=[{'host': 'host1', 'task': 'install'}],
+                             unreachable=['host2'],
+                             recap={'host1': {'failed': 1}})
+        self.registry.close()
+
+        self.registry = task_registry.TaskRegistry(self.path)
+        task = self.registry.get('1_1')
+        self.assertEqual([{'host': 'host1', 'task': 'install'}],
+                         task['failures'])
+        self.assertEqual(['host2'], task['unreachable'])
+        self.assertEqual({'host1': {'failed': 1}}, task['recap'])
+
+    def test_added_columns(self):
+        # A database written before the columns were added
+        os.makedirs(os.path.dirname(self.path))
+        db = sqlite3.connect(self.path)
+        db.execute('CREATE TABLE tasks (id TEXT PRIMARY KEY, '
+                   'status TEXT NOT NULL, command TEXT NOT NULL, '
+                   'priority INTEGER NOT NULL DEFAULT 0, client_id TEXT, '
+                   'queue_time INTEGER, start_time INTEGER, '
+                   'end_time INTEGER, pid INTEGER, code INTEGER, '
+                   'error TEXT, log_size INTEGER)')
+        db.execute("INSERT INTO tasks (id, status, command) "
+                   "VALUES ('1_1', 'complete', '[\"true\"]')")
+        db.commit()
+        db.close()
+
+        task = self.registry.get('1_1')
+        self.assertEqual('complete', task['status'])
+        self.assertIsNone(task['recap'])
+        self.registry.update('1_1', recap={'host1': {'ok': 1}})
+        self.assertEqual({'host1': {'ok': 1}},
+                         self.registry.get('1_1')['recap'])
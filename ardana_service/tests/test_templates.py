@@ -0,0 +1,124 @@
+import flask
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import model
+from .. import templates
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data')
+
+
+class TestTemplateCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.templates_dir = os.path.join(self.temp_dir, 'examples')
+        shutil.copytree(TEST_DATA_DIR, self.templates_dir)
+        self.snapshot_file = os.path.join(self.temp_dir, 'scratch',
+                                          'templates.pickle')
+
+        self.saved_catalog = templates.catalog
+        templates.catalog = self.new_catalog()
+
+        self.app = flask.Flask(__name__)
+        self.app.register_blueprint(templates.bp)
+        self.client = self.app.test_client()
+
+        self.saved_read_model = model.read_model
+        self.reads = []
+
+    def tearDown(self):
+        templates.catalog = self.saved_catalog
+        model.read_model = self.saved_read_model
+        shutil.rmtree(self.temp_dir)
+
+    def new_catalog(self):
+        return templates.TemplateCatalog(self.templates_dir,
+                                         self.snapshot_file)
+
+    def count_reads(self):
+        def read_model(model_dir, sections=None):
+            self.reads.append(os.path.basename(model_dir))
+            return self.saved_read_model(model_dir, sections)
+        model.read_model = read_model
+
+    def get_json(self, url):
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        return json.loads(response.data)
+
+    def test_all_templates(self):
+        data = self.get_json('/api/v2/templates')
+        self.assertEqual(['no_passthrough', 'one_passthrough',
+                          'two_passthroughs'],
+                         sorted(t['name'] for t in data))
+        for template in data:
+            self.assertEqual('/api/v2/templates/' + template['name'],
+                             template['href'])
+            self.assertTrue(template['overview'])
+
+    def test_template(self):
+        data = self.get_json('/api/v2/templates/one_passthrough')
+        expected = model.read_model(
+            os.path.join(self.templates_dir, 'one_passthrough'))
+        self.assertEqual(json.loads(flask.json.dumps(expected)), data)
+
+    def test_invalid_template(self):
+        response = self.client.get('/api/v2/templates/invalid_yml')
+        self.assertEqual(500, response.status_code)
+
+    def test_unknown_template(self):
+        response = self.client.get('/api/v2/templates/doesnotexist')
+        self.assertEqual(404, response.status_code)
+
+    def test_templates_read_once(self):
+        self.count_reads()
+        self.get_json('/api/v2/templates')
+        self.get_json('/api/v2/templates/one_passthrough')
+        self.get_json('/api/v2/templates/two_passthroughs')
+        self.assertEqual(sorted(os.listdir(self.templates_dir)),
+                         sorted(self.reads))
+
+    def test_snapshot_is_used(self):
+        expected = templates.catalog.get()
+        self.assertTrue(os.path.exists(self.snapshot_file))
+
+        self.count_reads()
+        catalog = self.new_catalog().get()
+        self.assertEqual([], self.reads)
+        self.assertEqual(expected['templates'], catalog['templates'])
+        self.assertEqual(expected['models'], catalog['models'])
+
+    def test_changed_template_invalidates_snapshot(self):
+        templates.catalog.get()
+
+        filename = os.path.join(self.templates_dir, 'no_passthrough',
+                                'data', 'new.yml')
+        with open(filename, 'w') as f:
+            f.write('foo: bar\n')
+
+        self.count_reads()
+        catalog = self.new_catalog().get()
+        self.assertIn('no_passthrough', self.reads)
+        self.assertIn('data/new.yml',
+                      catalog['models']['no_passthrough']['model']
+                      ['fileInfo']['files'])
+
+    def test_corrupt_snapshot_is_ignored(self):
+        os.mkdir(os.path.dirname(self.snapshot_file))
+        with open(self.snapshot_file, 'w') as f:
+            f.write('not a pickle')
+
+        data = self.get_json('/api/v2/templates')
+        self.assertEqual(3, len(data))
+
+    def test_etag(self):
+        response = self.client.get('/api/v2/templates/no_passthrough')
+        etag = response.headers['ETag'].strip('"')
+
+        response = self.client.get('/api/v2/templates/no_passthrough',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(304, response.status_code)
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import watcher
+
+
+class TestWatchers(object):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.temp_dir, 'data'))
+        self.touch('cloudConfig.yml')
+        self.watcher = self.create_watcher()
+
+    def tearDown(self):
+        self.watcher.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def touch(self, relname, contents='x'):
+        with open(os.path.join(self.temp_dir, relname), 'w') as f:
+            f.write(contents)
+
+    def test_no_changes(self):
+        self.assertEqual(set(), self.watcher.check(0))
+
+    def test_added_file(self):
+        self.touch('data/servers.yml')
+        self.assertEqual({'data/servers.yml'}, self.watcher.check(1))
+
+    def test_modified_file(self):
+        self.touch('cloudConfig.yml', 'longer contents')
+        self.assertEqual({'cloudConfig.yml'}, self.watcher.check(1))
+
+    def test_removed_file(self):
+        os.unlink(os.path.join(self.temp_dir, 'cloudConfig.yml'))
+        self.assertEqual({'cloudConfig.yml'}, self.watcher.check(1))
+
+    def test_added_directory(self):
+        os.mkdir(os.path.join(self.temp_dir, 'data', 'swift'))
+        self.touch('data/swift/rings.yml')
+        changed = self.watcher.check(1)
+        # Depending on timing, the file may be reported when its directory
+        # is first watched, or by its own event
+        self.assertEqual({'data/swift/rings.yml'}, changed)
+
+
+class TestPollingWatcher(TestWatchers, unittest.TestCase):
+
+    def create_watcher(self):
+        return watcher.PollingWatcher(self.temp_dir, None, 0)
+
+
+@unittest.skipUnless(watcher._load_libc(), "inotify is not available")
+class TestInotifyWatcher(TestWatchers, unittest.TestCase):
+
+    def create_watcher(self):
+        return watcher.InotifyWatcher(self.temp_dir, None,
+                                      watcher._load_libc())
+
+
+class TestStartWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_missing_directory(self):
+        path = os.path.join(self.temp_dir, 'model')
+        w = watcher.start_watcher(path, lambda changed: None, 0.01)
+        try:
+            self.assertIsInstance(w, watcher.PollingWatcher)
+            os.mkdir(path)
+            with open(os.path.join(path, 'cloudConfig.yml'), 'w') as f:
+                f.write('x')
+            self.assertEqual({'cloudConfig.yml'}, w.check(0))
+        finally:
+            w.stop()
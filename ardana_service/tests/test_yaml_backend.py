@@ -0,0 +1,60 @@
+import os
+import unittest
+import yaml
+
+from .. import yaml_backend
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data')
+
+
+class TestYamlBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_backend = yaml_backend.backend
+
+    def tearDown(self):
+        yaml_backend.set_backend(self.saved_backend)
+
+    def test_auto(self):
+        yaml_backend.set_backend(yaml_backend.AUTO)
+        if yaml.__with_libyaml__:
+            self.assertEqual('libyaml', yaml_backend.backend)
+        else:
+            self.assertEqual('python', yaml_backend.backend)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            yaml_backend.set_backend('ruamel')
+        self.assertEqual(self.saved_backend, yaml_backend.backend)
+
+    @unittest.skipUnless(yaml.__with_libyaml__, "PyYAML built without libyaml")
+    def test_backends_agree(self):
+        for root, dirs, files in os.walk(TEST_DATA):
+            for file in files:
+                if not file.endswith('.yml'):
+                    continue
+                with open(os.path.join(root, file)) as f:
+                    content = f.read()
+
+                results = []
+                for name in ('python', 'libyaml'):
+                    yaml_backend.set_backend(name)
+                    try:
+                        doc = yaml_backend.load(content)
+                    except yaml.YAMLError:
+                        # Some test models are invalid on purpose
+                        results.append(None)
+                        continue
+                    results.append((doc, yaml_backend.dump(doc)))
+
+                self.assertEqual(results[0], results[1], file)
+
+    def test_dump_format(self):
+        doc = {'servers': [{'id': 'one', 'roles': ['a', 'b']}]}
+        for name in yaml_backend.BACKENDS:
+            yaml_backend.set_backend(name)
+            self.assertEqual("servers:\n"
+                             "- id: one\n"
+                             "  roles:\n"
+                             "  - a\n"
+                             "  - b\n", yaml_backend.dump(doc))
@@ -0,0 +1,236 @@
+"""Watch a directory tree for changes to the files within it
+
+Changes are reported to a callback as a set of file paths relative to the
+watched directory, or as None when the watcher lost track of events and
+everything below the directory should be considered changed.
+
+inotify is used where the platform provides it (via libc, so no extra
+packages are needed), otherwise the tree is polled for changes in the
+stat info of its files.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+# Subset of the constants in <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF)
+
+# struct inotify_event: wd, mask, cookie, len, followed by len bytes of name
+EVENT_HEADER = struct.Struct('iIII')
+
+# Time to wait for a burst of events (e.g. a model save) to finish before
+# reporting it
+SETTLE_TIME = 0.1
+
+
+def _load_libc():
+    name = ctypes.util.find_library('c') or 'libc.so.6'
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class Watcher(object):
+
+    def __init__(self, path, callback):
+        self.path = path
+        self.callback = callback
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                changed = self.check()
+                if changed is None or changed:
+                    self.callback(changed)
+            except Exception as e:
+                LOG.exception(e)
+
+
+class PollingWatcher(Watcher):
+
+    def __init__(self, path, callback, interval):
+        super(PollingWatcher, self).__init__(path, callback)
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for root, dirs, files in os.walk(self.path):
+            for file in files:
+                filename = os.path.join(root, file)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                relname = os.path.relpath(filename, self.path)
+                snapshot[relname] = (st.st_mtime, st.st_size, st.st_ino)
+        return snapshot
+
+    def check(self, timeout=None):
+        time.sleep(self.interval if timeout is None else timeout)
+
+        snapshot = self._take_snapshot()
+        changed = set(snapshot.keys()) ^ set(self._snapshot.keys())
+        changed.update(k for k, v in snapshot.items()
+                       if k in self._snapshot and self._snapshot[k] != v)
+        self._snapshot = snapshot
+        return changed
+
+
+class InotifyWatcher(Watcher):
+
+    def __init__(self, path, callback, libc):
+        super(InotifyWatcher, self).__init__(path, callback)
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        # Map of watch descriptors to the directories they watch
+        self._dirs = {}
+        self._add_tree(path)
+
+    def _add_tree(self, top):
+        added = set()
+        for root, dirs, files in os.walk(top):
+            path = root
+            if not isinstance(path, bytes):
+                path = path.encode(sys.getfilesystemencoding())
+            wd = self._libc.inotify_add_watch(self._fd, path, WATCH_MASK)
+            if wd < 0:
+                LOG.warning("Unable to watch %s", root)
+                continue
+            self._dirs[wd] = root
+            added.update(os.path.relpath(os.path.join(root, f), self.path)
+                         for f in files)
+        return added
+
+    def _read_events(self, changed):
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return changed
+            raise
+
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, so nothing can be trusted
+                LOG.warning("inotify queue overflowed for %s", self.path)
+                changed = None
+                continue
+
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+
+            directory = self._dirs.get(wd)
+            if directory is None or changed is None:
+                continue
+
+            if mask & IN_DELETE_SELF:
+                if directory == self.path:
+                    changed = None
+                continue
+
+            if not isinstance(name, str):
+                name = name.decode(sys.getfilesystemencoding())
+            filename = os.path.join(directory, name)
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(self._add_tree(filename))
+                elif mask & IN_MOVED_FROM:
+                    # The files that were in the directory are not reported
+                    # individually
+                    changed = None
+            elif not mask & IN_CREATE:
+                # Creation is followed by IN_CLOSE_WRITE once the file has
+                # been written, which is when it should be reported
+                changed.add(os.path.relpath(filename, self.path))
+
+        return changed
+
+    def check(self, timeout=1.0):
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = self._read_events(set())
+
+        # Collect the rest of the burst
+        while True:
+            readable, _, _ = select.select([self._fd], [], [], SETTLE_TIME)
+            if not readable:
+                return changed
+            changed = self._read_events(changed)
+
+    def stop(self):
+        super(InotifyWatcher, self).stop()
+        os.close(self._fd)
+
+
+def start_watcher(path, callback, interval):
+    """Watch path, calling callback with the set of changed files"""
+
+    libc = _load_libc()
+    watcher = None
+    if not os.path.isdir(path):
+        # inotify can only watch directories that exist, while polling picks
+        # up the files whenever the directory is created
+        LOG.warning("%s does not exist (yet)", path)
+    elif libc:
+        try:
+            watcher = InotifyWatcher(path, callback, libc)
+        except OSError as e:
+            LOG.warning("Unable to use inotify (%s), falling back to polling",
+                        e)
+
+    if watcher is None:
+        watcher = PollingWatcher(path, callback, interval)
+
+    LOG.info("Watching %s with %s", path, watcher.__class__.__name__)
+    watcher.start()
+    return watcher
@@ -0,0 +1,60 @@
+"""Loading and dumping of the yaml files of the input model
+
+The libyaml based loader and dumper are many times faster than the pure
+python ones, so they are used whenever PyYAML has been built with libyaml.
+Otherwise the pure python implementations are used.  Both produce the same
+documents, and dump them identically.
+"""
+import logging
+import yaml
+
+import config.config as config
+
+LOG = logging.getLogger(__name__)
+
+# Map of backend name to (Loader, Dumper)
+BACKENDS = {'python': (yaml.SafeLoader, yaml.SafeDumper)}
+if getattr(yaml, '__with_libyaml__', False):
+    BACKENDS['libyaml'] = (yaml.CSafeLoader, yaml.CSafeDumper)
+
+AUTO = 'auto'
+
+# Backend currently in use, set by set_backend
+backend = None
+_loader = None
+_dumper = None
+
+
+def set_backend(name):
+    """Select the backend by name, or the fastest available one for auto"""
+    global backend, _loader, _dumper
+
+    if name == AUTO:
+        name = 'libyaml' if 'libyaml' in BACKENDS else 'python'
+
+    if name not in BACKENDS:
+        raise ValueError("Unavailable yaml backend %s" % name)
+
+    backend = name
+    _loader, _dumper = BACKENDS[name]
+    LOG.debug("Using %s yaml backend", name)
+
+
+def load(stream):
+    """Parse a yaml document from a string or file, like yaml.safe_load"""
+    return yaml.load(stream, Loader=_loader)
+
+
+def dump(data, stream=None):
+    """Dump data in the block style used for all model files
+
+    If no stream is given, the yaml is returned as a string
+    """
+    return yaml.dump(data, stream,
+                     Dumper=_dumper,
+                     indent=2,
+                     default_flow_style=False,
+                     canonical=False)
+
+
+set_backend(config.get('model', 'yaml_backend'))
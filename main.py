@@ -11,6 +11,7 @@ from ardana_service import versions
 from config import config
 from flask import Flask
 import logging
+import os
 logging.basicConfig(level=logging.DEBUG)
 
 LOG = logging.getLogger(__name__)
@@ -30,4 +31,14 @@ if __name__ == "__main__":
     app.config.from_mapping(config.get_flask_config())
     # app.run(debug=True)
     socketio.init_app(app)
-    socketio.run(app, use_reloader=True)
+
+    # With the reloader, this script also runs in a parent process that
+    # only restarts the serving process when files change; background
+    # services must run in the serving process alone
+    use_reloader = True
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        model.start_live_model()
+        templates.start_catalog()
+        playbooks.start_log_archiver()
+
+    socketio.run(app, use_reloader=use_reloader)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Compare the time taken to plan a model write with that of copying it
+
+Usage: benchmark_write_model.py [num_servers] [iterations]
+
+The servers of the two_passthroughs test model are replicated num_servers
+times, and a dry run of write_model is timed against a deepcopy of the same
+model, which is what writing used to cost before the model was no longer
+copied.
+"""
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ardana_service import model  # noqa: E402
+
+
+def build_model(num_servers):
+    data = model.read_model(os.path.join(
+        os.path.dirname(__file__), '..', 'ardana_service', 'tests',
+        'test_data', 'two_passthroughs'))
+    servers = data['inputModel']['servers']
+    data['inputModel']['servers'] = []
+    for i in range(num_servers):
+        server = copy.deepcopy(servers[i % len(servers)])
+        server['id'] = 'server-%d' % i
+        data['inputModel']['servers'].append(server)
+    return data
+
+
+def main():
+    num_servers = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    data = build_model(num_servers)
+    print("%d servers, %d iterations" % (num_servers, iterations))
+
+    start = time.time()
+    for i in range(iterations):
+        copy.deepcopy(data)
+    copy_time = time.time() - start
+
+    # Write to an empty dir, so that all time is spent in write_model rather
+    # than in reading the existing files
+    temp_dir = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        for i in range(iterations):
+            model.write_model(data, temp_dir, dry_run=True)
+        write_time = time.time() - start
+    finally:
+        shutil.rmtree(temp_dir)
+
+    print("deepcopy    %7.3fs" % copy_time)
+    print("write_model %7.3fs" % write_time)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Compare the speed of the yaml backends on the files of an input model
+
+Usage: benchmark_yaml.py [model_dir] [iterations]
+
+Every yml file below model_dir (by default the model directory of this
+repository) is parsed and dumped with each available backend, and the dumps
+are checked to be identical across backends.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ardana_service import yaml_backend  # noqa: E402
+
+
+def read_files(model_dir):
+    contents = []
+    for root, dirs, files in os.walk(model_dir):
+        for file in sorted(files):
+            if file.endswith('.yml'):
+                with open(os.path.join(root, file)) as f:
+                    contents.append(f.read())
+    return contents
+
+
+def run(contents, iterations):
+    start = time.time()
+    for i in range(iterations):
+        docs = [yaml_backend.load(c) for c in contents]
+    parse_time = time.time() - start
+
+    start = time.time()
+    for i in range(iterations):
+        dumps = [yaml_backend.dump(d) for d in docs]
+    dump_time = time.time() - start
+
+    return parse_time, dump_time, dumps
+
+
+def main():
+    top = os.path.join(os.path.dirname(__file__), '..', 'model')
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else top
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    contents = read_files(model_dir)
+    print("%d files, %d bytes, %d iterations" % (
+        len(contents), sum(len(c) for c in contents), iterations))
+
+    results = {}
+    for name in sorted(yaml_backend.BACKENDS):
+        yaml_backend.set_backend(name)
+        parse_time, dump_time, dumps = run(contents, iterations)
+        results[name] = dumps
+        print("%-8s parse %7.3fs  dump %7.3fs" %
+              (name, parse_time, dump_time))
+
+    if len(set(tuple(d) for d in results.values())) > 1:
+        print("Dumps differ between backends")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())